@@ -0,0 +1,293 @@
+# backend/benchmark_pipeline.py
+# Reproducible throughput/latency benchmark for the OCR pipeline.
+#
+# Runs every page in --images at each --scales resolution through the full
+# process_image_pipeline path with Gemini replaced by a stub (no network, fixed
+# optional latency) and the OCR result and Gemini response caches disabled.
+# Per-stage timings come from pipeline_tracing.PipelineTrace, so the stages match
+# /metrics/pipeline/. Every case records the page size it was given and the size the
+# pipeline actually worked on after its own resize step (OCR_RESIZE_MODE). The fixed
+# mode resizes every page to the same size, so a scale sweep is only accepted with
+# OCR_RESIZE_MODE=adaptive.
+#
+#   OCR_RESIZE_MODE=adaptive python benchmark_pipeline.py --scales 0.5,1.0 --repeats 5 --output bench.json
+#   python benchmark_pipeline.py --baseline bench.json --max-regression 0.15
+#   python benchmark_pipeline.py --synthetic 5x20,10x30,20x40 --images ""   # page-density sweep
+#   python benchmark_pipeline.py --concurrency 1,2,4 --sweep "torch_threads=1,4 opencv_threads=1,4"
+#
+# --concurrency switches to a load test: every page is recognized by that many threads at
+# once (closed loop, like overlapping requests in the OCR executor), for each combination
+# of the --sweep values of resource_config.RUNTIME_SETTINGS, giving pages/s and p50/p95
+# latency per setting and concurrency level.
+#
+# The JSON output records the git commit, library versions and pipeline settings
+# next to the numbers so two runs can be compared; --baseline exits with status 1
+# when end-to-end p50 latency of any case got slower than --max-regression.
+import argparse
+import contextlib
+import glob
+import itertools
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import gemini_clients
+import ocr_pipeline
+from resource_config import RESOURCE_CONFIG, RUNTIME_SETTINGS, apply_runtime_settings
+from pipeline_tracing import PipelineTrace, StageStatistics
+from synthetic_pages import generate_page
+
+IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+RESULTS_FORMAT_VERSION = 1
+
+class _StubGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+class StubGeminiModel:
+    """Stands in for genai.GenerativeModel: echoes the OCR text back after latency_ms"""
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        if self.latency_ms > 0: time.sleep(self.latency_ms / 1000.0)
+        return _StubGeminiResponse(prompt.rsplit("Fix the following OCR output:\n", 1)[-1])
+
+def rss_peak_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct)) if values else 0.0
+
+def git_commit(repo_dir):
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment_info(script_dir):
+    info = {"git_commit": git_commit(script_dir), "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "numpy": np.__version__, "opencv": cv2.__version__}
+    try:
+        import torch
+        info["torch"] = torch.__version__; info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    info["pipeline"] = {
+        "OCR_RESIZE_MODE": ocr_pipeline.OCR_RESIZE_MODE, "VIT_INFERENCE_BACKEND": ocr_pipeline.VIT_INFERENCE_BACKEND,
+        "VIT_BATCH_SIZE": ocr_pipeline.VIT_BATCH_SIZE, "VIT_FAST_PREPROCESS": ocr_pipeline.VIT_FAST_PREPROCESS,
+        "VIT_SCHEDULER_ENABLED": ocr_pipeline.VIT_SCHEDULER_ENABLED, "OCR_LINE_WORKERS": ocr_pipeline.line_worker_count(),
+        "vit_model_version": ocr_pipeline.vit_model_version_g,
+    }
+    info["resources"] = dict(RESOURCE_CONFIG)
+    return info
+
+def load_page(image_path, scale):
+    """Returns the page encoded as PNG bytes at `scale` times its original resolution"""
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None: return None, None
+    if scale != 1.0:
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        img = cv2.resize(img, (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))), interpolation=interpolation)
+    ok, encoded = cv2.imencode(".png", img)
+    return (encoded.tobytes() if ok else None), img.shape[:2]
+
+def pipeline_input_shape(image_bytes):
+    """(h, w) of the page after the pipeline's own resize step, i.e. the resolution segmentation works on"""
+    if ocr_pipeline.OCR_RESIZE_MODE != "adaptive": return ocr_pipeline.TARGET_HEIGHT_FIXED, ocr_pipeline.TARGET_WIDTH_FIXED
+    with contextlib.redirect_stdout(io.StringIO()):
+        resized, _ = ocr_pipeline.resize_adaptive(ocr_pipeline.decode_image_bytes(image_bytes))
+    return resized.shape[:2]
+
+def iter_cases(image_paths, scales, synthetic_densities, seed):
+    """Yields (name, image_bytes, (h, w), letters_truth) for every page/scale and synthetic density"""
+    for image_path in image_paths:
+        for scale in scales:
+            image_bytes, shape = load_page(image_path, scale)
+            yield f"{os.path.basename(image_path)}@{scale:g}", image_bytes, shape, None
+    for num_lines, letters_per_line in synthetic_densities:
+        for scale in scales:
+            page = generate_page(num_lines=num_lines, letters_per_line=letters_per_line, seed=seed,
+                                 width=round(2268 * scale), height=round(3302 * scale))
+            yield f"synthetic-{num_lines}x{letters_per_line}@{scale:g}", page.encode(), page.image.shape[:2], page.letter_count
+
+def run_case(name, image_bytes, repeats, warmup, verbose):
+    """Runs one page `warmup + repeats` times; returns the per-case summary dict"""
+    latencies_ms = []; letter_counts = []; stage_stats = StageStatistics()
+    for run_idx in range(warmup + repeats):
+        trace = PipelineTrace(label=name)
+        output = io.StringIO()
+        with (contextlib.nullcontext() if verbose else contextlib.redirect_stdout(output)):
+            start = time.perf_counter()
+            text = ocr_pipeline.process_image_pipeline(image_bytes, original_filename=name, trace=trace)
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+        trace.finish(stats=stage_stats if run_idx >= warmup else StageStatistics())
+        if text.startswith("Error:"):
+            return {"name": name, "error": text}
+        if run_idx < warmup: continue
+        latencies_ms.append(elapsed_ms)
+        letter_counts.append(next((record.items or 0 for record in trace.stages() if record.name == "segment_letters"), 0))
+
+    total_seconds = sum(latencies_ms) / 1000.0
+    stages = {}
+    for stage_name, entry in stage_stats.snapshot()["stages"].items():
+        stages[stage_name] = {"wall_ms_avg": entry["wall_ms_avg"], "cpu_ms_sum": entry["cpu_ms_sum"], "items_sum": entry["items_sum"]}
+    return {
+        "name": name, "runs": len(latencies_ms), "letters": letter_counts[-1] if letter_counts else 0,
+        "latency_ms": {"p50": round(percentile(latencies_ms, 50), 3), "p95": round(percentile(latencies_ms, 95), 3),
+                       "min": round(min(latencies_ms), 3), "max": round(max(latencies_ms), 3)},
+        "pages_per_sec": round(len(latencies_ms) / total_seconds, 4) if total_seconds else 0.0,
+        "letters_per_sec": round(sum(letter_counts) / total_seconds, 2) if total_seconds else 0.0,
+        "rss_peak_mb": round(rss_peak_mb(), 1),
+        "stages": stages,
+    }
+
+def parse_sweep(text):
+    """"torch_threads=1,4 opencv_threads=1,4" -> [{"torch_threads": 1, "opencv_threads": 1}, ...] (every combination)"""
+    axes = []
+    for part in text.split():
+        name, _, values = part.partition("=")
+        if name not in RUNTIME_SETTINGS: raise ValueError(f"--sweep setting must be one of {', '.join(RUNTIME_SETTINGS)}, got {name!r}")
+        axes.append([(name, int(value)) for value in values.split(",") if value.strip()])
+    return [dict(combination) for combination in itertools.product(*axes)] if axes else [{}]
+
+def run_load(name, image_bytes, concurrency, runs_per_thread, verbose):
+    """Recognizes the page runs_per_thread times on each of `concurrency` threads at once; returns throughput and latency"""
+    def worker(_):
+        latencies_ms = []
+        for _ in range(runs_per_thread):
+            start = time.perf_counter()
+            text = ocr_pipeline.process_image_pipeline(image_bytes, original_filename=name)
+            latencies_ms.append((time.perf_counter() - start) * 1000.0)
+            if text.startswith("Error:"): raise RuntimeError(text)
+        return latencies_ms
+    with (contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())):
+        worker(0) # warm-up at the new thread counts
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            latencies_ms = [latency for thread_latencies in executor.map(worker, range(concurrency)) for latency in thread_latencies]
+            wall_seconds = time.perf_counter() - start
+    return {"concurrency": concurrency, "runs": len(latencies_ms), "pages_per_sec": round(len(latencies_ms) / wall_seconds, 4),
+            "latency_ms": {"p50": round(percentile(latencies_ms, 50), 3), "p95": round(percentile(latencies_ms, 95), 3),
+                           "max": round(max(latencies_ms), 3)}}
+
+def run_sweep(name, image_bytes, settings_list, concurrency_levels, runs_per_thread, verbose):
+    original = {key: RESOURCE_CONFIG[key] for key in RUNTIME_SETTINGS}
+    entries = []
+    try:
+        for settings in settings_list:
+            RESOURCE_CONFIG.update(original); RESOURCE_CONFIG.update(settings)
+            apply_runtime_settings(RESOURCE_CONFIG, ocr_pipeline.torch)
+            effective = {key: RESOURCE_CONFIG[key] for key in RUNTIME_SETTINGS}
+            for concurrency in concurrency_levels:
+                entry = {"name": name, "settings": effective, **run_load(name, image_bytes, concurrency, runs_per_thread, verbose)}
+                entries.append(entry)
+                print(f"  {name} {' '.join(f'{k}={v}' for k, v in effective.items())} x{concurrency}: {entry['pages_per_sec']:.2f} pages/s, "
+                      f"p50 {entry['latency_ms']['p50']:.1f}ms, p95 {entry['latency_ms']['p95']:.1f}ms")
+    finally:
+        RESOURCE_CONFIG.update(original); apply_runtime_settings(RESOURCE_CONFIG, ocr_pipeline.torch)
+    return entries
+
+def compare_with_baseline(results, baseline_path, max_regression):
+    with open(baseline_path, 'r', encoding='utf-8') as f: baseline = json.load(f)
+    baseline_cases = {case["name"]: case for case in baseline.get("cases", []) if "latency_ms" in case}
+    regressions = []
+    print(f"\nComparison with {baseline_path} (commit {baseline.get('environment', {}).get('git_commit')}):")
+    for case in results["cases"]:
+        old = baseline_cases.get(case["name"])
+        if old is None or "latency_ms" not in case: continue
+        ratio = case["latency_ms"]["p50"] / old["latency_ms"]["p50"] if old["latency_ms"]["p50"] else 1.0
+        marker = "❌" if ratio > 1.0 + max_regression else "  "
+        print(f"  {marker} {case['name']}: p50 {old['latency_ms']['p50']:.1f}ms -> {case['latency_ms']['p50']:.1f}ms ({(ratio - 1.0) * 100:+.1f}%)")
+        if ratio > 1.0 + max_regression: regressions.append(case["name"])
+    return regressions
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark OCR pipeline stages and end-to-end throughput (Gemini stubbed).")
+    parser.add_argument("--images", default=os.path.join(script_dir, "test_images"), help="Directory of page images (\"\" for none)")
+    parser.add_argument("--synthetic", default="", help="Comma-separated LINESxLETTERS densities of synthetic pages to add, e.g. 5x20,20x40")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic pages")
+    parser.add_argument("--scales", default=None,
+                        help="Comma-separated resolution factors applied to every page (default 0.5,1.0 with OCR_RESIZE_MODE=adaptive, else 1.0)")
+    parser.add_argument("--repeats", type=int, default=3, help="Measured runs per page and scale")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured runs per page and scale")
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0, help="Simulated latency of the stubbed Gemini call")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", default=None, help="Earlier --output file to compare p50 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed relative p50 slowdown vs. the baseline")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own log output")
+    parser.add_argument("--concurrency", default="", help="Comma-separated numbers of pages recognized at once (load test instead of per-page runs)")
+    parser.add_argument("--sweep", default="", help=f"Space-separated SETTING=V1,V2 lists to combine in the load test ({', '.join(RUNTIME_SETTINGS)})")
+    args = parser.parse_args()
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    settings_list = parse_sweep(args.sweep)
+    if args.sweep and not concurrency_levels: concurrency_levels = [1]
+
+    with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+        ocr_pipeline.load_models()
+    if ocr_pipeline.vit_model_g is None:
+        print("❌ ViT model could not be loaded."); sys.exit(1)
+    ocr_pipeline.gemini_model_g = StubGeminiModel(args.gemini_latency_ms)
+    ocr_pipeline.ocr_result_cache_g = None # every run must do the full work
+    gemini_clients.gemini_response_cache_g = None
+
+    image_paths = sorted(p for ext in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(args.images, ext))) if args.images else []
+    synthetic_densities = [tuple(int(n) for n in d.lower().split("x")) for d in args.synthetic.split(",") if d.strip()]
+    if not image_paths and not synthetic_densities:
+        print(f"❌ No images found in {args.images!r} and no --synthetic densities given"); sys.exit(1)
+    adaptive = ocr_pipeline.OCR_RESIZE_MODE == "adaptive"
+    scales = [float(s) for s in (args.scales or ("0.5,1.0" if adaptive else "1.0")).split(",") if s.strip()]
+    if len(set(scales)) > 1 and not adaptive:
+        print(f"❌ OCR_RESIZE_MODE={ocr_pipeline.OCR_RESIZE_MODE} resizes every page to {ocr_pipeline.TARGET_WIDTH_FIXED}x{ocr_pipeline.TARGET_HEIGHT_FIXED}, "
+              "so every --scales value measures the same work. Use a single scale or OCR_RESIZE_MODE=adaptive."); sys.exit(1)
+
+    results = {"format_version": RESULTS_FORMAT_VERSION, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "environment": environment_info(script_dir),
+               "settings": {"scales": scales, "resize_mode": ocr_pipeline.OCR_RESIZE_MODE, "repeats": args.repeats, "warmup": args.warmup, "gemini_latency_ms": args.gemini_latency_ms,
+                            "synthetic": args.synthetic, "seed": args.seed, "concurrency": concurrency_levels, "sweep": args.sweep},
+               "cases": [], "sweep": []}
+    print(f"Benchmarking {len(image_paths)} page(s) + {len(synthetic_densities)} synthetic density(ies) x {len(scales)} scale(s), {args.repeats} run(s) each...")
+    for name, image_bytes, shape, letters_truth in iter_cases(image_paths, scales, synthetic_densities, args.seed):
+        if image_bytes is None:
+            print(f"  {name}: could not read image"); continue
+        pipeline_shape = pipeline_input_shape(image_bytes)
+        if concurrency_levels:
+            entries = run_sweep(name, image_bytes, settings_list, concurrency_levels, args.repeats, args.verbose)
+            for entry in entries: entry["pipeline_height"], entry["pipeline_width"] = pipeline_shape
+            results["sweep"].extend(entries); continue
+        case = run_case(name, image_bytes, args.repeats, args.warmup, args.verbose)
+        case["height"], case["width"] = shape
+        case["pipeline_height"], case["pipeline_width"] = pipeline_shape
+        if letters_truth is not None: case["letters_truth"] = letters_truth
+        results["cases"].append(case)
+        if "error" in case:
+            print(f"  {name}: {case['error']}"); continue
+        slowest = sorted(case["stages"].items(), key=lambda kv: -kv[1]["wall_ms_avg"])
+        print(f"  {name} ({shape[1]}x{shape[0]} -> {pipeline_shape[1]}x{pipeline_shape[0]}): p50 {case['latency_ms']['p50']:.1f}ms, p95 {case['latency_ms']['p95']:.1f}ms, "
+              f"{case['pages_per_sec']:.2f} pages/s, {case['letters_per_sec']:.0f} letters/s, peak RSS {case['rss_peak_mb']:.0f}MB")
+        print("      " + ", ".join(f"{stage} {entry['wall_ms_avg']:.1f}ms" for stage, entry in slowest if stage != "total"))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            print(f"❌ {len(regressions)} case(s) regressed by more than {args.max_regression * 100:.0f}%"); sys.exit(1)
+        print("✅ No regressions against the baseline")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# backend/check_onnx_parity.py
+# Parity check between the PyTorch ViT and the ONNX Runtime backend.
+#
+# Segments every image in test_images/, classifies all letter crops with both
+# backends and compares the top-1 labels. Exits with status 1 when agreement is
+# below --min-agreement.
+#
+#   python vit_onnx_backend.py                 # export first
+#   python check_onnx_parity.py --min-agreement 0.99
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import ocr_pipeline
+from vit_onnx_backend import OnnxViTClassifier, resolve_onnx_model_path
+
+def collect_letter_crops(image_path):
+    with open(image_path, 'rb') as f: image_bytes = f.read()
+    img_color = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img_color is None: return []
+    img_color = ocr_pipeline.resize_to_fixed(img_color, ocr_pipeline.TARGET_WIDTH_FIXED, ocr_pipeline.TARGET_HEIGHT_FIXED)
+    line_images = ocr_pipeline.segment_image_to_lines(img_color, base_filename=os.path.basename(image_path)) or []
+    crops = []
+    for line_idx, line_img in enumerate(line_images):
+        for item_type, item_data in ocr_pipeline.segment_line_to_items(line_img, line_idx, base_filename=os.path.basename(image_path)):
+            if item_type == 'char' and item_data is not None: crops.append(item_data)
+    return crops
+
+def classify_with(model, crops):
+    ocr_pipeline.vit_model_g = model
+    start = time.perf_counter()
+    results = ocr_pipeline.classify_chars_local_vit_batch(crops)
+    return results, time.perf_counter() - start
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compare top-1 labels of the PyTorch and ONNX ViT backends.")
+    parser.add_argument("--images", default=os.path.join(script_dir, "test_images"), help="Directory of page images")
+    parser.add_argument("--onnx-dir", default=os.path.join(script_dir, "vit-hebrew-final-onnx"), help="Directory with the exported ONNX model(s)")
+    parser.add_argument("--fp32", action="store_true", help="Compare against the fp32 export instead of the int8 one")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="Minimum fraction of matching top-1 labels")
+    args = parser.parse_args()
+
+    # Always load the reference through PyTorch, regardless of VIT_INFERENCE_BACKEND
+    ocr_pipeline.VIT_INFERENCE_BACKEND = "torch"
+    ocr_pipeline.VIT_SCHEDULER_ENABLED = False
+    ocr_pipeline.load_models()
+    torch_model = ocr_pipeline.vit_model_g
+    if torch_model is None:
+        print("❌ PyTorch ViT model could not be loaded."); sys.exit(1)
+    onnx_path = resolve_onnx_model_path(args.onnx_dir, prefer_int8=not args.fp32)
+    if onnx_path is None:
+        print(f"❌ No ONNX model in {args.onnx_dir}. Run vit_onnx_backend.py first."); sys.exit(1)
+    model_dir, _ = ocr_pipeline.resolve_vit_model_path() # the checkpoint load_models just loaded
+    onnx_model = OnnxViTClassifier(onnx_path, model_dir)
+    if dict(onnx_model.config.id2label) != dict(torch_model.config.id2label):
+        print("❌ Label mapping differs between backends."); sys.exit(1)
+
+    image_paths = sorted(p for ext in ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp") for p in glob.glob(os.path.join(args.images, ext)))
+    total_crops = 0; total_matches = 0; torch_seconds = 0.0; onnx_seconds = 0.0
+    for image_path in image_paths:
+        crops = collect_letter_crops(image_path)
+        if not crops: print(f"  {os.path.basename(image_path)}: no letters found"); continue
+        torch_results, torch_time = classify_with(torch_model, crops)
+        onnx_results, onnx_time = classify_with(onnx_model, crops)
+        matches = sum(1 for (t_label, _), (o_label, _) in zip(torch_results, onnx_results) if t_label == o_label)
+        total_crops += len(crops); total_matches += matches; torch_seconds += torch_time; onnx_seconds += onnx_time
+        print(f"  {os.path.basename(image_path)}: {matches}/{len(crops)} top-1 labels match "
+              f"(torch {torch_time * 1000 / len(crops):.2f} ms/letter, onnx {onnx_time * 1000 / len(crops):.2f} ms/letter)")
+    ocr_pipeline.vit_model_g = torch_model
+
+    if total_crops == 0:
+        print("❌ No letter crops found in any test image."); sys.exit(1)
+    agreement = total_matches / total_crops
+    print(f"\nTop-1 agreement: {agreement:.4f} over {total_crops} letters ({os.path.basename(onnx_path)})")
+    print(f"Speedup: {torch_seconds / onnx_seconds:.2f}x" if onnx_seconds > 0 else "Speedup: n/a")
+    if agreement < args.min_agreement:
+        print(f"❌ Agreement below threshold {args.min_agreement}"); sys.exit(1)
+    print("✅ ONNX backend matches PyTorch")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# backend/check_preprocess_parity.py
+# Parity check between the batched letter preprocessing (VIT_FAST_PREPROCESS) and
+# PIL + ViTImageProcessor.
+#
+# Segments every image in test_images/, plus randomized crops of every size between
+# --min-size and --max-size. Both preprocessing paths run on the same crops and must
+# give the same top-1 labels. Exits with status 1 on any changed prediction, or when
+# the pixel values differ by more than --max-pixel-diff.
+#
+#   python check_preprocess_parity.py
+#   python check_preprocess_parity.py --random-cases 500 --seed 7
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+import ocr_pipeline
+from check_onnx_parity import collect_letter_crops
+
+def run_both(crops):
+    results = {}
+    for fast in (False, True):
+        ocr_pipeline.VIT_FAST_PREPROCESS = fast
+        start = time.perf_counter()
+        pixel_values = ocr_pipeline._prepare_vit_batch(crops)
+        preprocess_seconds = time.perf_counter() - start
+        results[fast] = (pixel_values, ocr_pipeline.classify_chars_local_vit_batch(crops), preprocess_seconds)
+    return results[False], results[True]
+
+def random_crops(count, min_size, max_size, seed):
+    rng = np.random.default_rng(seed)
+    crops = []
+    for _ in range(count):
+        height, width = rng.integers(min_size, max_size + 1, size=2)
+        crop = np.full((height, width), 255, dtype=np.uint8) # dark strokes on white, like the segmented letters
+        for _ in range(rng.integers(1, 4)):
+            y0, x0 = rng.integers(0, height), rng.integers(0, width)
+            crop[y0:y0 + rng.integers(1, height + 1), x0:x0 + rng.integers(1, width + 1)] = rng.integers(0, 120)
+        crops.append(crop if rng.random() < 0.7 else np.repeat(crop[:, :, None], 3, axis=2))
+    return crops
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compare top-1 labels of the vectorized and the ViTImageProcessor letter preprocessing.")
+    parser.add_argument("--images", default=os.path.join(script_dir, "test_images"), help="Directory of page images")
+    parser.add_argument("--random-cases", type=int, default=200, help="Randomized crops in addition to the test images")
+    parser.add_argument("--min-size", type=int, default=4)
+    parser.add_argument("--max-size", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-pixel-diff", type=float, default=1e-5, help="Largest allowed difference of a normalized pixel value")
+    args = parser.parse_args()
+
+    ocr_pipeline.VIT_INFERENCE_BACKEND = "torch"
+    ocr_pipeline.VIT_SCHEDULER_ENABLED = False
+    ocr_pipeline.load_models()
+    if ocr_pipeline.vit_model_g is None:
+        print("❌ ViT model could not be loaded."); sys.exit(1)
+
+    image_paths = sorted(p for ext in ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp") for p in glob.glob(os.path.join(args.images, ext)))
+    cases = [(os.path.basename(path), collect_letter_crops(path)) for path in image_paths]
+    if args.random_cases > 0: cases.append((f"{args.random_cases} random crops", random_crops(args.random_cases, args.min_size, args.max_size, args.seed)))
+    total_crops = 0; changed = 0; max_diff = 0.0; slow_seconds = 0.0; fast_seconds = 0.0
+    for name, crops in cases:
+        if not crops: print(f"  {name}: no letters found"); continue
+        (slow_pixels, slow_results, slow_time), (fast_pixels, fast_results, fast_time) = run_both(crops)
+        diff = float((slow_pixels - fast_pixels).abs().max())
+        case_changed = [(i, slow[0], fast[0]) for i, (slow, fast) in enumerate(zip(slow_results, fast_results)) if slow[0] != fast[0]]
+        total_crops += len(crops); changed += len(case_changed); max_diff = max(max_diff, diff)
+        slow_seconds += slow_time; fast_seconds += fast_time
+        print(f"  {name}: {len(crops) - len(case_changed)}/{len(crops)} top-1 labels match, max pixel diff {diff:.2e} "
+              f"(processor {slow_time * 1000 / len(crops):.2f} ms/letter, vectorized {fast_time * 1000 / len(crops):.2f} ms/letter)")
+        for crop_idx, slow_label, fast_label in case_changed[:10]:
+            print(f"    crop {crop_idx} {crops[crop_idx].shape}: {slow_label!r} -> {fast_label!r}")
+
+    if total_crops == 0:
+        print("❌ No letter crops to compare."); sys.exit(1)
+    print(f"\n{changed} changed prediction(s) over {total_crops} letters, max pixel diff {max_diff:.2e}")
+    print(f"Preprocessing speedup: {slow_seconds / fast_seconds:.2f}x" if fast_seconds > 0 else "Speedup: n/a")
+    if changed or max_diff > args.max_pixel_diff:
+        print("❌ Vectorized preprocessing does not match ViTImageProcessor"); sys.exit(1)
+    print("✅ Vectorized preprocessing matches ViTImageProcessor")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+# backend/check_segmentation_parity.py
+# Parity check between the optimized segmentation code in ocr_pipeline and the
+# original reference implementations kept below.
+#
+#   merge  - merge_split_boxes_inline vs. the original all-pairs fixed-point loop,
+#            on the letter boxes of test_images/, synthetic pages of several
+#            densities and randomized box sets (with and without the Lamed guard)
+#   lines  - segment_image_to_lines (vectorized projection-profile run detection)
+#            vs. the original per-row loop, on the same pages at fixed and adaptive
+#            resolution plus randomized synthetic pages; crops must be bit-for-bit equal
+#   boxes  - extract_letter_boxes_components vs. extract_letter_boxes_contours
+#            (LETTER_BOX_EXTRACTOR), on the closed line binaries of the same pages at
+#            fixed and adaptive resolution plus randomized noisy line binaries
+#
+# merge, lines and boxes outputs must be identical (same boxes/crops, same order;
+# boxes in the x order segment_line_to_items sorts them into). Exits with status 1
+# on any difference.
+#
+#   python check_segmentation_parity.py
+#   python check_segmentation_parity.py --random-cases 2000 --seed 7
+import argparse
+import contextlib
+import glob
+import io
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import ocr_pipeline as op
+from synthetic_pages import generate_page
+
+IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+
+# --- Reference implementations (as before the optimization) ---
+def legacy_merge_split_boxes_inline(boxes, avg_char_height, param_scale=None):
+    min_x_overlap_ratio = op.MIN_X_OVERLAP_RATIO_MERGE
+    max_center_x_diff_ratio = op.MAX_CENTER_X_DIFF_RATIO_MERGE
+    if len(boxes) < 2: return boxes
+    merge_line_tolerance = max(op._px(5, param_scale), avg_char_height * 0.5)
+    merged_something_overall = True; current_boxes = list(boxes)
+    merge_iterations = 0; MAX_MERGE_ITERATIONS = 10
+    while merged_something_overall and merge_iterations < MAX_MERGE_ITERATIONS:
+        merged_something_overall = False; processed_indices = set(); next_boxes = []
+        current_boxes.sort(key=lambda b: (b[1], b[0]))
+        indices_to_process = list(range(len(current_boxes)))
+        for i in indices_to_process:
+            if i in processed_indices: continue
+            merged_box_candidate_coords = list(current_boxes[i]); merged_with_indices = {i}
+            for j in range(len(current_boxes)):
+                if i == j or j in processed_indices: continue
+                box2_coords = current_boxes[j]
+                x1, y1, w1, h1 = merged_box_candidate_coords; x2, y2, w2, h2 = box2_coords
+                vertical_distance = max(0, y2 - (y1 + h1), y1 - (y2 + h2)); v_overlap = max(0, min(y1 + h1, y2 + h2) - max(y1, y2))
+                if vertical_distance >= merge_line_tolerance and v_overlap < min(h1,h2) * 0.2: continue
+                overlap_x_start = max(x1, x2); overlap_x_end = min(x1 + w1, x2 + w2); overlap_width = max(0, overlap_x_end - overlap_x_start)
+                min_w_local = min(w1, w2) if w1 > 0 and w2 > 0 else 0; overlap_needed = (min_w_local * min_x_overlap_ratio)
+                has_horizontal_overlap = (overlap_width > overlap_needed) if min_w_local > 0 else (overlap_width > 0)
+                center1_x = x1 + w1 / 2.0; center2_x = x2 + w2 / 2.0; center_x_diff = abs(center1_x - center2_x)
+                max_w_local = max(w1, w2) if w1 > 0 or w2 > 0 else 0; alignment_limit = (max_w_local * max_center_x_diff_ratio)
+                is_center_aligned = (center_x_diff < alignment_limit) if max_w_local > 0 else True
+                if has_horizontal_overlap and is_center_aligned:
+                    prevent_this_merge = False
+                    if op.RTL_ENABLED and op.PREVENT_LAMED_OVERHANG_MERGE:
+                        box_L_coords, box_R_coords = (None, None)
+                        if x1 > x2 : box_L_coords, box_R_coords = merged_box_candidate_coords, box2_coords
+                        elif x2 > x1: box_L_coords, box_R_coords = box2_coords, merged_box_candidate_coords
+                        if box_L_coords and box_R_coords and (box_L_coords[0] > box_R_coords[0]):
+                            xl, yl, wl, hl = box_L_coords; xr, yr, wr, hr = box_R_coords
+                            is_L_taller_shape = hl > (hr * op.LAMED_CANDIDATE_MIN_HEIGHT_RATIO) and wl <= (hl * op.LAMED_CANDIDATE_MAX_WIDTH_RATIO)
+                            if is_L_taller_shape:
+                                lamed_rtl_right_edge = xl - wl
+                                is_R_under_L_span = xr < xl and xr > lamed_rtl_right_edge - wr*0.2
+                                is_R_narrower = wr < wl * 0.8
+                                y_condition = (yr >= yl - hr * 0.3) and (yr < yl + hl * 0.75)
+                                if y_condition and is_R_under_L_span and is_R_narrower :
+                                    if wr > wl * op.EATEN_CHAR_MIN_WIDTH_RATIO_OF_LAMED:
+                                        prevent_this_merge = True
+                    if not prevent_this_merge:
+                        merged_x=min(x1,x2); merged_y=min(y1,y2); merged_w=max(x1+w1,x2+w2)-merged_x; merged_h=max(y1+h1,y2+h2)-merged_y
+                        merged_box_candidate_coords=[merged_x,merged_y,merged_w,merged_h]; merged_with_indices.add(j); merged_something_overall=True
+            next_boxes.append(tuple(merged_box_candidate_coords)); processed_indices.update(merged_with_indices)
+        current_boxes = next_boxes; merge_iterations += 1
+    return current_boxes
+
+def legacy_segment_image_to_lines(img_color_input, param_scale=None):
+    line_crops = []
+    img_color = img_color_input
+    if img_color is None: raise ValueError("Input image is None.")
+    img_height, img_width = img_color.shape[:2]
+    img_gray = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY)
+    _, img_binary_orig = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if param_scale is None: line_kernel_len = max(15, img_width // op.LINE_REMOVAL_KERNEL_LENGTH_DIV)
+    else: line_kernel_len = max(15, op._px(op.TARGET_WIDTH_FIXED // op.LINE_REMOVAL_KERNEL_LENGTH_DIV, param_scale))
+    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (line_kernel_len, 1))
+    img_opened = cv2.morphologyEx(img_binary_orig, cv2.MORPH_OPEN, horizontal_kernel, iterations=1)
+    img_no_lines = cv2.subtract(img_binary_orig, img_opened)
+    img_for_hpp = img_no_lines.copy()
+    if op.VERTICAL_RECONNECT_KERNEL_HEIGHT > 0:
+        reconnect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, op._px(op.VERTICAL_RECONNECT_KERNEL_HEIGHT, param_scale)))
+        img_for_hpp = cv2.morphologyEx(img_for_hpp, cv2.MORPH_CLOSE, reconnect_kernel)
+    horizontal_projection = np.sum(img_for_hpp, axis=1)
+    max_proj_val = np.max(horizontal_projection); threshold = 0
+    if max_proj_val > 0:
+         threshold = max_proj_val * op.PROJECTION_THRESHOLD_RATIO
+    if max_proj_val == 0: return []
+    in_line = False; initial_segments_raw = []; start_y = 0
+    for y in range(img_height):
+        if horizontal_projection[y] > threshold and not in_line: in_line = True; start_y = y
+        elif horizontal_projection[y] <= threshold and in_line:
+            in_line = False; end_y = y
+            if end_y > start_y:
+                initial_segments_raw.append({'start_raw': start_y, 'end_raw': end_y, 'hpp_sum': np.sum(horizontal_projection[start_y:end_y])})
+    if in_line:
+        end_y = img_height
+        if end_y > start_y:
+             initial_segments_raw.append({'start_raw': start_y, 'end_raw': end_y, 'hpp_sum': np.sum(horizontal_projection[start_y:end_y])})
+    if not initial_segments_raw: return []
+    avg_line_height_raw = sum(s['end_raw'] - s['start_raw'] for s in initial_segments_raw) / len(initial_segments_raw) if initial_segments_raw else 30
+    min_sensible_height = max(op._px(8, param_scale), avg_line_height_raw * 0.25)
+    avg_hpp_sum_per_pixel_height = 0
+    if initial_segments_raw:
+        total_hpp_sum_for_avg = sum(s['hpp_sum'] for s in initial_segments_raw)
+        total_height_sum_for_avg = sum(s['end_raw'] - s['start_raw'] for s in initial_segments_raw if (s['end_raw'] - s['start_raw']) > 0)
+        if total_height_sum_for_avg > 0:
+            avg_hpp_sum_per_pixel_height = total_hpp_sum_for_avg / total_height_sum_for_avg
+    min_sensible_hpp_density = avg_hpp_sum_per_pixel_height * op.HPP_DENSITY_FILTER_RATIO
+    filtered_segments = []
+    for seg in initial_segments_raw:
+        height = seg['end_raw'] - seg['start_raw']
+        hpp_density_this_seg = 0
+        if height > 0: hpp_density_this_seg = seg['hpp_sum'] / height
+        passes_height_filter = height >= min_sensible_height
+        passes_density_filter = True
+        if avg_hpp_sum_per_pixel_height > 0.01 : passes_density_filter = hpp_density_this_seg >= min_sensible_hpp_density
+        if passes_height_filter and passes_density_filter:
+            filtered_segments.append(seg)
+    initial_segments = filtered_segments
+    if not initial_segments: return []
+    avg_line_height = sum(s['end_raw'] - s['start_raw'] for s in initial_segments) / len(initial_segments) if initial_segments else 30
+    adjusted_segments = []
+    num_segments = len(initial_segments)
+    for i in range(num_segments):
+        current_seg = initial_segments[i].copy()
+        adjusted_start = current_seg['start_raw']; adjusted_end = current_seg['end_raw']
+        curr_start_raw = current_seg['start_raw']; curr_end_raw = current_seg['end_raw']
+        if i > 0:
+            prev_seg = initial_segments[i-1]; prev_end_raw = prev_seg['end_raw']
+            if curr_start_raw > prev_end_raw: adjusted_start = prev_end_raw + (curr_start_raw - prev_end_raw) // 2
+        if i < num_segments - 1:
+            next_seg = initial_segments[i+1]; next_start_raw = next_seg['start_raw']
+            if next_start_raw > curr_end_raw: adjusted_end = curr_end_raw + (next_start_raw - curr_end_raw) // 2
+        current_seg['start_adj'] = adjusted_start; current_seg['end_adj'] = adjusted_end
+        adjusted_segments.append(current_seg)
+    final_adjusted_segments = []
+    boundary_extension_amount = int(avg_line_height * op.BOUNDARY_EXTEND_RATIO) if avg_line_height > 0 else int(20 * op.BOUNDARY_EXTEND_RATIO)
+    for i, seg in enumerate(adjusted_segments):
+        current_final_seg = seg.copy()
+        final_start, final_end = seg['start_adj'], seg['end_adj']
+        if i == 0: final_start = max(0, seg['start_adj'] - boundary_extension_amount)
+        if i == num_segments - 1: final_end = min(img_height, seg['end_adj'] + boundary_extension_amount)
+        current_final_seg['start_final'] = final_start; current_final_seg['end_final'] = final_end
+        final_adjusted_segments.append(current_final_seg)
+    for i, seg in enumerate(final_adjusted_segments):
+        line_crop_padding = op._px(op.LINE_CROP_PADDING, param_scale, minimum=0)
+        crop_y_start = max(0, seg['start_final'] - line_crop_padding)
+        crop_y_max = min(img_height, seg['end_final'] + line_crop_padding)
+        line_crop = None
+        if crop_y_max > crop_y_start:
+            line_crop = img_gray[crop_y_start:crop_y_max, :]
+            if line_crop.size > 0:
+                line_crops.append(line_crop)
+    return line_crops
+
+
+# --- Inputs ---
+def page_images(images_dir, synthetic_densities):
+    for path in sorted(p for ext in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(images_dir, ext))):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None: yield os.path.basename(path), img
+    for num_lines, letters_per_line in synthetic_densities:
+        yield f"synthetic-{num_lines}x{letters_per_line}", generate_page(num_lines=num_lines, letters_per_line=letters_per_line, seed=num_lines).image
+
+def collect_merge_inputs(images_dir, synthetic_densities):
+    """Runs segmentation on every page and records the arguments of each merge_split_boxes_inline call"""
+    calls = []; original_merge = op.merge_split_boxes_inline
+    def recording_merge(boxes, avg_char_height, param_scale=None):
+        calls.append((list(boxes), avg_char_height, param_scale))
+        return original_merge(boxes, avg_char_height, param_scale=param_scale)
+    op.merge_split_boxes_inline = recording_merge
+    try:
+        for name, img in page_images(images_dir, synthetic_densities):
+            resized = op.resize_to_fixed(img, op.TARGET_WIDTH_FIXED, op.TARGET_HEIGHT_FIXED)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for line_idx, line_img in enumerate(op.segment_image_to_lines(resized, base_filename=name) or []):
+                    op.segment_line_to_items(line_img, line_idx, base_filename=name)
+    finally:
+        op.merge_split_boxes_inline = original_merge
+    return calls
+
+def random_box_set(rng):
+    # Letters along a line plus split parts (dots, strokes) above/below them and tall Lamed-like boxes
+    boxes = []; x = rng.randint(0, 50); line_h = rng.randint(15, 60)
+    for _ in range(rng.randint(2, 60)):
+        w = rng.randint(1, line_h); h = rng.randint(1, int(line_h * 1.8)); y = rng.randint(0, line_h)
+        boxes.append((x, y, w, h))
+        for _ in range(rng.choice([0, 0, 0, 1, 2])):
+            fw = rng.randint(1, max(1, w)); fx = x + rng.randint(-w // 2, max(0, w - fw // 2))
+            boxes.append((fx, max(0, y + rng.randint(-line_h, line_h)), fw, rng.randint(1, max(1, h // 2))))
+        x += w + rng.randint(-w // 2, line_h // 2)
+    rng.shuffle(boxes)
+    boxes.sort(key=lambda b: b[0], reverse=op.RTL_ENABLED)
+    return boxes, max(5, sum(b[3] for b in boxes) / len(boxes))
+
+def stripe_page(rng):
+    # Random ink stripes of random density, including runs touching the top and bottom rows
+    height = rng.randint(50, 1500); width = rng.randint(50, 800)
+    img = np.full((height, width, 3), 255, np.uint8); y = rng.choice([0, rng.randint(0, 40)])
+    while y < height:
+        run = rng.randint(1, 80); fill = rng.random()
+        img[y:y + run, :int(width * fill)] = 0
+        y += run + rng.randint(1, 60)
+    if rng.random() < 0.5: img[-rng.randint(1, 20):, :width // 2] = 0
+    return img
+
+def random_pages(count, rng):
+    for page_idx in range(count):
+        yield f"stripes-{page_idx}", stripe_page(rng)
+        page = generate_page(num_lines=rng.randint(1, 40), letters_per_line=rng.randint(3, 70), width=rng.randint(600, 3000),
+                             height=rng.randint(600, 4000), ruled_lines=rng.random() < 0.5, noise=rng.choice([0.0, 0.02, 0.08]), seed=page_idx)
+        yield f"random-page-{page_idx}", page.image
+
+def compare_lines(pages, label):
+    mismatches = 0; cases = 0; legacy_seconds = 0.0; new_seconds = 0.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, img in pages:
+            variants = [(op.resize_to_fixed(img, op.TARGET_WIDTH_FIXED, op.TARGET_HEIGHT_FIXED), None), op.resize_adaptive(img), (img, None)]
+            for variant_img, param_scale in variants:
+                cases += 1
+                start = time.perf_counter(); expected = legacy_segment_image_to_lines(variant_img, param_scale=param_scale); legacy_seconds += time.perf_counter() - start
+                start = time.perf_counter(); actual = op.segment_image_to_lines(variant_img, base_filename=name, param_scale=param_scale); new_seconds += time.perf_counter() - start
+                same = (expected is None) == (actual is None) and len(expected or []) == len(actual or []) and \
+                       all(e.shape == a.shape and np.array_equal(e, a) for e, a in zip(expected or [], actual or []))
+                if not same:
+                    mismatches += 1
+                    print(f"    mismatch {name} ({variant_img.shape[1]}x{variant_img.shape[0]}): {len(expected or [])} vs {len(actual or [])} lines", file=sys.stderr)
+    speedup = f"{legacy_seconds / new_seconds:.2f}x" if new_seconds > 0 else "n/a"
+    print(f"  lines [{label}]: {cases - mismatches}/{cases} identical, legacy {legacy_seconds * 1000:.1f}ms vs {new_seconds * 1000:.1f}ms ({speedup})")
+    return mismatches
+
+def line_binaries(pages):
+    for name, img in pages:
+        for variant_img, param_scale in ((op.resize_to_fixed(img, op.TARGET_WIDTH_FIXED, op.TARGET_HEIGHT_FIXED), None), op.resize_adaptive(img)):
+            kernel_size = op._px(op.MORPH_KERNEL_SIZE_LETTERS, param_scale)
+            with contextlib.redirect_stdout(io.StringIO()):
+                line_images = op.segment_image_to_lines(variant_img, base_filename=name, param_scale=param_scale) or []
+            for line_img in line_images:
+                _, line_binary = cv2.threshold(line_img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+                yield name, cv2.morphologyEx(line_binary, cv2.MORPH_CLOSE, np.ones((kernel_size, kernel_size), np.uint8)), param_scale
+
+def random_line_binaries(count, rng):
+    # Ink noise of random density, closed like the line binaries: touching blobs, holes and blobs inside holes
+    for case_idx in range(count):
+        height = rng.randint(3, 120); width = rng.randint(3, 1500)
+        binary = ((np.random.default_rng(case_idx).random((height, width)) < rng.uniform(0.05, 0.7)) * 255).astype(np.uint8)
+        if rng.random() < 0.5: binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((rng.randint(2, 4),) * 2, np.uint8))
+        yield f"random-line-{case_idx}", binary, rng.choice([None, 0.5, 1.7])
+
+def compare_extractors(cases, label):
+    mismatches = 0; total = 0; contour_seconds = 0.0; component_seconds = 0.0
+    for name, line_binary, param_scale in cases:
+        total += 1; line_h = line_binary.shape[0]
+        start = time.perf_counter(); expected = op.extract_letter_boxes_contours(line_binary, line_h, param_scale=param_scale); contour_seconds += time.perf_counter() - start
+        start = time.perf_counter(); actual = op.extract_letter_boxes_components(line_binary, line_h, param_scale=param_scale); component_seconds += time.perf_counter() - start
+        expected.sort(key=lambda b: b[0], reverse=op.RTL_ENABLED); actual.sort(key=lambda b: b[0], reverse=op.RTL_ENABLED)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 3: print(f"    mismatch {name} ({line_binary.shape[1]}x{line_h}): {sorted(set(expected) ^ set(actual))[:6]}")
+    speedup = f"{contour_seconds / component_seconds:.2f}x" if component_seconds > 0 else "n/a"
+    print(f"  boxes [{label}]: {total - mismatches}/{total} lines identical, contours {contour_seconds * 1000:.1f}ms vs components {component_seconds * 1000:.1f}ms ({speedup})")
+    return mismatches
+
+def compare_merge(cases, label):
+    mismatches = 0; legacy_seconds = 0.0; new_seconds = 0.0
+    for boxes, avg_char_height, param_scale in cases:
+        start = time.perf_counter(); expected = legacy_merge_split_boxes_inline(list(boxes), avg_char_height, param_scale); legacy_seconds += time.perf_counter() - start
+        start = time.perf_counter(); actual = op.merge_split_boxes_inline(list(boxes), avg_char_height, param_scale=param_scale); new_seconds += time.perf_counter() - start
+        if [tuple(b) for b in expected] != [tuple(b) for b in actual]:
+            mismatches += 1
+            if mismatches <= 3: print(f"    mismatch ({len(boxes)} boxes): expected {expected[:6]}... got {actual[:6]}...")
+    speedup = f"{legacy_seconds / new_seconds:.1f}x" if new_seconds > 0 else "n/a"
+    print(f"  merge [{label}]: {len(cases) - mismatches}/{len(cases)} identical, legacy {legacy_seconds * 1000:.1f}ms vs {new_seconds * 1000:.1f}ms ({speedup})")
+    return mismatches
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Check optimized segmentation against the reference implementations.")
+    parser.add_argument("--images", default=os.path.join(script_dir, "test_images"), help="Directory of page images")
+    parser.add_argument("--synthetic", default="10x30,30x50,40x80", help="LINESxLETTERS densities of synthetic pages to include")
+    parser.add_argument("--random-cases", type=int, default=500, help="Randomized box sets per Lamed-guard setting")
+    parser.add_argument("--random-pages", type=int, default=20, help="Randomized synthetic pages for the line segmentation check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    synthetic_densities = [tuple(int(n) for n in d.lower().split("x")) for d in args.synthetic.split(",") if d.strip()]
+
+    failures = 0
+    failures += compare_lines(page_images(args.images, synthetic_densities), "pages")
+    failures += compare_lines(random_pages(args.random_pages, random.Random(args.seed)), "random pages")
+    failures += compare_extractors(line_binaries(page_images(args.images, synthetic_densities)), "page lines")
+    failures += compare_extractors(random_line_binaries(args.random_cases, random.Random(args.seed)), "random lines")
+    page_cases = collect_merge_inputs(args.images, synthetic_densities)
+    failures += compare_merge(page_cases, f"page lines ({len(page_cases)})")
+    rng = random.Random(args.seed)
+    for guard in (True, False):
+        op.PREVENT_LAMED_OVERHANG_MERGE = guard
+        random_cases = [random_box_set(rng) + (rng.choice([None, 0.5, 1.7]),) for _ in range(args.random_cases)]
+        failures += compare_merge(random_cases, f"random, lamed guard {'on' if guard else 'off'}")
+
+    if failures:
+        print(f"❌ {failures} case(s) differ from the reference implementation"); sys.exit(1)
+    print("✅ Optimized segmentation matches the reference implementation")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# backend/gemini_clients.py
+# Shared Gemini client registry for OCR correction (ocr_pipeline) and /enhance-text/ (text_enhancement).
+#
+#   configure_gemini()                                   # once per process (per API key)
+#   model = get_gemini_model("gemini-1.5-flash", {"temperature": 0.3, ...})
+#   model.generate_content(prompt)
+#
+# google.generativeai is imported by the first configure_gemini() call, not at import
+# time (it adds about a second to startup). genai.configure() resets the SDK's cached
+# transport clients, so it is only called when the key actually changes; every
+# GenerativeModel then reuses the same gRPC channel. Models are created lazily and cached by (model name, generation config).
+# warm_up_gemini_models*() opens the channels (and the async client on the server's
+# event loop) with a count_tokens call, so the first request does not pay for it.
+#
+# Responses are cached (memory LRU + optional disk tier, with a TTL) under
+# gemini_cache_key(operation, model, generation config, prompt version, text, options),
+# so repeated text/options never reach the API.
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+from result_cache import TieredCache, hash_key
+
+GEMINI_WARMUP = os.environ.get("GEMINI_WARMUP", "true").lower() in ("1", "true", "yes")
+GEMINI_WARMUP_TEXT = "שלום"
+GEMINI_WARMUP_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_WARMUP_TIMEOUT_SECONDS", "10"))
+
+# --- Response Cache Configuration ---
+GEMINI_CACHE_ENABLED = os.environ.get("GEMINI_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "512"))
+GEMINI_CACHE_DIR = os.environ.get("GEMINI_CACHE_DIR", "")
+GEMINI_CACHE_MAX_DISK_MB = float(os.environ.get("GEMINI_CACHE_MAX_DISK_MB", "64"))
+GEMINI_CACHE_TTL_SECONDS = float(os.environ.get("GEMINI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+gemini_response_cache_g = TieredCache(GEMINI_CACHE_MAX_ENTRIES, GEMINI_CACHE_DIR or None, int(GEMINI_CACHE_MAX_DISK_MB * 1024 * 1024),
+                                      ttl_seconds=GEMINI_CACHE_TTL_SECONDS) if GEMINI_CACHE_ENABLED else None
+
+_lock = threading.Lock()
+genai = None # google.generativeai, imported by configure_gemini()
+_configured_api_key: Optional[str] = None
+_models: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], Any] = {}
+
+def _config_key(generation_config: Optional[Dict[str, Any]]) -> Tuple[Tuple[str, Any], ...]:
+    return tuple(sorted((generation_config or {}).items()))
+
+def configure_gemini(api_key: Optional[str] = None) -> bool:
+    """Configures the SDK with api_key (default: GEMINI_API_KEY); a no-op when that key is already configured"""
+    global _configured_api_key, genai
+    api_key = api_key if api_key is not None else os.getenv("GEMINI_API_KEY")
+    if not api_key: return False
+    with _lock:
+        if api_key == _configured_api_key: return True
+        if genai is None:
+            import google.generativeai as genai_module
+            genai = genai_module
+        genai.configure(api_key=api_key)
+        # Models created under the previous key hold clients from the reset client manager
+        _configured_api_key = api_key; _models.clear()
+    return True
+
+def gemini_configured() -> bool:
+    return _configured_api_key is not None
+
+def get_gemini_model(model_name: str, generation_config: Optional[Dict[str, Any]] = None):
+    """Cached genai.GenerativeModel for (model_name, generation_config); configures from the environment on first use"""
+    key = (model_name, _config_key(generation_config))
+    model = _models.get(key)
+    if model is not None: return model
+    if not gemini_configured() and not configure_gemini():
+        raise RuntimeError("GEMINI_API_KEY is not configured")
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            config = genai.types.GenerationConfig(**generation_config) if generation_config else None
+            model = genai.GenerativeModel(model_name, generation_config=config)
+            _models[key] = model
+            print(f"[Gemini Clients] Created model {model_name} {dict(key[1]) or ''}".rstrip())
+    return model
+
+def registered_models() -> List[Dict[str, Any]]:
+    with _lock:
+        return [{"model": name, "generation_config": dict(config)} for name, config in _models]
+
+def _warm_up_targets(specs):
+    if not gemini_configured() and not configure_gemini(): return []
+    return [(spec[0], get_gemini_model(*spec)) for spec in specs]
+
+def warm_up_gemini_models(specs: List[Tuple[str, Optional[Dict[str, Any]]]]) -> int:
+    """Creates the models for specs [(model_name, generation_config), ...] and opens the sync channel; returns how many warmed up"""
+    warmed = 0
+    for model_name, model in _warm_up_targets(specs):
+        start = time.perf_counter()
+        try:
+            model.count_tokens(GEMINI_WARMUP_TEXT, request_options={"timeout": GEMINI_WARMUP_TIMEOUT_SECONDS}); warmed += 1
+            print(f"[Gemini Clients] Warmed up {model_name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+        except Exception as e:
+            print(f"[Gemini Clients] Warm-up of {model_name} failed: {e}")
+    return warmed
+
+async def warm_up_gemini_models_async(specs: List[Tuple[str, Optional[Dict[str, Any]]]]) -> int:
+    """Async variant; run it on the serving event loop so the async gRPC client is bound to that loop"""
+    warmed = 0
+    for model_name, model in _warm_up_targets(specs):
+        start = time.perf_counter()
+        try:
+            await model.count_tokens_async(GEMINI_WARMUP_TEXT, request_options={"timeout": GEMINI_WARMUP_TIMEOUT_SECONDS}); warmed += 1
+            print(f"[Gemini Clients] Warmed up {model_name} (async) in {(time.perf_counter() - start) * 1000:.0f}ms")
+        except Exception as e:
+            print(f"[Gemini Clients] Async warm-up of {model_name} failed: {e}")
+    return warmed
+
+# === RESPONSE CACHE ===
+def normalize_cache_text(text: str) -> str:
+    # NFC, no trailing spaces, single spaces within lines, no leading/trailing blank lines; line breaks are kept
+    text = unicodedata.normalize("NFC", text or "")
+    lines = [re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.splitlines()]
+    return "\n".join(lines).strip()
+
+def gemini_cache_key(operation: str, model_name: str, generation_config: Optional[Dict[str, Any]], prompt_version: str,
+                     text: str, options: Optional[Dict[str, Any]] = None) -> str:
+    return hash_key("gemini", operation, model_name, _config_key(generation_config), prompt_version, normalize_cache_text(text), options or {})
+
+def cached_gemini_response(cache_key: str) -> Optional[str]:
+    if gemini_response_cache_g is None: return None
+    entry = gemini_response_cache_g.get(cache_key)
+    return entry["text"] if entry is not None else None
+
+def store_gemini_response(cache_key: str, text: Optional[str]):
+    # Empty responses are not cached so the call is retried next time
+    if gemini_response_cache_g is None or not text: return
+    gemini_response_cache_g.put(cache_key, {"text": text})
+
+def gemini_cache_stats() -> Dict[str, Any]:
+    return gemini_response_cache_g.stats() if gemini_response_cache_g is not None else {"enabled": False}
@@ -1,18 +1,29 @@
 # backend/main.py - DEBUG VERSION
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import uvicorn
 import traceback
 import os
 import base64
+import zipfile
+import asyncio
+import json
+import time
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import io
 
 # Import your processing pipeline function from ocr_pipeline.py
 try:
-    from ocr_pipeline import process_image_pipeline, load_models
+    from ocr_pipeline import (recognize_image_text_cached, iter_recognized_lines, recognize_images_batch,
+                              correct_text_gemini_with_status_async, store_cached_result, ocr_cache_stats, load_models)
+    from pipeline_tracing import PipelineTrace, PIPELINE_STAGE_STATS
+    import ocr_pipeline
     print("✅ OCR pipeline imported successfully")
 except ImportError as e:
     print(f"❌ FATAL ERROR: Could not import from ocr_pipeline.py: {e}")
@@ -20,16 +31,25 @@ except ImportError as e:
     import sys
     sys.exit(1)
 
+from service_metrics import METRICS
+from resource_config import RESOURCE_CONFIG
+from ocr_jobs import OcrJobStore, OcrJobWorkers, JOB_QUEUED
+
 # Import text enhancement functions with DETAILED error handling
 text_enhancement_available = False
 text_enhancement_error = "Not attempted"
 try:
-    print("🔍 Attempting to import google.generativeai...")
-    import google.generativeai as genai
-    print("✅ google.generativeai imported successfully")
+    # The SDK itself is imported on first use by gemini_clients; only check that it is installed
+    print("🔍 Checking for google.generativeai...")
+    if importlib.util.find_spec("google.generativeai") is None:
+        raise ImportError("No module named 'google.generativeai'")
+    print("✅ google.generativeai is installed")
     
     print("🔍 Attempting to import text_enhancement module...")
-    from text_enhancement import initialize_gemini, enhance_text_with_gemini, parse_gemini_response
+    from text_enhancement import (initialize_gemini, enhance_text_with_gemini, parse_gemini_response,
+                                  ENHANCEMENT_MODEL_NAME, ENHANCEMENT_GENERATION_CONFIG)
+    from gemini_clients import (GEMINI_WARMUP, gemini_configured, registered_models, warm_up_gemini_models, warm_up_gemini_models_async,
+                                gemini_cache_stats)
     text_enhancement_available = True
     text_enhancement_error = "Success"
     print("✅ Text enhancement module imported successfully")
@@ -48,6 +68,116 @@ except Exception as e:
 
 app = FastAPI(title="Digi-Ktav OCR & Enhancement API", version="1.0.0")
 
+# --- OCR Concurrency Configuration ---
+# The CPU-bound part of the pipeline runs in a bounded thread pool so the event loop
+# (and /health/) stays responsive. Requests beyond running + queued slots get a 503.
+OCR_MAX_CONCURRENCY = RESOURCE_CONFIG["ocr_executor_workers"] # OCR_MAX_CONCURRENCY, see resource_config.py
+OCR_MAX_QUEUE = max(0, int(os.getenv("OCR_MAX_QUEUE", "8")))
+OCR_RETRY_AFTER_SECONDS = os.getenv("OCR_RETRY_AFTER_SECONDS", "5")
+# Batch endpoint limits (a zip counts with the images inside it)
+OCR_BATCH_MAX_FILES = max(1, int(os.getenv("OCR_BATCH_MAX_FILES", "50")))
+# Per-request byte budget: uploaded images plus the expanded size of zip members
+OCR_BATCH_MAX_BYTES = int(float(os.getenv("OCR_BATCH_MAX_MB", "200")) * 1024 * 1024)
+BATCH_UPLOAD_CHUNK_BYTES = 1024 * 1024
+OCR_BATCH_GEMINI_CONCURRENCY = max(1, int(os.getenv("OCR_BATCH_GEMINI_CONCURRENCY", "4")))
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_MAX_CONCURRENCY, thread_name_prefix="ocr-pipeline")
+ocr_requests_in_flight = 0
+
+# --- Async OCR Job Configuration ---
+# Submitted jobs are persisted in SQLite and drained by OCR_JOB_WORKERS background tasks,
+# which share the OCR executor with the synchronous endpoints.
+OCR_JOB_DB = os.getenv("OCR_JOB_DB", "./ocr_jobs.sqlite3")
+OCR_JOB_WORKERS = max(1, int(os.getenv("OCR_JOB_WORKERS", "2")))
+OCR_JOB_TTL_SECONDS = float(os.getenv("OCR_JOB_TTL_SECONDS", str(24 * 3600)))
+OCR_JOB_MAX_ATTEMPTS = max(1, int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "3")))
+OCR_JOB_STALE_SECONDS = float(os.getenv("OCR_JOB_STALE_SECONDS", "1800"))
+OCR_JOB_MAX_QUEUED = max(1, int(os.getenv("OCR_JOB_MAX_QUEUED", "1000")))
+ocr_job_store: Optional[OcrJobStore] = None
+ocr_job_workers: Optional[OcrJobWorkers] = None
+gemini_warmup_task: Optional[asyncio.Task] = None
+
+# --- Startup / Readiness ---
+# Liveness (/health/live, /health/) answers as soon as the server is up; readiness
+# (/health/ready) only once the models are loaded and the warm-up inference has run.
+# With OCR_BACKGROUND_WARMUP the server accepts connections immediately and OCR
+# endpoints answer 503 until it is ready; otherwise startup blocks as before.
+OCR_BACKGROUND_WARMUP = os.getenv("OCR_BACKGROUND_WARMUP", "false").lower() in ("1", "true", "yes")
+OCR_WARMUP_INFERENCE = os.getenv("OCR_WARMUP_INFERENCE", "true").lower() in ("1", "true", "yes")
+ocr_ready = False
+ocr_startup_state = "starting" # starting -> loading_models -> warming_up -> ready | failed
+ocr_startup_error: Optional[str] = None
+ocr_startup_task: Optional[asyncio.Task] = None
+
+# --- Metrics ---
+HTTP_REQUESTS = METRICS.counter("http_requests_total", "HTTP requests by route, method and status", ["route", "method", "status"])
+HTTP_REQUEST_SECONDS = METRICS.histogram("http_request_duration_seconds", "HTTP request latency by route", ["route", "method"])
+HTTP_IN_FLIGHT = METRICS.gauge("http_requests_in_flight", "HTTP requests currently being served")
+OCR_EXECUTOR_QUEUED = METRICS.gauge("ocr_executor_queue_depth", "OCR jobs waiting for an executor thread")
+OCR_EXECUTOR_ACTIVE = METRICS.gauge("ocr_executor_active_jobs", "OCR jobs currently running in the executor")
+OCR_REJECTED = METRICS.counter("ocr_requests_rejected_total", "OCR requests rejected with 503 because the queue was full")
+METRICS.gauge("ocr_executor_max_workers", "Size of the OCR executor", callback=lambda: [({}, OCR_MAX_CONCURRENCY)])
+METRICS.gauge("ocr_requests_in_flight", "Admitted OCR requests and running async jobs (queued, running or awaiting Gemini)", callback=lambda: [({}, ocr_requests_in_flight)])
+METRICS.gauge("model_loaded", "Whether a model is loaded (1) or not (0)", ["model"], callback=lambda: [
+    ({"model": "vit"}, 1 if ocr_pipeline.vit_model_g is not None else 0),
+    ({"model": "gemini_correction"}, 1 if ocr_pipeline.gemini_model_g is not None else 0),
+    ({"model": "text_enhancement"}, 1 if text_enhancement_available and os.getenv('GEMINI_API_KEY') else 0),
+])
+METRICS.counter("ocr_cache_events_total", "OCR result cache events since startup", ["event"], callback=lambda: [
+    ({"event": event}, value) for event, value in ocr_cache_stats().items() if event in ("memory_hits", "disk_hits", "misses", "stores")
+])
+METRICS.counter("gemini_cache_events_total", "Gemini response cache events since startup", ["event"], callback=lambda: [
+    ({"event": event}, value) for event, value in (gemini_cache_stats().items() if text_enhancement_available else [])
+    if event in ("memory_hits", "disk_hits", "misses", "stores", "expired")
+])
+METRICS.gauge("ocr_jobs", "Async OCR jobs in the job store by status", ["status"], callback=lambda: [
+    ({"status": status}, count) for status, count in (ocr_job_store.counts().items() if ocr_job_store is not None else [])
+])
+METRICS.add_collector(lambda: PIPELINE_STAGE_STATS.prometheus_lines())
+
+def _tracked_ocr_job(fn, *args):
+    OCR_EXECUTOR_QUEUED.dec(); OCR_EXECUTOR_ACTIVE.inc()
+    try:
+        return fn(*args)
+    finally:
+        OCR_EXECUTOR_ACTIVE.dec()
+
+async def run_in_ocr_executor(fn, *args):
+    """Runs fn(*args) in the OCR executor, keeping the queue depth / active job gauges current"""
+    OCR_EXECUTOR_QUEUED.inc()
+    future = ocr_executor.submit(_tracked_ocr_job, fn, *args)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        if future.cancel(): OCR_EXECUTOR_QUEUED.dec()
+        raise
+
+async def run_ocr(image_bytes: bytes, filename: str, trace: PipelineTrace) -> Optional[str]:
+    """Recognition in the OCR executor, then Gemini correction and caching; shared by /process-image/ and the job workers"""
+    cache_key, recognized_text, cache_hit = await run_in_ocr_executor(recognize_image_text_cached, image_bytes, filename, trace)
+    if not cache_hit and isinstance(recognized_text, str) and not recognized_text.startswith("Error:"):
+        with trace.stage("gemini_correction"):
+            recognized_text, correction_failed = await correct_text_gemini_with_status_async(recognized_text)
+        store_cached_result(cache_key, recognized_text, correction_failed)
+    trace.finish()
+    print(f"⏱️ OCR timings for {filename}: {trace.summary()} (total {trace.total_ms:.0f}ms)")
+    return recognized_text
+
+def admit_ocr_job() -> bool:
+    # Job workers take their slot from the same admission limit as the synchronous requests
+    global ocr_requests_in_flight
+    if ocr_requests_in_flight >= OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE: return False
+    ocr_requests_in_flight += 1
+    return True
+
+def release_ocr_job():
+    global ocr_requests_in_flight
+    ocr_requests_in_flight -= 1
+
+async def process_ocr_job(job):
+    trace = PipelineTrace(label=job["filename"])
+    recognized_text = await run_ocr(job["image"], job["filename"], trace)
+    return recognized_text, trace.to_dict()
+
 # --- CORS Configuration ---
 origins = [
     "http://localhost:5173",    # Your local React dev server (Vite)
@@ -87,21 +217,75 @@ class ImageCompressionResponse(BaseModel):
     compressed_size_kb: Optional[float] = None
     error: Optional[str] = None
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    HTTP_IN_FLIGHT.inc()
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        HTTP_REQUESTS.inc(route=route_path, method=request.method, status=str(status_code))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_time, route=route_path, method=request.method)
+        HTTP_IN_FLIGHT.dec()
+
 # --- Load models on startup ---
 @app.on_event("startup")
 async def startup_event():
     print("🚀 FastAPI server starting up...")
-    
-    # Initialize OCR models
-    if not load_models():
-        print("⚠️ CRITICAL WARNING: OCR model initialization failed during startup!")
+
+    # The job store and its workers start right away so jobs can be queued while the models load;
+    # the workers only claim jobs once the service is ready. Jobs interrupted by a previous shutdown are re-queued first
+    global ocr_job_store, ocr_job_workers, ocr_startup_task
+    try:
+        ocr_job_store = OcrJobStore(OCR_JOB_DB, ttl_seconds=OCR_JOB_TTL_SECONDS, max_attempts=OCR_JOB_MAX_ATTEMPTS,
+                                    stale_after_s=OCR_JOB_STALE_SECONDS)
+        ocr_job_workers = OcrJobWorkers(ocr_job_store, process_ocr_job, num_workers=OCR_JOB_WORKERS,
+                                        admit=admit_ocr_job, release=release_ocr_job)
+        await asyncio.to_thread(ocr_job_store.requeue_interrupted, ocr_job_workers.worker_prefix)
+        ocr_job_workers.start(ready=False)
+    except Exception as e:
+        ocr_job_store = None; ocr_job_workers = None
+        print(f"❌ Could not start the OCR job queue: {e}")
+        traceback.print_exc()
+
+    if OCR_BACKGROUND_WARMUP:
+        print("⏳ Loading models in the background; /health/ready reports when OCR is ready")
+        ocr_startup_task = asyncio.create_task(prepare_ocr_service())
     else:
-        print("✅ OCR model initialization complete")
-    
+        await prepare_ocr_service()
+
+async def prepare_ocr_service():
+    """Loads the models off the event loop, runs the warm-up inference, then releases the job workers and marks the service ready"""
+    global ocr_ready, ocr_startup_state, ocr_startup_error, gemini_warmup_task
+    startup_start = time.perf_counter()
+    try:
+        # Initialize OCR models
+        ocr_startup_state = "loading_models"
+        if not await asyncio.to_thread(load_models):
+            print("⚠️ CRITICAL WARNING: OCR model initialization failed during startup!")
+        else:
+            print("✅ OCR model initialization complete")
+        if ocr_pipeline.vit_model_g is None:
+            raise RuntimeError("ViT model is not loaded")
+    except Exception as e:
+        ocr_startup_state = "failed"; ocr_startup_error = str(e)
+        print(f"❌ OCR service is not ready: {e}")
+        # Nothing will run the queued jobs, so they fail instead of staying queued forever
+        if ocr_job_store is not None:
+            failed = await asyncio.to_thread(ocr_job_store.fail_queued, f"Error: OCR service failed to start: {e}")
+            if failed: print(f"❌ Failed {failed} queued OCR job(s)")
+
     # Initialize Gemini for text enhancement
     if text_enhancement_available:
         try:
-            if not initialize_gemini():
+            if not await asyncio.to_thread(initialize_gemini):
                 print("⚠️ WARNING: Gemini initialization failed. Text enhancement will not work.")
             else:
                 print("✅ Gemini API initialized for text enhancement")
@@ -110,6 +294,59 @@ async def startup_event():
     else:
         print(f"⚠️ Text enhancement module not available. Error: {text_enhancement_error}")
 
+    # Open the Gemini connections in the background: OCR correction awaits the async client,
+    # /enhance-text/ calls the sync client from a worker thread
+    if text_enhancement_available and GEMINI_WARMUP and gemini_configured():
+        gemini_warmup_task = asyncio.create_task(warm_up_gemini_clients())
+
+    # Without OCR the server stays up for /enhance-text/ and reports not ready
+    if ocr_startup_state == "failed": return
+
+    # A dummy page through segmentation + ViT, so the first request does not pay for kernel initialization
+    if OCR_WARMUP_INFERENCE:
+        ocr_startup_state = "warming_up"
+        try:
+            await asyncio.to_thread(ocr_pipeline.warm_up_pipeline)
+        except Exception as e:
+            print(f"⚠️ Warm-up inference failed: {e}")
+            traceback.print_exc()
+
+    # Let the job workers claim jobs
+    if ocr_job_workers is not None:
+        ocr_job_workers.set_ready()
+        print(f"✅ OCR job queue ready ({OCR_JOB_DB})")
+
+    ocr_ready = True; ocr_startup_state = "ready"
+    print(f"✅ OCR service ready ({(time.perf_counter() - startup_start) * 1000:.0f}ms after startup began)")
+
+def require_ocr_ready():
+    if not ocr_ready:
+        raise HTTPException(
+            status_code=503,
+            detail=f"OCR service is not ready yet ({ocr_startup_state}). Please retry shortly.",
+            headers={"Retry-After": OCR_RETRY_AFTER_SECONDS}
+        )
+
+async def warm_up_gemini_clients():
+    try:
+        warmed = await warm_up_gemini_models_async([(ocr_pipeline.GEMINI_CORRECTION_MODEL_NAME, None)]) if ocr_pipeline.gemini_model_g is not None else 0
+        warmed += await asyncio.to_thread(warm_up_gemini_models, [(ENHANCEMENT_MODEL_NAME, ENHANCEMENT_GENERATION_CONFIG)])
+        print(f"✅ Gemini clients warmed up ({warmed} model(s))")
+    except Exception as e:
+        print(f"⚠️ Gemini warm-up failed: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if ocr_startup_task is not None and not ocr_startup_task.done():
+        ocr_startup_task.cancel()
+    if gemini_warmup_task is not None and not gemini_warmup_task.done():
+        gemini_warmup_task.cancel()
+    if ocr_job_workers is not None:
+        await ocr_job_workers.stop()
+    if ocr_job_store is not None:
+        ocr_job_store.close()
+    ocr_executor.shutdown(wait=False, cancel_futures=True)
+
 # --- Helper Functions ---
 def compress_image_data(image_data: str, max_size_kb: int = 800, max_dimension: int = 1200) -> tuple:
     """
@@ -183,9 +420,17 @@ async def root():
         "gemini_api_key_configured": bool(os.getenv('GEMINI_API_KEY')),
         "endpoints": {
             "ocr": "/process-image/ (POST)",
+            "ocr_stream": "/process-image/stream/ (POST, Server-Sent Events)",
+            "ocr_batch": "/process-images/batch/ (POST, multiple images and/or zip archives)",
+            "ocr_job_submit": "/jobs/ (POST, returns a job id)",
+            "ocr_job_status": "/jobs/{job_id} (GET)",
             "text_enhancement": "/enhance-text/ (POST)",
             "image_compression": "/compress-image/ (POST)",
             "health": "/health/ (GET)",
+            "liveness": "/health/live (GET)",
+            "readiness": "/health/ready (GET, 503 until the models are loaded and warmed up)",
+            "metrics": "/metrics (GET, Prometheus text format)",
+            "pipeline_metrics": "/metrics/pipeline/ (GET)",
             "debug": "/debug/ (GET)"
         }
     }
@@ -220,21 +465,55 @@ async def debug_info():
     
     return debug_info
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: the process is up and the event loop responds"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: models loaded and warmed up; 503 until then"""
+    body = {"ready": ocr_ready, "state": ocr_startup_state, "vit_loaded": ocr_pipeline.vit_model_g is not None}
+    if ocr_startup_error: body["error"] = ocr_startup_error
+    if not ocr_ready:
+        return JSONResponse(status_code=503, content=body, headers={"Retry-After": OCR_RETRY_AFTER_SECONDS})
+    return body
+
 @app.get("/health/")
 async def health_check():
     return {
         "status": "healthy",
-        "ocr_available": True,
+        "ready": ocr_ready,
+        "startup_state": ocr_startup_state,
+        "ocr_available": ocr_ready,
+        "ocr_in_flight": ocr_requests_in_flight,
+        "ocr_capacity": OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE,
+        "ocr_cache": ocr_cache_stats(),
+        "resources": RESOURCE_CONFIG,
+        "ocr_jobs": await asyncio.to_thread(ocr_job_store.counts) if ocr_job_store is not None else None,
         "text_enhancement_available": text_enhancement_available,
         "text_enhancement_error": text_enhancement_error,
-        "gemini_available": text_enhancement_available and os.getenv('GEMINI_API_KEY') is not None
+        "gemini_available": text_enhancement_available and os.getenv('GEMINI_API_KEY') is not None,
+        "gemini_models": registered_models() if text_enhancement_available else [],
+        "gemini_cache": gemini_cache_stats() if text_enhancement_available else None
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/pipeline/")
+async def pipeline_metrics():
+    """Per-stage latency histograms of the OCR pipeline, aggregated across requests"""
+    return PIPELINE_STAGE_STATS.snapshot()
+
 @app.post("/process-image/")
-async def ocr_image_endpoint(file: UploadFile = File(...)):
+async def ocr_image_endpoint(file: UploadFile = File(...), timings: bool = Query(False)):
     """
     Receives an image, processes it through the OCR pipeline,
     and returns the recognized text.
+    With ?timings=true the response also carries per-stage timings.
     """
     allowed_mime_types = ["image/jpeg", "image/png", "image/bmp", "image/webp"]
     if file.content_type not in allowed_mime_types:
@@ -243,12 +522,25 @@ async def ocr_image_endpoint(file: UploadFile = File(...)):
             detail=f"Invalid file type. Allowed: {', '.join(allowed_mime_types)}"
         )
 
+    require_ocr_ready()
+    global ocr_requests_in_flight
+    if ocr_requests_in_flight >= OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE:
+        print(f"⚠️ OCR queue full ({ocr_requests_in_flight} in flight), rejecting {file.filename}")
+        OCR_REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="OCR service is busy. Please retry shortly.",
+            headers={"Retry-After": OCR_RETRY_AFTER_SECONDS}
+        )
+
+    ocr_requests_in_flight += 1
     try:
         image_bytes = await file.read()
         print(f"📤 Received image: {file.filename}, size: {len(image_bytes)} bytes, type: {file.content_type}")
         
-        # Call your main OCR processing function
-        recognized_text = process_image_pipeline(image_bytes, original_filename=file.filename)
+        # Run the CPU-bound recognition in the OCR executor, then await the Gemini correction
+        trace = PipelineTrace(label=file.filename)
+        recognized_text = await run_ocr(image_bytes, file.filename, trace)
 
         if recognized_text is None:
             print(f"❌ OCR processing returned None for {file.filename}")
@@ -258,7 +550,10 @@ async def ocr_image_endpoint(file: UploadFile = File(...)):
             raise HTTPException(status_code=500, detail=recognized_text)
 
         print(f"✅ OCR processing completed for {file.filename}")
-        return {"filename": file.filename, "recognized_text": recognized_text}
+        response = {"filename": file.filename, "recognized_text": recognized_text}
+        if timings:
+            response["timings"] = trace.to_dict()
+        return response
 
     except HTTPException as http_exc:
         raise http_exc
@@ -267,6 +562,304 @@ async def ocr_image_endpoint(file: UploadFile = File(...)):
         traceback.print_exc()
         error_detail = f"An unexpected error occurred on the server: {str(e)}"
         raise HTTPException(status_code=500, detail=error_detail)
+    finally:
+        ocr_requests_in_flight -= 1
+
+ALLOWED_IMAGE_MIME_TYPES = ["image/jpeg", "image/png", "image/bmp", "image/webp"]
+ZIP_MIME_TYPES = ["application/zip", "application/x-zip-compressed", "application/x-zip"]
+IMAGE_FILE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+async def _read_upload_limited(upload, limit):
+    # Reads an upload in chunks; returns None as soon as it grows past limit bytes
+    chunks = []; size = 0
+    while True:
+        chunk = await upload.read(BATCH_UPLOAD_CHUNK_BYTES)
+        if not chunk: return b"".join(chunks)
+        size += len(chunk)
+        if size > limit: return None
+        chunks.append(chunk)
+
+def _expand_batch_upload(filename, content_type, data, max_bytes=OCR_BATCH_MAX_BYTES, max_entries=OCR_BATCH_MAX_FILES):
+    """
+    Turns one uploaded file into batch entries: (name, image_bytes, error).
+    Zip archives expand to their image members in archive order. Their member count and
+    declared sizes are checked against max_entries / max_bytes before anything is extracted.
+    """
+    is_zip = content_type in ZIP_MIME_TYPES or (filename or "").lower().endswith(".zip")
+    if not is_zip:
+        if content_type not in ALLOWED_IMAGE_MIME_TYPES:
+            return [(filename, None, f"Invalid file type. Allowed: {', '.join(ALLOWED_IMAGE_MIME_TYPES)} or a zip archive")]
+        return [(filename, data, None)]
+    entries = []
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            members = [m for m in archive.infolist() if not m.is_dir() and m.filename.lower().endswith(IMAGE_FILE_EXTENSIONS)
+                       and not os.path.basename(m.filename).startswith(".")]
+            if len(members) > max_entries:
+                raise HTTPException(status_code=413, detail=f"Too many images in batch ({filename} holds {len(members)}), the limit is {OCR_BATCH_MAX_FILES}.")
+            if sum(m.file_size for m in members) > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Archive {filename} expands beyond the {OCR_BATCH_MAX_BYTES // (1024 * 1024)}MB batch limit.")
+            for member in members:
+                # zipfile stops at the declared size and fails the CRC check if a member holds more
+                entries.append((f"{filename}/{member.filename}", archive.read(member), None))
+    except zipfile.BadZipFile:
+        return [(filename, None, "Invalid zip archive")]
+    if not entries:
+        return [(filename, None, "Zip archive contains no images")]
+    return entries
+
+@app.post("/process-images/batch/")
+async def ocr_batch_endpoint(files: List[UploadFile] = File(...), timings: bool = Query(False)):
+    """
+    Recognizes many pages in one request. Accepts several images and/or zip archives of
+    images. Pages are segmented concurrently and all their letters are classified in shared
+    ViT batches. Results come back in upload order (archive members in archive order), with
+    per-file errors instead of failing the whole batch.
+    """
+    too_large_detail = f"Batch upload exceeds {OCR_BATCH_MAX_BYTES // (1024 * 1024)}MB."
+    if len(files) > OCR_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many images in batch ({len(files)}), the limit is {OCR_BATCH_MAX_FILES}.")
+    # Sizes known from the multipart parse are checked before any upload is read
+    if sum(upload.size or 0 for upload in files) > OCR_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=too_large_detail)
+    # budget_bytes counts the images kept for the batch, zip members at their expanded size
+    entries = []; total_bytes = 0; budget_bytes = 0
+    for upload in files:
+        data = await _read_upload_limited(upload, OCR_BATCH_MAX_BYTES - budget_bytes)
+        if data is None: raise HTTPException(status_code=413, detail=too_large_detail)
+        total_bytes += len(data)
+        upload_entries = _expand_batch_upload(upload.filename, upload.content_type, data,
+                                              OCR_BATCH_MAX_BYTES - budget_bytes, OCR_BATCH_MAX_FILES - len(entries))
+        del data
+        entries.extend(upload_entries); budget_bytes += sum(len(image_bytes) for _, image_bytes, _ in upload_entries if image_bytes)
+        if len(entries) > OCR_BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many images in batch ({len(entries)}), the limit is {OCR_BATCH_MAX_FILES}.")
+
+    require_ocr_ready()
+    global ocr_requests_in_flight
+    if ocr_requests_in_flight >= OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE:
+        print(f"⚠️ OCR queue full ({ocr_requests_in_flight} in flight), rejecting batch of {len(entries)} file(s)")
+        OCR_REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="OCR service is busy. Please retry shortly.",
+            headers={"Retry-After": OCR_RETRY_AFTER_SECONDS}
+        )
+
+    ocr_requests_in_flight += 1
+    try:
+        print(f"📤 Received batch: {len(files)} upload(s), {len(entries)} image(s), {total_bytes} bytes")
+        trace = PipelineTrace(label=f"batch of {len(entries)}")
+        valid_entries = [(name, data) for name, data, error in entries if error is None]
+        page_results = await run_in_ocr_executor(recognize_images_batch, valid_entries, trace) if valid_entries else []
+
+        # Gemini corrections run concurrently, bounded so a large batch does not burst the API
+        gemini_semaphore = asyncio.Semaphore(OCR_BATCH_GEMINI_CONCURRENCY)
+        async def finalize(page):
+            if page["error"] is not None or page["cache_hit"]: return page
+            async with gemini_semaphore:
+                corrected, correction_failed = await correct_text_gemini_with_status_async(page["text"])
+            store_cached_result(page["cache_key"], corrected, correction_failed)
+            page["text"] = corrected
+            return page
+        with trace.stage("gemini_correction"):
+            page_results = await asyncio.gather(*(finalize(page) for page in page_results))
+        trace.finish()
+        print(f"⏱️ OCR batch timings: {trace.summary()} (total {trace.total_ms:.0f}ms)")
+
+        results = []; page_iter = iter(page_results)
+        for name, data, error in entries:
+            if error is None:
+                page = next(page_iter)
+                error = page["error"]
+                if error is None:
+                    results.append({"filename": name, "recognized_text": page["text"], "cached": page["cache_hit"]}); continue
+            results.append({"filename": name, "error": error})
+        failed = sum(1 for result in results if "error" in result)
+        print(f"✅ OCR batch completed: {len(results) - failed} succeeded, {failed} failed")
+        response = {"results": results, "succeeded": len(results) - failed, "failed": failed}
+        if timings:
+            response["timings"] = trace.to_dict()
+        return response
+
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        print(f"❌ Unhandled error processing batch: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred on the server: {str(e)}")
+    finally:
+        ocr_requests_in_flight -= 1
+
+@app.post("/jobs/", status_code=202)
+async def submit_ocr_job(file: UploadFile = File(...)):
+    """
+    Queues an image for background OCR and returns immediately with a job id.
+    Poll GET /jobs/{job_id} for the status and the recognized text.
+    """
+    if file.content_type not in ALLOWED_IMAGE_MIME_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_IMAGE_MIME_TYPES)}")
+    if ocr_job_store is None or ocr_job_workers is None:
+        raise HTTPException(status_code=503, detail="OCR job queue is not available.")
+    if ocr_startup_state == "failed":
+        raise HTTPException(status_code=503, detail=f"OCR service failed to start: {ocr_startup_error}")
+
+    counts = await asyncio.to_thread(ocr_job_store.counts)
+    if counts[JOB_QUEUED] >= OCR_JOB_MAX_QUEUED:
+        print(f"⚠️ OCR job queue full ({counts[JOB_QUEUED]} queued), rejecting {file.filename}")
+        OCR_REJECTED.inc()
+        raise HTTPException(status_code=503, detail="OCR job queue is full. Please retry shortly.",
+                            headers={"Retry-After": OCR_RETRY_AFTER_SECONDS})
+
+    image_bytes = await file.read()
+    job_id = await asyncio.to_thread(ocr_job_store.create, file.filename, image_bytes)
+    ocr_job_workers.notify()
+    print(f"📥 Queued OCR job {job_id}: {file.filename}, size: {len(image_bytes)} bytes")
+    return {"job_id": job_id, "status": JOB_QUEUED, "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_ocr_job(job_id: str):
+    """Status of a submitted OCR job; finished jobs carry the text (or error) and per-stage timings"""
+    if ocr_job_store is None:
+        raise HTTPException(status_code=503, detail="OCR job queue is not available.")
+    job = await asyncio.to_thread(ocr_job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job id.")
+
+    response = {key: job[key] for key in ("job_id", "status", "filename", "created_at", "started_at", "finished_at", "attempts")}
+    if job["status"] == JOB_QUEUED:
+        response["queue_position"] = await asyncio.to_thread(ocr_job_store.queue_position, job_id)
+    if job["recognized_text"] is not None:
+        response["recognized_text"] = job["recognized_text"]
+    if job["error"] is not None:
+        response["error"] = job["error"]
+    if job["timings"] is not None:
+        response["timings"] = job["timings"]
+    if "expires_at" in job:
+        response["expires_at"] = job["expires_at"]
+    return response
+
+ocr_stream_tasks = set() # running /process-image/stream/ pipelines (asyncio keeps only weak references to tasks)
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/process-image/stream/")
+async def ocr_image_stream_endpoint(file: UploadFile = File(...)):
+    """
+    Streaming variant of /process-image/ (Server-Sent Events). Emits:
+      start     {"filename"}
+      lines     {"count"}                    number of text lines found
+      line      {"index", "text"}            raw ViT text of each line as soon as it is classified
+      raw       {"text"}                     the full raw text
+      corrected {"text", "cached"}           final text after Gemini correction (or from the cache)
+      error     {"detail"}
+      done      {"timings"}
+    """
+    allowed_mime_types = ["image/jpeg", "image/png", "image/bmp", "image/webp"]
+    if file.content_type not in allowed_mime_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(allowed_mime_types)}"
+        )
+
+    require_ocr_ready()
+    global ocr_requests_in_flight
+    if ocr_requests_in_flight >= OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE:
+        print(f"⚠️ OCR queue full ({ocr_requests_in_flight} in flight), rejecting stream for {file.filename}")
+        OCR_REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="OCR service is busy. Please retry shortly.",
+            headers={"Retry-After": OCR_RETRY_AFTER_SECONDS}
+        )
+
+    ocr_requests_in_flight += 1
+    try:
+        image_bytes = await file.read()
+    except Exception:
+        ocr_requests_in_flight -= 1
+        raise
+    print(f"📤 Received image for streaming: {file.filename}, size: {len(image_bytes)} bytes, type: {file.content_type}")
+    trace = PipelineTrace(label=file.filename)
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue(); chunks: asyncio.Queue = asyncio.Queue()
+    client_gone = threading.Event()
+
+    def produce_line_events():
+        # Runs in the OCR executor; hands every pipeline event to the event loop as soon as it exists,
+        # and stops after the current line once the client is gone
+        try:
+            for event in iter_recognized_lines(image_bytes, file.filename, trace):
+                if client_gone.is_set(): break
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            traceback.print_exc()
+            loop.call_soon_threadsafe(events.put_nowait, {"event": "error", "detail": f"An unexpected error occurred on the server: {str(e)}"})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    async def run_stream():
+        # Produces the SSE chunks independently of the response, so the in-flight slot is held until the
+        # executor work (and Gemini) is over even if the client never reads or disconnects early
+        try:
+            producer = asyncio.ensure_future(run_in_ocr_executor(produce_line_events))
+            chunks.put_nowait(_sse_event("start", {"filename": file.filename}))
+            line_texts = []; cache_key = None; final_text = None; error_detail = None
+            while True:
+                event = await events.get()
+                if event is None: break
+                if event["event"] == "lines":
+                    cache_key = event["cache_key"]
+                    chunks.put_nowait(_sse_event("lines", {"count": event["count"]}))
+                elif event["event"] == "line":
+                    line_texts.append(event["text"])
+                    chunks.put_nowait(_sse_event("line", {"index": event["index"], "text": event["text"]}))
+                elif event["event"] == "cached":
+                    final_text = event["text"]
+                elif event["event"] == "error":
+                    error_detail = event["detail"]
+            await producer
+            if client_gone.is_set():
+                print(f"⚠️ Client left the stream for {file.filename}; stopped after {len(line_texts)} line(s)"); return
+
+            if error_detail is not None:
+                print(f"❌ OCR streaming error for {file.filename}: {error_detail}")
+                chunks.put_nowait(_sse_event("error", {"detail": error_detail}))
+            elif final_text is not None:
+                chunks.put_nowait(_sse_event("corrected", {"text": final_text, "cached": True}))
+            else:
+                raw_text = "\n".join(line_texts)
+                chunks.put_nowait(_sse_event("raw", {"text": raw_text}))
+                with trace.stage("gemini_correction"):
+                    final_text, correction_failed = await correct_text_gemini_with_status_async(raw_text)
+                store_cached_result(cache_key, final_text, correction_failed)
+                chunks.put_nowait(_sse_event("corrected", {"text": final_text, "cached": False}))
+            trace.finish()
+            print(f"⏱️ OCR stream timings for {file.filename}: {trace.summary()} (total {trace.total_ms:.0f}ms)")
+            chunks.put_nowait(_sse_event("done", {"timings": trace.to_dict()}))
+        except Exception as e:
+            traceback.print_exc()
+            chunks.put_nowait(_sse_event("error", {"detail": f"An unexpected error occurred on the server: {str(e)}"}))
+        finally:
+            trace.finish() # no-op after a complete stream
+            chunks.put_nowait(None)
+
+    stream_task = asyncio.create_task(run_stream())
+    ocr_stream_tasks.add(stream_task)
+    stream_task.add_done_callback(lambda task: (ocr_stream_tasks.discard(task), release_ocr_job()))
+
+    async def event_stream():
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None: break
+                yield chunk
+        finally:
+            client_gone.set() # no-op once the stream is complete
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/enhance-text/", response_model=TextEnhancementResponse)
 async def enhance_text_endpoint(request: TextEnhancementRequest):
@@ -290,8 +883,8 @@ async def enhance_text_endpoint(request: TextEnhancementRequest):
         print(f"🔤 Text enhancement request - text length: {len(request.text)} chars")
         print(f"⚙️ Options: {request.options}")
         
-        # Call Gemini API
-        enhanced_text = enhance_text_with_gemini(request.text, request.options)
+        # Call Gemini API off the event loop so health checks stay responsive
+        enhanced_text = await asyncio.to_thread(enhance_text_with_gemini, request.text, request.options)
         
         if enhanced_text is None:
             return TextEnhancementResponse(
@@ -0,0 +1,158 @@
+# backend/model_registry.py
+# Versioned, checksum-verified ViT model artifacts, loaded through memory-mapped safetensors.
+#
+#   models/
+#     CURRENT                     <- version served by default (VIT_MODEL_VERSION overrides it)
+#     <version>/
+#       manifest.json             <- {"name", "version", "created_at", "format", "files": {name: {"sha256", "size"}}}
+#       config.json, preprocessor_config.json
+#       model.safetensors         <- state_dict saved with the runtime model's own parameter names
+#
+# prepare_model_artifacts.py builds a version from the trained checkpoint (directory or
+# zip) at build time, so nothing is extracted at runtime. resolve() checks the manifest;
+# the sha256 pass runs once per file state and is remembered in <version>/.verified.
+# load_vit_classifier_mmap() maps model.safetensors read-only and assigns the mapped
+# tensors as the model parameters, so worker processes on one host share the weight
+# pages through the page cache instead of each holding a private copy.
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+MANIFEST_FILENAME = "manifest.json"
+CURRENT_FILENAME = "CURRENT"
+VERIFIED_FILENAME = ".verified"
+WEIGHTS_FILENAME = "model.safetensors"
+ARTIFACT_FORMAT = "safetensors-v1"
+
+def sha256_file(path: str, chunk_size: int = 4 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''): digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f: f.write(data)
+    os.replace(tmp_path, path)
+
+class ModelRegistry:
+    """Model versions under one store directory, each described by a manifest of file checksums"""
+    def __init__(self, root: str):
+        self.root = root
+
+    def version_dir(self, version: str) -> str:
+        return os.path.join(self.root, version)
+
+    def versions(self) -> List[str]:
+        if not os.path.isdir(self.root): return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isfile(os.path.join(self.root, name, MANIFEST_FILENAME)))
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, CURRENT_FILENAME), 'r', encoding='utf-8') as f: version = f.read().strip()
+        except OSError:
+            return None
+        return version or None
+
+    def set_current(self, version: str):
+        if version not in self.versions(): raise ValueError(f"Unknown model version '{version}'")
+        _write_atomic(os.path.join(self.root, CURRENT_FILENAME), f"{version}\n".encode('utf-8'))
+
+    def manifest(self, version: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.version_dir(version), MANIFEST_FILENAME), 'r', encoding='utf-8') as f: return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, version: str, name: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Checksums every file in the version directory into its manifest"""
+        version_dir = self.version_dir(version)
+        files = {}
+        for filename in sorted(os.listdir(version_dir)):
+            path = os.path.join(version_dir, filename)
+            if filename in (MANIFEST_FILENAME, VERIFIED_FILENAME) or not os.path.isfile(path): continue
+            files[filename] = {"sha256": sha256_file(path), "size": os.path.getsize(path)}
+        manifest = {"name": name, "version": version, "format": ARTIFACT_FORMAT, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "files": files, **(extra or {})}
+        _write_atomic(os.path.join(version_dir, MANIFEST_FILENAME), json.dumps(manifest, indent=2, ensure_ascii=False).encode('utf-8'))
+        return manifest
+
+    def _file_states(self, version: str, manifest: Dict[str, Any]) -> Dict[str, List[int]]:
+        states = {}
+        for filename in manifest["files"]:
+            stat = os.stat(os.path.join(self.version_dir(version), filename))
+            states[filename] = [stat.st_size, stat.st_mtime_ns]
+        return states
+
+    def verify(self, version: str, force: bool = False) -> List[str]:
+        """Returns the problems found (empty when the version is intact); sizes are always checked, checksums once per file state"""
+        manifest = self.manifest(version)
+        if manifest is None: return [f"missing or unreadable {MANIFEST_FILENAME}"]
+        if manifest.get("format") != ARTIFACT_FORMAT: return [f"unsupported artifact format {manifest.get('format')!r}"]
+        if WEIGHTS_FILENAME not in manifest["files"]: return [f"manifest does not list {WEIGHTS_FILENAME}"]
+        version_dir = self.version_dir(version)
+        problems = []
+        for filename, expected in manifest["files"].items():
+            path = os.path.join(version_dir, filename)
+            if not os.path.isfile(path): problems.append(f"{filename}: missing"); continue
+            if os.path.getsize(path) != expected["size"]: problems.append(f"{filename}: size {os.path.getsize(path)} != {expected['size']}")
+        if problems: return problems
+
+        manifest_digest = sha256_file(os.path.join(version_dir, MANIFEST_FILENAME))
+        states = self._file_states(version, manifest)
+        verified_path = os.path.join(version_dir, VERIFIED_FILENAME)
+        if not force:
+            try:
+                with open(verified_path, 'r', encoding='utf-8') as f: stamp = json.load(f)
+                if stamp.get("manifest_sha256") == manifest_digest and stamp.get("files") == states: return []
+            except (OSError, ValueError):
+                pass
+        for filename, expected in manifest["files"].items():
+            if sha256_file(os.path.join(version_dir, filename)) != expected["sha256"]: problems.append(f"{filename}: sha256 mismatch")
+        if not problems:
+            # A read-only store just means the checksums are recomputed on the next start
+            try: _write_atomic(verified_path, json.dumps({"manifest_sha256": manifest_digest, "files": states}).encode('utf-8'))
+            except OSError: pass
+        return problems
+
+    def resolve(self, version: Optional[str] = None) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """(version, directory, manifest) of the requested (default: CURRENT) version if it verifies, else None"""
+        version = version or self.current_version()
+        if version is None:
+            print(f"[Model Registry] No current model version in '{self.root}'."); return None
+        start = time.perf_counter()
+        problems = self.verify(version)
+        if problems:
+            print(f"[Model Registry ERROR] Model version '{version}' in '{self.root}' failed verification: {'; '.join(problems)}")
+            return None
+        print(f"[Model Registry] Model version '{version}' verified in {(time.perf_counter() - start) * 1000:.0f}ms.")
+        return version, self.version_dir(version), self.manifest(version)
+
+def load_vit_classifier_mmap(model_dir: str):
+    """
+    ViTForImageClassification whose parameters are the memory-mapped tensors of
+    model_dir/model.safetensors. The module is built on the meta device, so no weight
+    memory is allocated before the mapped tensors are assigned. Returns None (after
+    printing why) when the checkpoint does not match the model exactly, so callers
+    can fall back to from_pretrained.
+    """
+    import torch
+    from safetensors.torch import load_file
+    from transformers import ViTConfig, ViTForImageClassification
+
+    config = ViTConfig.from_pretrained(model_dir)
+    with torch.device("meta"):
+        model = ViTForImageClassification(config)
+    state_dict = load_file(os.path.join(model_dir, WEIGHTS_FILENAME)) # mmap-backed CPU tensors
+    try:
+        model.load_state_dict(state_dict, strict=True, assign=True)
+    except RuntimeError as e:
+        print(f"[Model Registry WARNING] {WEIGHTS_FILENAME} does not match the model's parameters ({str(e).splitlines()[0]}).")
+        return None
+    unassigned = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if unassigned:
+        print(f"[Model Registry WARNING] Tensors not present in {WEIGHTS_FILENAME}: {', '.join(unassigned[:5])}.")
+        return None
+    return model.eval()
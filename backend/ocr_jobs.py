@@ -0,0 +1,289 @@
+# backend/ocr_jobs.py
+# Persistent OCR job queue (SQLite) for the submit/poll API in main.py.
+#
+#   POST /jobs/          -> job id (status "queued")
+#   worker               -> claim_next() ... complete() / fail()
+#   GET /jobs/{job_id}   -> status, timings and result
+#
+# The image is stored with the job until it finishes, so queued jobs survive a
+# restart. Jobs left "running" by a process that no longer exists are re-queued, up to
+# max_attempts; jobs of a live process running for longer than stale_after_s fail
+# (re-queueing them would run them twice). Worker names carry the pid and the start
+# time of the claiming process, so a reused pid (e.g. pid 1 again after a container
+# restart) does not make a dead worker look alive. Only the worker that claimed a job can
+# finish it, so a late result never overwrites a recovered job. Finished jobs are
+# deleted ttl_seconds after they finish. Claims use an IMMEDIATE transaction, so
+# several worker processes on the host can share one file.
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+JOB_QUEUED = "queued"; JOB_RUNNING = "running"; JOB_SUCCEEDED = "succeeded"; JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    image BLOB,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    recognized_text TEXT,
+    error TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS ocr_jobs_status_created ON ocr_jobs (status, created_at);
+"""
+
+def _process_start_time(pid: int) -> Optional[str]:
+    # Start time of the process in clock ticks since boot (/proc/<pid>/stat field 22), None if unknown
+    try:
+        with open(f"/proc/{pid}/stat") as f: return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError): return None
+
+class OcrJobStore:
+    """SQLite-backed job table; all methods are thread-safe and blocking (call them via asyncio.to_thread)"""
+    def __init__(self, db_path: str, ttl_seconds: float = 24 * 3600, max_attempts: int = 3, stale_after_s: float = 1800):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max(1, int(max_attempts))
+        self.stale_after_s = stale_after_s
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+    def create(self, filename: str, image_bytes: bytes) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("INSERT INTO ocr_jobs (job_id, status, filename, image, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, JOB_QUEUED, filename, sqlite3.Binary(image_bytes), time.time()))
+        return job_id
+
+    def claim_next(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically moves the oldest queued job to running; returns it (with image bytes) or None"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT job_id, filename, image, attempts FROM ocr_jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                         (JOB_QUEUED,)).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT"); return None
+                self._conn.execute("UPDATE ocr_jobs SET status = ?, started_at = ?, attempts = attempts + 1, worker = ? WHERE job_id = ?",
+                                   (JOB_RUNNING, time.time(), worker, row["job_id"]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK"); raise
+        return {"job_id": row["job_id"], "filename": row["filename"], "image": bytes(row["image"]), "attempts": row["attempts"] + 1, "worker": worker}
+
+    def _finish(self, job_id, worker, status, recognized_text, error, timings) -> bool:
+        # Only the worker still holding the claim can finish the job
+        with self._lock:
+            cursor = self._conn.execute("UPDATE ocr_jobs SET status = ?, finished_at = ?, recognized_text = ?, error = ?, timings = ?, image = NULL "
+                                        "WHERE job_id = ? AND status = ? AND worker = ?",
+                                        (status, time.time(), recognized_text, error, json.dumps(timings) if timings is not None else None,
+                                         job_id, JOB_RUNNING, worker))
+        if cursor.rowcount == 0: print(f"[OCR Jobs WARNING] Job {job_id} is no longer claimed by {worker}; result discarded")
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, worker: str, recognized_text: str, timings: Optional[Dict[str, Any]] = None) -> bool:
+        return self._finish(job_id, worker, JOB_SUCCEEDED, recognized_text, None, timings)
+
+    def fail(self, job_id: str, worker: str, error: str, timings: Optional[Dict[str, Any]] = None) -> bool:
+        return self._finish(job_id, worker, JOB_FAILED, None, error, timings)
+
+    def fail_queued(self, error: str) -> int:
+        """Fails every queued job (the service cannot run them); returns how many"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE ocr_jobs SET status = ?, finished_at = ?, error = ?, image = NULL WHERE status = ?",
+                                        (JOB_FAILED, time.time(), error, JOB_QUEUED))
+        return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT job_id, status, filename, created_at, started_at, finished_at, attempts, recognized_text, error, timings "
+                                     "FROM ocr_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None: return None
+        job = dict(row)
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else None
+        if job["finished_at"] is not None: job["expires_at"] = job["finished_at"] + self.ttl_seconds
+        return job
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM ocr_jobs WHERE status = ? AND created_at < (SELECT created_at FROM ocr_jobs WHERE job_id = ?)",
+                                     (JOB_QUEUED, job_id)).fetchone()
+        return row[0] if row is not None else None
+
+    @staticmethod
+    def _worker_alive(worker: Optional[str], own_prefix: Optional[str] = None) -> bool:
+        # Worker names are "<pid>-<process start time>-<uuid>-<index>" (see OcrJobWorkers)
+        if own_prefix and (worker or "").startswith(own_prefix + "-"): return True
+        parts = (worker or "").split("-")
+        try: pid = int(parts[0])
+        except ValueError: return False
+        if own_prefix and pid == os.getpid(): return False # an earlier incarnation of this process
+        if len(parts) >= 4:
+            started = _process_start_time(pid)
+            if started is not None: return started == parts[1]
+        try: os.kill(pid, 0)
+        except ProcessLookupError: return False
+        except PermissionError: return True
+        return True
+
+    def requeue_interrupted(self, own_prefix: Optional[str] = None) -> int:
+        """
+        Jobs whose worker process is gone go back to the queue, or fail after max_attempts. Jobs of a
+        live process that ran past stale_after_s fail: that process may still finish them.
+        own_prefix is the calling process's OcrJobWorkers.worker_prefix: its own claims are live, and
+        other claims under its pid belong to an earlier process that reused the pid.
+        """
+        now = time.time(); requeued = 0; failed = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = self._conn.execute("SELECT job_id, worker, started_at, attempts FROM ocr_jobs WHERE status = ?", (JOB_RUNNING,)).fetchall()
+                for row in running:
+                    error = None
+                    if self._worker_alive(row["worker"], own_prefix):
+                        if (row["started_at"] or now) > now - self.stale_after_s: continue
+                        error = f"Error: Job ran for more than {self.stale_after_s:g}s."
+                    elif row["attempts"] >= self.max_attempts:
+                        error = "Error: Job was interrupted too many times."
+                    if error is not None:
+                        self._conn.execute("UPDATE ocr_jobs SET status = ?, finished_at = ?, error = ?, image = NULL WHERE job_id = ?",
+                                           (JOB_FAILED, now, error, row["job_id"])); failed += 1
+                    else:
+                        self._conn.execute("UPDATE ocr_jobs SET status = ?, started_at = NULL, worker = NULL WHERE job_id = ?",
+                                           (JOB_QUEUED, row["job_id"])); requeued += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK"); raise
+        if failed or requeued: print(f"[OCR Jobs] Recovered interrupted jobs: {requeued} re-queued, {failed} failed (stale or out of attempts)")
+        return requeued
+
+    def cleanup_expired(self) -> int:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM ocr_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                         (*FINISHED_STATUSES, time.time() - self.ttl_seconds)).rowcount
+        if deleted: print(f"[OCR Jobs] Removed {deleted} expired job(s)")
+        return deleted
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM ocr_jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED)}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+class OcrJobWorkers:
+    """
+    asyncio worker tasks draining an OcrJobStore. process_job(job) is an async callable
+    returning (recognized_text, timings_dict); an exception or a text starting with
+    "Error:" marks the job failed. Workers started with ready=False accept nothing until
+    set_ready(), so they can be started before the models are loaded.
+
+    admit() and release() share the server's admission limit with the synchronous
+    requests: a worker claims a job only after admit() returned True, and calls
+    release() once the job is finished (or nothing was claimed).
+    """
+    def __init__(self, store: OcrJobStore, process_job: Callable[[Dict[str, Any]], Awaitable], num_workers: int = 2,
+                 poll_interval_s: float = 1.0, cleanup_interval_s: float = 60.0,
+                 admit: Optional[Callable[[], bool]] = None, release: Optional[Callable[[], None]] = None):
+        self.store = store
+        self.process_job = process_job
+        self.admit = admit or (lambda: True); self.release = release or (lambda: None)
+        self.num_workers = max(1, int(num_workers))
+        self.poll_interval_s = poll_interval_s
+        self.cleanup_interval_s = cleanup_interval_s
+        self._wakeup: Optional[asyncio.Event] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._worker_prefix = f"{os.getpid()}-{_process_start_time(os.getpid()) or 0}-{uuid.uuid4().hex[:6]}"
+
+    def start(self, ready: bool = True):
+        self._wakeup = asyncio.Event(); self._ready = asyncio.Event()
+        if ready: self._ready.set()
+        self._tasks = [asyncio.create_task(self._worker_loop(f"{self._worker_prefix}-{i}")) for i in range(self.num_workers)]
+        self._tasks.append(asyncio.create_task(self._cleanup_loop()))
+        print(f"[OCR Jobs] Started {self.num_workers} job worker(s) on {self.store.db_path}")
+
+    async def stop(self):
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def worker_prefix(self) -> str:
+        return self._worker_prefix
+
+    def set_ready(self):
+        if self._ready is not None: self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready is not None and self._ready.is_set()
+
+    def notify(self):
+        # Wakes idle workers right away instead of waiting for the next poll
+        if self._wakeup is not None: self._wakeup.set()
+
+    async def _worker_loop(self, worker_name):
+        await self._ready.wait()
+        while True:
+            job = None
+            if self.admit():
+                try:
+                    job = await asyncio.to_thread(self.store.claim_next, worker_name)
+                except Exception as e:
+                    print(f"[OCR Jobs ERROR] Could not claim a job: {e}")
+                finally:
+                    if job is None: self.release()
+            if job is None:
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval_s)
+                except asyncio.TimeoutError: pass
+                continue
+            try: await self._run_job(job)
+            finally: self.release()
+
+    async def _run_job(self, job):
+        job_id = job["job_id"]; worker = job["worker"]
+        print(f"[OCR Jobs] Running job {job_id} ({job['filename']}, attempt {job['attempts']})")
+        try:
+            recognized_text, timings = await self.process_job(job)
+        except asyncio.CancelledError:
+            raise # shutdown: the job stays "running" and is re-queued at the next startup
+        except Exception as e:
+            traceback.print_exc()
+            await asyncio.to_thread(self.store.fail, job_id, worker, f"Error: {str(e)}", None); return
+        if recognized_text is None or recognized_text.startswith("Error:"):
+            await asyncio.to_thread(self.store.fail, job_id, worker, recognized_text or "Error: OCR processing returned no result.", timings)
+        else:
+            await asyncio.to_thread(self.store.complete, job_id, worker, recognized_text, timings)
+        print(f"[OCR Jobs] Finished job {job_id}")
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.store.cleanup_expired)
+                if await asyncio.to_thread(self.store.requeue_interrupted, self._worker_prefix): self.notify()
+            except Exception as e: print(f"[OCR Jobs ERROR] Cleanup failed: {e}")
+            await asyncio.sleep(self.cleanup_interval_s)
@@ -6,14 +6,23 @@
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
+import bisect
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
 import sys
+import time
 import io
 import traceback
 import os
-import zipfile
 from PIL import Image
 from dotenv import load_dotenv
+from vit_batch_scheduler import ViTBatchScheduler
+from result_cache import TieredCache, hash_key
+from model_registry import ModelRegistry, load_vit_classifier_mmap
+from pipeline_tracing import PipelineTrace, trace_stage
+from service_metrics import GEMINI_CALL_SECONDS, GEMINI_CALL_ERRORS
 
 # Call load_dotenv() as early as possible
 load_dotenv()
@@ -21,22 +30,42 @@ print(f"DEBUG (startup): GEMINI_API_KEY from os.environ after load_dotenv: {os.g
 
 
 # --- Library Imports ---
+# torch/transformers, google.generativeai and matplotlib take seconds to import, so they are
+# loaded on first use (import_ml_libraries() from load_models, the Gemini SDK inside
+# gemini_clients, matplotlib only with DEBUG_VISUALIZE). Only their presence is checked here.
 # Local Model (Transformers/Torch)
-try:
-    from transformers import ViTForImageClassification, ViTImageProcessor
-    import torch
-    print("INFO: Transformers and Torch imported successfully for local ViT model.")
-except ImportError:
+if importlib.util.find_spec("transformers") is None or importlib.util.find_spec("torch") is None:
     print("FATAL ERROR: 'transformers' or 'torch' not found. These are essential for the local ViT model.")
     sys.exit("Dependency missing: transformers/torch")
+torch = None; ViTForImageClassification = None; ViTImageProcessor = None
+ml_import_lock_g = threading.Lock()
 
 # Google Gemini SDK
-try:
-    import google.generativeai as genai
-    print("INFO: google.generativeai imported successfully.")
-except ImportError:
+if importlib.util.find_spec("google.generativeai") is None:
     print("FATAL ERROR: 'google-generativeai' not found. This library is essential for Gemini correction.")
     sys.exit("Dependency missing: google-generativeai")
+from gemini_clients import configure_gemini, get_gemini_model, gemini_cache_key, cached_gemini_response, store_gemini_response
+# Thread counts of torch / OpenCV / ONNX Runtime and the segmentation pools (see resource_config.py)
+from resource_config import RESOURCE_CONFIG, apply_process_settings, apply_runtime_settings, configure_torch, describe_resource_config
+apply_process_settings()
+
+def import_ml_libraries():
+    # Imports torch/transformers into this module's globals on first call
+    global torch, ViTForImageClassification, ViTImageProcessor
+    if torch is not None: return
+    with ml_import_lock_g:
+        if torch is not None: return
+        start = time.perf_counter()
+        from transformers import ViTForImageClassification as vit_classifier_cls, ViTImageProcessor as vit_processor_cls
+        import torch as torch_module
+        configure_torch(torch_module) # before any torch work: interop threads cannot be changed afterwards
+        ViTForImageClassification = vit_classifier_cls; ViTImageProcessor = vit_processor_cls
+        torch = torch_module # set last: other threads check torch to see whether the imports are done
+        print(f"INFO: Transformers and Torch imported successfully for local ViT model ({(time.perf_counter() - start) * 1000:.0f}ms).")
+
+def _pyplot():
+    import matplotlib.pyplot as plt
+    return plt
 
 # --- Parameters ---
 TARGET_HEIGHT_FIXED = 4500; TARGET_WIDTH_FIXED = 3000
@@ -52,10 +81,61 @@ PREVENT_LAMED_OVERHANG_MERGE = True; LAMED_CANDIDATE_MIN_HEIGHT_RATIO = 1.5
 LAMED_CANDIDATE_MAX_WIDTH_RATIO = 0.7; EATEN_CHAR_MIN_WIDTH_RATIO_OF_LAMED = 0.4
 SPACE_MULTIPLIER = 2.5; MIN_ABS_SPACE_WIDTH_RATIO = 0.4; LETTER_CROP_PADDING = 2
 
+# Resolution handling: "fixed" always resizes to TARGET_WIDTH_FIXED x TARGET_HEIGHT_FIXED.
+# "adaptive" estimates the letter height and scales the page (keeping aspect ratio) so letters are
+# ADAPTIVE_TARGET_TEXT_HEIGHT_PX tall; pixel constants above are scaled by TARGET / REFERENCE height.
+OCR_RESIZE_MODE = os.environ.get("OCR_RESIZE_MODE", "fixed").lower()
+REFERENCE_TEXT_HEIGHT_PX = 50 # Typical estimated letter height at the fixed resolution the constants were tuned for
+ADAPTIVE_TARGET_TEXT_HEIGHT_PX = float(os.environ.get("ADAPTIVE_TARGET_TEXT_HEIGHT_PX", "32"))
+ADAPTIVE_MIN_SCALE = 0.25; ADAPTIVE_MAX_SCALE = 4.0; TEXT_HEIGHT_ESTIMATE_MAX_SIDE = 1000
+
+# Letter box extraction in segment_line_to_items: "contours" (findContours + per-contour filtering) or
+# "components" (one connectedComponentsWithStats call + vectorized filters). Both measure the area of the
+# outer contour polygon (holes included), so they keep the same boxes; check_segmentation_parity.py times them.
+LETTER_BOX_EXTRACTOR = os.environ.get("LETTER_BOX_EXTRACTOR", "contours").lower()
+
+# Line-parallel letter segmentation: lines are segmented on a thread pool (OpenCV releases the GIL).
+# OCR_LINE_WORKERS (RESOURCE_CONFIG["line_workers"]): 1 keeps the sequential loop, an integer sets the
+# pool size, "auto" uses one thread per CPU of the budget. The pool never exceeds the CPU budget.
+
+# Parameters that change the OCR output; part of the result cache fingerprint
+SEGMENTATION_PARAM_NAMES = [
+    "TARGET_HEIGHT_FIXED", "TARGET_WIDTH_FIXED", "LINE_REMOVAL_KERNEL_LENGTH_DIV", "VERTICAL_RECONNECT_KERNEL_HEIGHT",
+    "PROJECTION_THRESHOLD_RATIO", "HPP_DENSITY_FILTER_RATIO", "LINE_CROP_PADDING", "BOUNDARY_EXTEND_RATIO",
+    "RTL_ENABLED", "MIN_CONTOUR_AREA_LETTER", "MAX_CONTOUR_AREA_LETTER", "MIN_ASPECT_RATIO_LETTER", "MAX_ASPECT_RATIO_LETTER",
+    "FILTER_TOP_FRAGMENTS", "TOP_FRAGMENT_MAX_START_Y", "TOP_FRAGMENT_MAX_END_Y_RATIO", "MORPH_KERNEL_SIZE_LETTERS",
+    "MIN_X_OVERLAP_RATIO_MERGE", "MAX_CENTER_X_DIFF_RATIO_MERGE", "PREVENT_LAMED_OVERHANG_MERGE",
+    "LAMED_CANDIDATE_MIN_HEIGHT_RATIO", "LAMED_CANDIDATE_MAX_WIDTH_RATIO", "EATEN_CHAR_MIN_WIDTH_RATIO_OF_LAMED",
+    "SPACE_MULTIPLIER", "MIN_ABS_SPACE_WIDTH_RATIO", "LETTER_CROP_PADDING",
+    "OCR_RESIZE_MODE", "REFERENCE_TEXT_HEIGHT_PX", "ADAPTIVE_TARGET_TEXT_HEIGHT_PX", "LETTER_BOX_EXTRACTOR",
+]
+
 # --- Local ViT Model Configuration ---
-VIT_MODEL_PATH = "./vit-hebrew-final" # Relative path to the ViT model directory
+VIT_MODEL_PATH = "./vit-hebrew-final" # Relative path to the ViT model directory (used when the model store has no version)
+# Versioned artifacts built by prepare_model_artifacts.py; weights are memory-mapped (see model_registry.py)
+VIT_MODEL_STORE = os.environ.get("VIT_MODEL_STORE", "./models")
+VIT_MODEL_VERSION = os.environ.get("VIT_MODEL_VERSION", "") # empty: the store's CURRENT version
+VIT_BATCH_SIZE = int(os.environ.get("VIT_BATCH_SIZE", "32")) # Letter crops per ViT forward pass
+# Cross-request dynamic batching: crops from concurrent requests share forward passes
+VIT_SCHEDULER_ENABLED = os.environ.get("VIT_SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes")
+VIT_SCHEDULER_MAX_WAIT_MS = float(os.environ.get("VIT_SCHEDULER_MAX_WAIT_MS", "10"))
+# Batched crop preprocessing instead of ViTImageProcessor: Pillow's resize on single-channel crops, then vectorized normalization (identical values)
+VIT_FAST_PREPROCESS = os.environ.get("VIT_FAST_PREPROCESS", "true").lower() in ("1", "true", "yes")
+# Inference backend: "torch" (fp32 PyTorch) or "onnx" (ONNX Runtime, int8 if exported, see vit_onnx_backend.py)
+VIT_INFERENCE_BACKEND = os.environ.get("VIT_INFERENCE_BACKEND", "torch").lower()
+VIT_ONNX_DIR = os.environ.get("VIT_ONNX_DIR", "./vit-hebrew-final-onnx")
+VIT_ONNX_PREFER_INT8 = os.environ.get("VIT_ONNX_PREFER_INT8", "true").lower() in ("1", "true", "yes")
+
+# --- OCR Result Cache Configuration ---
+# Keyed on the decoded image pixels + pipeline config fingerprint. Disk tier is enabled by OCR_CACHE_DIR.
+OCR_CACHE_ENABLED = os.environ.get("OCR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "256"))
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "")
+OCR_CACHE_MAX_DISK_MB = float(os.environ.get("OCR_CACHE_MAX_DISK_MB", "256"))
 
 # --- Gemini API Configuration ---
+GEMINI_CORRECTION_MODEL_NAME = "models/gemini-1.5-flash-latest"
+CORRECTION_PROMPT_VERSION = "1" # part of the Gemini response cache key; bump when the correction prompt changes meaning
 GEMINI_API_KEY_FALLBACK = "YOUR_GEMINI_API_KEY_HERE"
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", GEMINI_API_KEY_FALLBACK)
 if not GEMINI_API_KEY or GEMINI_API_KEY == GEMINI_API_KEY_FALLBACK:
@@ -64,9 +144,15 @@ if not GEMINI_API_KEY or GEMINI_API_KEY == GEMINI_API_KEY_FALLBACK:
 # Global model instances
 vit_model_g = None
 vit_processor_g = None
+vit_preprocess_params_g = None
 vit_idx2label_g = None
+vit_scheduler_g = None
+vit_model_version_g = None
 gemini_model_g = None
 models_loaded_flag = False
+segmentation_executors_g = {} # "line" / "page" -> ThreadPoolExecutor
+segmentation_executors_lock_g = threading.Lock()
+ocr_result_cache_g = TieredCache(OCR_CACHE_MAX_ENTRIES, OCR_CACHE_DIR or None, int(OCR_CACHE_MAX_DISK_MB * 1024 * 1024)) if OCR_CACHE_ENABLED else None
 
 # --- Debugging ---
 DEBUG_VISUALIZE = False
@@ -108,59 +194,171 @@ def resize_to_fixed(img_color, target_w, target_h):
     resized_img = cv2.resize(img_color, (target_w, target_h), interpolation=cv2.INTER_CUBIC)
     return resized_img
 
-def merge_split_boxes_inline(boxes, avg_char_height):
-    min_x_overlap_ratio = MIN_X_OVERLAP_RATIO_MERGE
-    max_center_x_diff_ratio = MAX_CENTER_X_DIFF_RATIO_MERGE
+def estimate_text_height(img_color):
+    """
+    Estimates the median letter height (in pixels of img_color) from connected components
+    of an Otsu-binarized, downscaled copy. Returns None if no letter-like components are found.
+    """
+    img_gray = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY) if img_color.ndim == 3 else img_color
+    shrink = min(1.0, TEXT_HEIGHT_ESTIMATE_MAX_SIDE / float(max(img_gray.shape[:2])))
+    img_small = cv2.resize(img_gray, None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA) if shrink < 1.0 else img_gray
+    _, img_binary = cv2.threshold(img_small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(img_binary, connectivity=8)
+    widths = stats[1:, cv2.CC_STAT_WIDTH]; heights = stats[1:, cv2.CC_STAT_HEIGHT]; areas = stats[1:, cv2.CC_STAT_AREA]
+    # Drop specks, ruled lines and page-sized blobs (borders, shadows)
+    letter_like = (areas >= 8) & (heights >= 3) & (widths <= heights * 4) & (heights < img_small.shape[0] * 0.2)
+    if np.count_nonzero(letter_like) < 5: return None
+    return float(np.median(heights[letter_like])) / shrink
+
+def resize_adaptive(img_color):
+    """
+    Scales img_color (keeping aspect ratio) so letters are about ADAPTIVE_TARGET_TEXT_HEIGHT_PX tall.
+    Returns (resized_image, param_scale), where param_scale is the factor for the pixel-valued
+    segmentation constants. Falls back to resize_to_fixed with param_scale None if the text height
+    cannot be estimated.
+    """
+    text_height = estimate_text_height(img_color)
+    if not text_height:
+        print("[OCR Pipeline WARNING] Could not estimate text height, using fixed resize.")
+        return resize_to_fixed(img_color, TARGET_WIDTH_FIXED, TARGET_HEIGHT_FIXED), None
+    original_height, original_width = img_color.shape[:2]
+    working_scale = min(max(ADAPTIVE_TARGET_TEXT_HEIGHT_PX / text_height, ADAPTIVE_MIN_SCALE), ADAPTIVE_MAX_SCALE)
+    # Never produce more pixels than the fixed mode would
+    max_scale_for_area = (TARGET_WIDTH_FIXED * TARGET_HEIGHT_FIXED / float(original_width * original_height)) ** 0.5
+    working_scale = min(working_scale, max_scale_for_area)
+    target_w = max(1, int(round(original_width * working_scale))); target_h = max(1, int(round(original_height * working_scale)))
+    print(f"[OCR Pipeline] Adaptive resize: text height ~{text_height:.1f}px, scale {working_scale:.3f} -> {target_w}x{target_h}")
+    if (target_w, target_h) != (original_width, original_height):
+        interpolation = cv2.INTER_AREA if working_scale < 1.0 else cv2.INTER_CUBIC
+        img_color = cv2.resize(img_color, (target_w, target_h), interpolation=interpolation)
+    param_scale = (text_height * working_scale) / REFERENCE_TEXT_HEIGHT_PX
+    return img_color, param_scale
+
+def _px(value, param_scale, minimum=1):
+    # Scales a pixel-valued constant; param_scale None keeps the fixed-resolution value unchanged.
+    if param_scale is None: return value
+    return max(minimum, int(round(value * param_scale)))
+
+def _px_area(value, param_scale, minimum=1):
+    if param_scale is None: return value
+    return max(minimum, value * param_scale * param_scale)
+
+def _should_merge_boxes(merged_box_candidate_coords, box2_coords, merge_line_tolerance):
+    # Pairwise merge decision of merge_split_boxes_inline (vertical proximity, x-overlap, center alignment, Lamed-overhang guard)
+    x1, y1, w1, h1 = merged_box_candidate_coords; x2, y2, w2, h2 = box2_coords
+    vertical_distance = max(0, y2 - (y1 + h1), y1 - (y2 + h2)); v_overlap = max(0, min(y1 + h1, y2 + h2) - max(y1, y2))
+    if vertical_distance >= merge_line_tolerance and v_overlap < min(h1,h2) * 0.2: return False
+    overlap_x_start = max(x1, x2); overlap_x_end = min(x1 + w1, x2 + w2); overlap_width = max(0, overlap_x_end - overlap_x_start)
+    min_w_local = min(w1, w2) if w1 > 0 and w2 > 0 else 0; overlap_needed = (min_w_local * MIN_X_OVERLAP_RATIO_MERGE)
+    has_horizontal_overlap = (overlap_width > overlap_needed) if min_w_local > 0 else (overlap_width > 0)
+    center1_x = x1 + w1 / 2.0; center2_x = x2 + w2 / 2.0; center_x_diff = abs(center1_x - center2_x)
+    max_w_local = max(w1, w2) if w1 > 0 or w2 > 0 else 0; alignment_limit = (max_w_local * MAX_CENTER_X_DIFF_RATIO_MERGE)
+    is_center_aligned = (center_x_diff < alignment_limit) if max_w_local > 0 else True
+    if not (has_horizontal_overlap and is_center_aligned): return False
+    if RTL_ENABLED and PREVENT_LAMED_OVERHANG_MERGE:
+        box_L_coords, box_R_coords = (None, None)
+        if x1 > x2 : box_L_coords, box_R_coords = merged_box_candidate_coords, box2_coords
+        elif x2 > x1: box_L_coords, box_R_coords = box2_coords, merged_box_candidate_coords
+        if box_L_coords and box_R_coords and (box_L_coords[0] > box_R_coords[0]):
+            xl, yl, wl, hl = box_L_coords; xr, yr, wr, hr = box_R_coords
+            is_L_taller_shape = hl > (hr * LAMED_CANDIDATE_MIN_HEIGHT_RATIO) and wl <= (hl * LAMED_CANDIDATE_MAX_WIDTH_RATIO)
+            if is_L_taller_shape:
+                lamed_rtl_right_edge = xl - wl
+                is_R_under_L_span = xr < xl and xr > lamed_rtl_right_edge - wr*0.2
+                is_R_narrower = wr < wl * 0.8
+                y_condition = (yr >= yl - hr * 0.3) and (yr < yl + hl * 0.75)
+                if y_condition and is_R_under_L_span and is_R_narrower :
+                    if wr > wl * EATEN_CHAR_MIN_WIDTH_RATIO_OF_LAMED:
+                        return False # prevent_this_merge
+    return True
+
+def merge_split_boxes_inline(boxes, avg_char_height, param_scale=None):
+    # Greedy fixed-point merge: each pass walks the boxes in (y, x) order and grows a candidate with every later,
+    # unprocessed box that passes _should_merge_boxes against the grown candidate. A merge needs x-overlap, so
+    # only boxes overlapping the candidate's x-extent are looked up (x-sorted index) instead of testing all pairs.
     if len(boxes) < 2: return boxes
-    merge_line_tolerance = max(5, avg_char_height * 0.5)
+    merge_line_tolerance = max(_px(5, param_scale), avg_char_height * 0.5)
     merged_something_overall = True; current_boxes = list(boxes)
     merge_iterations = 0; MAX_MERGE_ITERATIONS = 10
     while merged_something_overall and merge_iterations < MAX_MERGE_ITERATIONS:
-        merged_something_overall = False; processed_indices = set(); next_boxes = []
+        merged_something_overall = False; next_boxes = []
         current_boxes.sort(key=lambda b: (b[1], b[0]))
-        indices_to_process = list(range(len(current_boxes)))
-        for i in indices_to_process:
-            if i in processed_indices: continue
-            merged_box_candidate_coords = list(current_boxes[i]); merged_with_indices = {i}
-            for j in range(len(current_boxes)):
-                if i == j or j in processed_indices: continue
-                box2_coords = current_boxes[j]
-                x1, y1, w1, h1 = merged_box_candidate_coords; x2, y2, w2, h2 = box2_coords
-                vertical_distance = max(0, y2 - (y1 + h1), y1 - (y2 + h2)); v_overlap = max(0, min(y1 + h1, y2 + h2) - max(y1, y2))
-                if vertical_distance >= merge_line_tolerance and v_overlap < min(h1,h2) * 0.2: continue
-                overlap_x_start = max(x1, x2); overlap_x_end = min(x1 + w1, x2 + w2); overlap_width = max(0, overlap_x_end - overlap_x_start)
-                min_w_local = min(w1, w2) if w1 > 0 and w2 > 0 else 0; overlap_needed = (min_w_local * min_x_overlap_ratio)
-                has_horizontal_overlap = (overlap_width > overlap_needed) if min_w_local > 0 else (overlap_width > 0)
-                center1_x = x1 + w1 / 2.0; center2_x = x2 + w2 / 2.0; center_x_diff = abs(center1_x - center2_x)
-                max_w_local = max(w1, w2) if w1 > 0 or w2 > 0 else 0; alignment_limit = (max_w_local * max_center_x_diff_ratio)
-                is_center_aligned = (center_x_diff < alignment_limit) if max_w_local > 0 else True
-                if has_horizontal_overlap and is_center_aligned:
-                    prevent_this_merge = False
-                    if RTL_ENABLED and PREVENT_LAMED_OVERHANG_MERGE:
-                        box_L_coords, box_R_coords = (None, None)
-                        if x1 > x2 : box_L_coords, box_R_coords = merged_box_candidate_coords, box2_coords
-                        elif x2 > x1: box_L_coords, box_R_coords = box2_coords, merged_box_candidate_coords
-                        if box_L_coords and box_R_coords and (box_L_coords[0] > box_R_coords[0]):
-                            xl, yl, wl, hl = box_L_coords; xr, yr, wr, hr = box_R_coords
-                            is_L_taller_shape = hl > (hr * LAMED_CANDIDATE_MIN_HEIGHT_RATIO) and wl <= (hl * LAMED_CANDIDATE_MAX_WIDTH_RATIO)
-                            if is_L_taller_shape:
-                                lamed_rtl_right_edge = xl - wl
-                                is_R_under_L_span = xr < xl and xr > lamed_rtl_right_edge - wr*0.2
-                                is_R_narrower = wr < wl * 0.8
-                                y_condition = (yr >= yl - hr * 0.3) and (yr < yl + hl * 0.75)
-                                if y_condition and is_R_under_L_span and is_R_narrower :
-                                    if wr > wl * EATEN_CHAR_MIN_WIDTH_RATIO_OF_LAMED:
-                                        prevent_this_merge = True
-                    if not prevent_this_merge:
-                        merged_x=min(x1,x2); merged_y=min(y1,y2); merged_w=max(x1+w1,x2+w2)-merged_x; merged_h=max(y1+h1,y2+h2)-merged_y
-                        merged_box_candidate_coords=[merged_x,merged_y,merged_w,merged_h]; merged_with_indices.add(j); merged_something_overall=True
-            next_boxes.append(tuple(merged_box_candidate_coords)); processed_indices.update(merged_with_indices)
+        num_boxes = len(current_boxes); processed = [False] * num_boxes
+        by_x_start = sorted(range(num_boxes), key=lambda k: current_boxes[k][0])
+        x_starts = [current_boxes[k][0] for k in by_x_start]
+        max_box_w = max(b[2] for b in current_boxes)
+
+        def queue_x_overlaps(cand, after_index, heap, queued):
+            # Unprocessed boxes after `after_index` (in walk order) whose x-extent overlaps the candidate's
+            cand_x_start = cand[0]; cand_x_end = cand[0] + cand[2]
+            lo = bisect.bisect_right(x_starts, cand_x_start - max_box_w); hi = bisect.bisect_left(x_starts, cand_x_end)
+            for k in by_x_start[lo:hi]:
+                if k <= after_index or processed[k] or k in queued: continue
+                x_k, _, w_k, _ = current_boxes[k]
+                if min(x_k + w_k, cand_x_end) - max(x_k, cand_x_start) > 0:
+                    heapq.heappush(heap, k); queued.add(k)
+
+        for i in range(num_boxes):
+            if processed[i]: continue
+            processed[i] = True; merged_box_candidate_coords = list(current_boxes[i])
+            heap = []; queued = set()
+            queue_x_overlaps(merged_box_candidate_coords, i, heap, queued)
+            while heap:
+                j = heapq.heappop(heap)
+                x1, y1, w1, h1 = merged_box_candidate_coords; x2, y2, w2, h2 = current_boxes[j]
+                if _should_merge_boxes(merged_box_candidate_coords, current_boxes[j], merge_line_tolerance):
+                    merged_x=min(x1,x2); merged_y=min(y1,y2); merged_w=max(x1+w1,x2+w2)-merged_x; merged_h=max(y1+h1,y2+h2)-merged_y
+                    merged_box_candidate_coords=[merged_x,merged_y,merged_w,merged_h]; processed[j] = True; merged_something_overall=True
+                    queue_x_overlaps(merged_box_candidate_coords, j, heap, queued) # the grown candidate may reach further boxes
+            next_boxes.append(tuple(merged_box_candidate_coords))
         current_boxes = next_boxes; merge_iterations += 1
         if merge_iterations == MAX_MERGE_ITERATIONS and merged_something_overall:
             if DEBUG_VISUALIZE: print("[C-WARN] Reached max merge iterations.")
     return current_boxes
 
-def segment_image_to_lines(img_color_input, base_filename="input_image"):
+LINE_SEGMENT_DTYPE = np.dtype([('start_raw', np.int64), ('end_raw', np.int64), ('hpp_sum', np.uint64),
+                               ('start_adj', np.int64), ('end_adj', np.int64), ('start_final', np.int64), ('end_final', np.int64)])
+
+def find_line_segments(horizontal_projection, threshold, img_height, param_scale=None):
+    """
+    Text-line runs of the horizontal projection profile, as a LINE_SEGMENT_DTYPE array.
+    Runs above threshold are filtered by height and ink density, their boundaries moved to
+    the midpoint of the gap to the neighbouring run and the outer ones extended by
+    BOUNDARY_EXTEND_RATIO of the average line height.
+    """
+    empty = np.empty(0, dtype=LINE_SEGMENT_DTYPE)
+    above = np.concatenate(([False], horizontal_projection > threshold, [False]))
+    edges = np.flatnonzero(above[1:] != above[:-1])
+    if edges.size == 0: return empty
+    starts_raw = edges[0::2]; ends_raw = edges[1::2]
+    # Exact integer run sums via a cumulative sum (same values as summing each slice)
+    cumulative = np.concatenate((np.zeros(1, dtype=horizontal_projection.dtype), np.cumsum(horizontal_projection)))
+    hpp_sums = cumulative[ends_raw] - cumulative[starts_raw]
+    heights = ends_raw - starts_raw
+    avg_line_height_raw = int(heights.sum()) / len(heights)
+    min_sensible_height = max(_px(8, param_scale), avg_line_height_raw * 0.25)
+    avg_hpp_sum_per_pixel_height = hpp_sums.sum() / int(heights.sum())
+    min_sensible_hpp_density = avg_hpp_sum_per_pixel_height * HPP_DENSITY_FILTER_RATIO
+    keep = heights >= min_sensible_height
+    if avg_hpp_sum_per_pixel_height > 0.01: keep &= (hpp_sums / heights) >= min_sensible_hpp_density
+    if not keep.any(): return empty
+
+    segments = np.empty(int(keep.sum()), dtype=LINE_SEGMENT_DTYPE)
+    segments['start_raw'] = starts_raw[keep]; segments['end_raw'] = ends_raw[keep]; segments['hpp_sum'] = hpp_sums[keep]
+    starts = segments['start_raw']; ends = segments['end_raw']
+    avg_line_height = int((ends - starts).sum()) / len(segments)
+    start_adj = starts.copy(); end_adj = ends.copy()
+    prev_ends = ends[:-1]; next_starts = starts[1:]
+    start_adj[1:] = np.where(starts[1:] > prev_ends, prev_ends + (starts[1:] - prev_ends) // 2, starts[1:])
+    end_adj[:-1] = np.where(next_starts > ends[:-1], ends[:-1] + (next_starts - ends[:-1]) // 2, ends[:-1])
+    segments['start_adj'] = start_adj; segments['end_adj'] = end_adj
+    boundary_extension_amount = int(avg_line_height * BOUNDARY_EXTEND_RATIO) if avg_line_height > 0 else int(20 * BOUNDARY_EXTEND_RATIO)
+    segments['start_final'] = start_adj; segments['end_final'] = end_adj
+    segments['start_final'][0] = max(0, int(start_adj[0]) - boundary_extension_amount)
+    segments['end_final'][-1] = min(img_height, int(end_adj[-1]) + boundary_extension_amount)
+    return segments
+
+def segment_image_to_lines(img_color_input, base_filename="input_image", param_scale=None):
     line_crops = []
     base_fn_for_debug = os.path.splitext(base_filename)[0]
     try:
@@ -170,21 +368,23 @@ def segment_image_to_lines(img_color_input, base_filename="input_image"):
         img_gray = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY)
         _, img_binary_orig = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
         save_debug_image(img_binary_orig, base_fn_for_debug, step_name="L0_InitialBinary")
-        line_kernel_len = max(15, img_width // LINE_REMOVAL_KERNEL_LENGTH_DIV)
+        if param_scale is None: line_kernel_len = max(15, img_width // LINE_REMOVAL_KERNEL_LENGTH_DIV)
+        else: line_kernel_len = max(15, _px(TARGET_WIDTH_FIXED // LINE_REMOVAL_KERNEL_LENGTH_DIV, param_scale))
         horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (line_kernel_len, 1))
         img_opened = cv2.morphologyEx(img_binary_orig, cv2.MORPH_OPEN, horizontal_kernel, iterations=1)
         img_no_lines = cv2.subtract(img_binary_orig, img_opened)
         save_debug_image(img_no_lines, base_fn_for_debug, step_name="L1_AfterLineRemoval")
         img_for_hpp = img_no_lines.copy()
         if VERTICAL_RECONNECT_KERNEL_HEIGHT > 0:
-            reconnect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, VERTICAL_RECONNECT_KERNEL_HEIGHT))
+            reconnect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, _px(VERTICAL_RECONNECT_KERNEL_HEIGHT, param_scale)))
             img_for_hpp = cv2.morphologyEx(img_for_hpp, cv2.MORPH_CLOSE, reconnect_kernel)
             save_debug_image(img_for_hpp, base_fn_for_debug, step_name="L2_AfterVReconnect")
         horizontal_projection = np.sum(img_for_hpp, axis=1)
         max_proj_val = np.max(horizontal_projection); threshold = 0
         if max_proj_val > 0:
              threshold = max_proj_val * PROJECTION_THRESHOLD_RATIO
-        if DEBUG_VISUALIZE and 'matplotlib' in sys.modules:
+        if DEBUG_VISUALIZE:
+            plt = _pyplot()
             plt.figure(figsize=(12, max(6, img_height / 40)))
             plt.plot(horizontal_projection, range(img_height))
             plt.gca().invert_yaxis(); plt.title(f"HPP for {base_fn_for_debug} (After Line Removal & Reconnect)")
@@ -199,66 +399,11 @@ def segment_image_to_lines(img_color_input, base_filename="input_image"):
                 except Exception as e_save: print(f"  [L-ERROR] Failed to save HPP plot {hpp_filepath}: {e_save}")
             plt.close()
         if max_proj_val == 0: return []
-        in_line = False; initial_segments_raw = []; start_y = 0
-        for y in range(img_height):
-            if horizontal_projection[y] > threshold and not in_line: in_line = True; start_y = y
-            elif horizontal_projection[y] <= threshold and in_line:
-                in_line = False; end_y = y
-                if end_y > start_y:
-                    initial_segments_raw.append({'start_raw': start_y, 'end_raw': end_y, 'hpp_sum': np.sum(horizontal_projection[start_y:end_y])})
-        if in_line:
-            end_y = img_height
-            if end_y > start_y:
-                 initial_segments_raw.append({'start_raw': start_y, 'end_raw': end_y, 'hpp_sum': np.sum(horizontal_projection[start_y:end_y])})
-        if not initial_segments_raw: return []
-        avg_line_height_raw = sum(s['end_raw'] - s['start_raw'] for s in initial_segments_raw) / len(initial_segments_raw) if initial_segments_raw else 30
-        min_sensible_height = max(8, avg_line_height_raw * 0.25)
-        avg_hpp_sum_per_pixel_height = 0
-        if initial_segments_raw:
-            total_hpp_sum_for_avg = sum(s['hpp_sum'] for s in initial_segments_raw)
-            total_height_sum_for_avg = sum(s['end_raw'] - s['start_raw'] for s in initial_segments_raw if (s['end_raw'] - s['start_raw']) > 0)
-            if total_height_sum_for_avg > 0:
-                avg_hpp_sum_per_pixel_height = total_hpp_sum_for_avg / total_height_sum_for_avg
-        min_sensible_hpp_density = avg_hpp_sum_per_pixel_height * HPP_DENSITY_FILTER_RATIO
-        filtered_segments = []
-        for seg in initial_segments_raw:
-            height = seg['end_raw'] - seg['start_raw']
-            hpp_density_this_seg = 0
-            if height > 0: hpp_density_this_seg = seg['hpp_sum'] / height
-            passes_height_filter = height >= min_sensible_height
-            passes_density_filter = True
-            if avg_hpp_sum_per_pixel_height > 0.01 : passes_density_filter = hpp_density_this_seg >= min_sensible_hpp_density
-            if passes_height_filter and passes_density_filter:
-                filtered_segments.append(seg)
-        initial_segments = filtered_segments
-        if not initial_segments: return []
-        avg_line_height = sum(s['end_raw'] - s['start_raw'] for s in initial_segments) / len(initial_segments) if initial_segments else 30
-        adjusted_segments = []
-        num_segments = len(initial_segments)
-        for i in range(num_segments):
-            current_seg = initial_segments[i].copy()
-            adjusted_start = current_seg['start_raw']; adjusted_end = current_seg['end_raw']
-            curr_start_raw = current_seg['start_raw']; curr_end_raw = current_seg['end_raw']
-            if i > 0:
-                prev_seg = initial_segments[i-1]; prev_end_raw = prev_seg['end_raw']
-                if curr_start_raw > prev_end_raw: adjusted_start = prev_end_raw + (curr_start_raw - prev_end_raw) // 2
-            if i < num_segments - 1:
-                next_seg = initial_segments[i+1]; next_start_raw = next_seg['start_raw']
-                if next_start_raw > curr_end_raw: adjusted_end = curr_end_raw + (next_start_raw - curr_end_raw) // 2
-            current_seg['start_adj'] = adjusted_start; current_seg['end_adj'] = adjusted_end
-            adjusted_segments.append(current_seg)
-        final_adjusted_segments = []
-        boundary_extension_amount = int(avg_line_height * BOUNDARY_EXTEND_RATIO) if avg_line_height > 0 else int(20 * BOUNDARY_EXTEND_RATIO)
-        for i, seg in enumerate(adjusted_segments):
-            current_final_seg = seg.copy()
-            final_start, final_end = seg['start_adj'], seg['end_adj']
-            if i == 0: final_start = max(0, seg['start_adj'] - boundary_extension_amount)
-            if i == num_segments - 1: final_end = min(img_height, seg['end_adj'] + boundary_extension_amount)
-            current_final_seg['start_final'] = final_start; current_final_seg['end_final'] = final_end
-            final_adjusted_segments.append(current_final_seg)
-        for i, seg in enumerate(final_adjusted_segments):
-            crop_y_start = max(0, seg['start_final'] - LINE_CROP_PADDING)
-            crop_y_max = min(img_height, seg['end_final'] + LINE_CROP_PADDING)
+        final_adjusted_segments = find_line_segments(horizontal_projection, threshold, img_height, param_scale=param_scale)
+        line_crop_padding = _px(LINE_CROP_PADDING, param_scale, minimum=0)
+        for seg in final_adjusted_segments:
+            crop_y_start = max(0, int(seg['start_final']) - line_crop_padding)
+            crop_y_max = min(img_height, int(seg['end_final']) + line_crop_padding)
             line_crop = None
             if crop_y_max > crop_y_start:
                 line_crop = img_gray[crop_y_start:crop_y_max, :]
@@ -267,7 +412,7 @@ def segment_image_to_lines(img_color_input, base_filename="input_image"):
         if DEBUG_VISUALIZE:
             img_lines_drawn = cv2.cvtColor(img_for_hpp, cv2.COLOR_GRAY2BGR)
             for i, seg_draw in enumerate(final_adjusted_segments):
-                s, e = seg_draw['start_final'], seg_draw['end_final']
+                s, e = int(seg_draw['start_final']), int(seg_draw['end_final'])
                 color = (0, 255, 0) if i % 2 == 0 else (0, 0, 255)
                 cv2.line(img_lines_drawn, (0, s), (img_width, s), color, 1)
                 cv2.line(img_lines_drawn, (0, e), (img_width, e), color, 1)
@@ -278,7 +423,91 @@ def segment_image_to_lines(img_color_input, base_filename="input_image"):
         print(f"\n[L-ERROR] Error in line segmentation for {base_fn_for_debug}: {e}")
         traceback.print_exc(); return None
 
-def segment_line_to_items(line_image_gray, line_index, base_filename="input_image"):
+def extract_letter_boxes_contours(img_binary, line_h_orig, param_scale=None, debug_image=None):
+    # Outer contours of the closed line binary, filtered by position, size, area and aspect ratio.
+    # Kept (green) and rejected (red) boxes are drawn on debug_image when given.
+    contours, hierarchy = cv2.findContours(img_binary.copy(), cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None: hierarchy = np.array([[[-1,-1,-1,-1]]])
+    elif len(contours) > 0 and hierarchy.ndim == 3 and hierarchy.shape[1] != len(contours):
+         hierarchy = hierarchy[:, :len(contours), :] if hierarchy.shape[1] > len(contours) else hierarchy
+    initial_boxes = []
+    top_fragment_max_start_y = _px(TOP_FRAGMENT_MAX_START_Y, param_scale, minimum=0)
+    min_contour_area = _px_area(MIN_CONTOUR_AREA_LETTER, param_scale); max_contour_area = _px_area(MAX_CONTOUR_AREA_LETTER, param_scale)
+    if contours and len(hierarchy) > 0 and hierarchy.ndim == 3 :
+        for i_contour, contour in enumerate(contours):
+             if i_contour >= hierarchy.shape[1]: continue
+             parent_index = hierarchy[0][i_contour][3]; is_inner = (parent_index != -1)
+             area = cv2.contourArea(contour); x, y, w, h = cv2.boundingRect(contour)
+             aspect_ratio = w / float(h) if h > 0 else 0
+             filter_reason = ""
+             if FILTER_TOP_FRAGMENTS:
+                 if y <= top_fragment_max_start_y and (y + h) < (line_h_orig * TOP_FRAGMENT_MAX_END_Y_RATIO):
+                     filter_reason = f"Top Fragment"
+             if not filter_reason:
+                 if is_inner: filter_reason = "Inner Contour"
+                 elif w <= 1 or h <= 1: filter_reason = "Too Small (W/H)"
+                 elif not (min_contour_area <= area <= max_contour_area): filter_reason = f"Area"
+                 elif not (MIN_ASPECT_RATIO_LETTER <= aspect_ratio <= MAX_ASPECT_RATIO_LETTER): filter_reason = f"Aspect Ratio"
+             if not filter_reason:
+                 initial_boxes.append((x, y, w, h))
+                 if debug_image is not None: cv2.rectangle(debug_image, (x,y), (x+w,y+h), (0,255,0),1)
+             elif debug_image is not None:
+                 cv2.rectangle(debug_image, (x,y), (x+w,y+h), (0,0,255),1)
+    return initial_boxes
+
+def _component_outer_contours(labels, num_labels, stats):
+    # Area (as cv2.contourArea) and findContours order of each component's outer contour, without tracing it.
+    # The contour runs through the centres of the boundary pixels, so over the filled component (holes included)
+    # each 2x2 pixel cell fully inside adds 1 and each cell with three pixels inside adds the 0.5 triangle it cuts off.
+    row = labels.shape[1] + 2
+    padded = np.pad(labels, 1); flat = padded.ravel() # zero border: neighbours and 2x2 cells never wrap around
+    # First (top-left) pixel of each component, searched on the component top rows only
+    top_rows = np.unique(stats[1:, cv2.CC_STAT_TOP]) + 1; row_labels = padded[top_rows]
+    row_idx, xs = np.nonzero((row_labels > 0) & (stats[row_labels, cv2.CC_STAT_TOP] + 1 == top_rows[:, None]))
+    first_labels, first_idx = np.unique(row_labels[row_idx, xs], return_index=True)
+    first = top_rows[row_idx[first_idx]] * row + xs[first_idx]
+    owner = flat; nested = np.zeros(0, dtype=np.int64)
+    filled = (padded > 0).astype(np.uint8)
+    cv2.floodFill(filled, None, (0, 0), 2, flags=4) # background reachable from outside; holes stay 0
+    if (filled == 0).any():
+        # Label the components with their holes filled in. A component inside another one's hole joins that
+        # region, whose first pixel is the outermost component's; the nested ones are measured directly below.
+        _, regions = cv2.connectedComponents((filled != 2).view(np.uint8), connectivity=8)
+        owner = regions.ravel()
+        region_first = np.full(owner.max() + 1, flat.size); np.minimum.at(region_first, owner[first], first)
+        nested = first_labels[region_first[owner[first]] != first]
+    inside_px = (owner > 0).view(np.uint8)
+    inside = inside_px[:-row - 1] + inside_px[1:-row] + inside_px[row:-1] + inside_px[row + 1:]
+    cells = np.flatnonzero(inside >= 3) # a cell missing one pixel still has its top-left or bottom-right one
+    region_areas = np.bincount(np.maximum(owner[cells], owner[cells + row + 1]), weights=np.where(inside[cells] == 4, 1.0, 0.5), minlength=owner.max() + 1)
+    areas = np.zeros(num_labels); areas[first_labels] = region_areas[owner[first]]
+    for label in nested.tolist():
+        x, y, w, h = stats[label, :4].tolist()
+        contours, _ = cv2.findContours((labels[y:y + h, x:x + w] == label).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        areas[label] = cv2.contourArea(contours[0])
+    order = first_labels[np.argsort(first)[::-1]] # findContours lists outer contours by first pixel, bottom-up
+    return areas, order
+
+def extract_letter_boxes_components(img_binary, line_h_orig, param_scale=None, debug_image=None):
+    # Same filters as extract_letter_boxes_contours, applied as masks over connectedComponentsWithStats.
+    # 8-connected components have the bounding boxes of the outer contours; holes never form components.
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(img_binary, 8, cv2.CV_32S, cv2.CCL_BBDT)
+    areas, order = _component_outer_contours(labels, num_labels, stats)
+    area = areas[order]; stats = stats[order] # label 0 (the background) is not in order
+    x = stats[:, cv2.CC_STAT_LEFT]; y = stats[:, cv2.CC_STAT_TOP]; w = stats[:, cv2.CC_STAT_WIDTH]; h = stats[:, cv2.CC_STAT_HEIGHT]
+    aspect_ratio = w / h.astype(np.float64) # components are never empty
+    top_fragment_max_start_y = _px(TOP_FRAGMENT_MAX_START_Y, param_scale, minimum=0)
+    min_contour_area = _px_area(MIN_CONTOUR_AREA_LETTER, param_scale); max_contour_area = _px_area(MAX_CONTOUR_AREA_LETTER, param_scale)
+    keep = (w > 1) & (h > 1) & (area >= min_contour_area) & (area <= max_contour_area)
+    keep &= (aspect_ratio >= MIN_ASPECT_RATIO_LETTER) & (aspect_ratio <= MAX_ASPECT_RATIO_LETTER)
+    if FILTER_TOP_FRAGMENTS:
+        keep &= ~((y <= top_fragment_max_start_y) & ((y + h) < (line_h_orig * TOP_FRAGMENT_MAX_END_Y_RATIO)))
+    if debug_image is not None:
+        for (bx, by, bw, bh), kept in zip(stats[:, :4].tolist(), keep.tolist()):
+            cv2.rectangle(debug_image, (bx, by), (bx + bw, by + bh), (0, 255, 0) if kept else (0, 0, 255), 1)
+    return [tuple(box) for box in stats[keep, :4].tolist()]
+
+def segment_line_to_items(line_image_gray, line_index, base_filename="input_image", param_scale=None, trace=None):
     base_fn_for_debug = os.path.splitext(base_filename)[0]
     output_items = []
     if line_image_gray is None or line_image_gray.size == 0: return []
@@ -288,43 +517,26 @@ def segment_line_to_items(line_image_gray, line_index, base_filename="input_imag
         save_debug_image(line_binary, base_fn_for_debug, line_idx=line_index, step_name="C0_LineBinary")
         img_for_contours = line_binary.copy()
         if MORPH_KERNEL_SIZE_LETTERS > 0:
-            kernel = np.ones((MORPH_KERNEL_SIZE_LETTERS, MORPH_KERNEL_SIZE_LETTERS), np.uint8)
+            morph_kernel_size = _px(MORPH_KERNEL_SIZE_LETTERS, param_scale)
+            kernel = np.ones((morph_kernel_size, morph_kernel_size), np.uint8)
             img_for_contours = cv2.morphologyEx(line_binary, cv2.MORPH_CLOSE, kernel)
             save_debug_image(img_for_contours, base_fn_for_debug, line_idx=line_index, step_name="C1_LineClosed")
-        contours, hierarchy = cv2.findContours(img_for_contours.copy(), cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-        if hierarchy is None: hierarchy = np.array([[[-1,-1,-1,-1]]])
-        elif len(contours) > 0 and hierarchy.ndim == 3 and hierarchy.shape[1] != len(contours):
-             hierarchy = hierarchy[:, :len(contours), :] if hierarchy.shape[1] > len(contours) else hierarchy
-        initial_boxes = []
         line_color_copy_filt = None
         if DEBUG_VISUALIZE: line_color_copy_filt = cv2.cvtColor(line_image_gray, cv2.COLOR_GRAY2BGR)
-        if contours and len(hierarchy) > 0 and hierarchy.ndim == 3 :
-            for i_contour, contour in enumerate(contours):
-                 if i_contour >= hierarchy.shape[1]: continue
-                 parent_index = hierarchy[0][i_contour][3]; is_inner = (parent_index != -1)
-                 area = cv2.contourArea(contour); x, y, w, h = cv2.boundingRect(contour)
-                 aspect_ratio = w / float(h) if h > 0 else 0
-                 filter_reason = ""
-                 if FILTER_TOP_FRAGMENTS:
-                     if y <= TOP_FRAGMENT_MAX_START_Y and (y + h) < (line_h_orig * TOP_FRAGMENT_MAX_END_Y_RATIO):
-                         filter_reason = f"Top Fragment"
-                 if not filter_reason:
-                     if is_inner: filter_reason = "Inner Contour"
-                     elif w <= 1 or h <= 1: filter_reason = "Too Small (W/H)"
-                     elif not (MIN_CONTOUR_AREA_LETTER <= area <= MAX_CONTOUR_AREA_LETTER): filter_reason = f"Area"
-                     elif not (MIN_ASPECT_RATIO_LETTER <= aspect_ratio <= MAX_ASPECT_RATIO_LETTER): filter_reason = f"Aspect Ratio"
-                 if not filter_reason:
-                     initial_boxes.append((x, y, w, h))
-                     if DEBUG_VISUALIZE and line_color_copy_filt is not None: cv2.rectangle(line_color_copy_filt, (x,y), (x+w,y+h), (0,255,0),1)
-                 elif DEBUG_VISUALIZE and line_color_copy_filt is not None:
-                     cv2.rectangle(line_color_copy_filt, (x,y), (x+w,y+h), (0,0,255),1)
+        if LETTER_BOX_EXTRACTOR == "components":
+            initial_boxes = extract_letter_boxes_components(img_for_contours, line_h_orig, param_scale=param_scale, debug_image=line_color_copy_filt)
+        else:
+            initial_boxes = extract_letter_boxes_contours(img_for_contours, line_h_orig, param_scale=param_scale, debug_image=line_color_copy_filt)
+        if line_color_copy_filt is not None:
             save_debug_image(line_color_copy_filt, base_fn_for_debug, line_idx=line_index, step_name="C2_InitialFilteredContours")
         if not initial_boxes: return []
         avg_height = np.mean([b[3] for b in initial_boxes]) if initial_boxes else 10
         avg_width = np.mean([b[2] for b in initial_boxes]) if initial_boxes else 10
-        avg_height = max(5, avg_height); avg_width = max(1, avg_width)
+        avg_height = max(_px(5, param_scale), avg_height); avg_width = max(1, avg_width)
         initial_boxes.sort(key=lambda b: b[0], reverse=RTL_ENABLED)
-        merged_boxes = merge_split_boxes_inline(initial_boxes, avg_height)
+        with trace_stage(trace, "merge_boxes") as stage:
+            merged_boxes = merge_split_boxes_inline(initial_boxes, avg_height, param_scale=param_scale)
+            stage.items = len(initial_boxes)
         merged_boxes.sort(key=lambda b: b[0], reverse=RTL_ENABLED)
         final_boxes_tuples = merged_boxes
         if DEBUG_VISUALIZE:
@@ -344,9 +556,10 @@ def segment_line_to_items(line_image_gray, line_index, base_filename="input_imag
             calculated_threshold = median_gap * SPACE_MULTIPLIER
             space_threshold = max(calculated_threshold, min_abs_space_width)
         else: space_threshold = min_abs_space_width
+        letter_crop_padding = _px(LETTER_CROP_PADDING, param_scale, minimum=0)
         for i_item, (x,y,w,h) in enumerate(final_boxes_tuples):
-            crop_y_s=max(0,y-LETTER_CROP_PADDING); crop_y_m=min(line_h_orig,y+h+LETTER_CROP_PADDING)
-            crop_x_s=max(0,x-LETTER_CROP_PADDING); crop_x_m=min(line_w_orig,x+w+LETTER_CROP_PADDING)
+            crop_y_s=max(0,y-letter_crop_padding); crop_y_m=min(line_h_orig,y+h+letter_crop_padding)
+            crop_x_s=max(0,x-letter_crop_padding); crop_x_m=min(line_w_orig,x+w+letter_crop_padding)
             letter_crop = None
             if crop_y_m > crop_y_s and crop_x_m > crop_x_s:
                 letter_crop = line_image_gray[crop_y_s:crop_y_m, crop_x_s:crop_x_m]
@@ -362,35 +575,122 @@ def segment_line_to_items(line_image_gray, line_index, base_filename="input_imag
         print(f"[C-ERROR] Error in letter segmentation for line {line_index + 1} ({base_fn_for_debug}): {e}")
         traceback.print_exc(); return []
 
+def line_worker_count():
+    return max(1, min(RESOURCE_CONFIG["line_workers"], RESOURCE_CONFIG["cpus"]))
+
+def _get_segmentation_executor(kind, workers):
+    # Separate pools for lines and whole pages, so page tasks never wait on their own pool
+    with segmentation_executors_lock_g:
+        executor = segmentation_executors_g.get(kind)
+        if executor is None or executor._max_workers != workers:
+            if executor is not None: executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ocr-{kind}")
+            segmentation_executors_g[kind] = executor
+            print(f"[OCR Pipeline] {kind.capitalize()} segmentation pool started ({workers} threads).")
+        return executor
+
+def segment_lines_to_items(line_images_gray, base_filename="input_image", param_scale=None, trace=None, parallel=True):
+    """
+    segment_line_to_items over all lines (in parallel when OCR_LINE_WORKERS > 1 and parallel is set).
+    Returns one item list per line, in line order.
+    """
+    def segment_one(indexed_line):
+        line_idx, line_img = indexed_line
+        return segment_line_to_items(line_img, line_idx, base_filename=base_filename, param_scale=param_scale, trace=trace) or []
+    workers = min(line_worker_count(), len(line_images_gray)) if parallel else 1
+    if workers <= 1 or DEBUG_VISUALIZE:
+        return [segment_one(indexed_line) for indexed_line in enumerate(line_images_gray)]
+    return list(_get_segmentation_executor("line", workers).map(segment_one, enumerate(line_images_gray)))
+
+def join_line_items(items_per_line):
+    # Flattens per-line items, separating lines with ('newline', None)
+    all_items = []
+    for line_idx, items_in_line in enumerate(items_per_line):
+        all_items.extend(items_in_line)
+        if line_idx < len(items_per_line) - 1: all_items.append(('newline', None))
+    return all_items
+
 # === MODEL LOADING (ViT and Gemini) ===
-def load_models():
-    global vit_model_g, vit_processor_g, vit_idx2label_g, gemini_model_g, models_loaded_flag
+def resolve_vit_model_path():
+    """
+    The ViT checkpoint directory load_models uses: VIT_MODEL_VERSION (or the CURRENT version) of the
+    model store, else the unversioned VIT_MODEL_PATH when there is no store. Returns (path, artifact),
+    where artifact is ModelRegistry.resolve()'s (version, path, manifest) or None; path is None when
+    the requested version is not available.
+    """
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    actual_vit_model_path = os.path.join(current_script_dir, VIT_MODEL_PATH.lstrip("./\\"))
+    model_store_dir = VIT_MODEL_STORE if os.path.isabs(VIT_MODEL_STORE) else os.path.join(current_script_dir, VIT_MODEL_STORE.lstrip("./\\"))
+    model_artifact = ModelRegistry(model_store_dir).resolve(VIT_MODEL_VERSION or None) if os.path.isdir(model_store_dir) else None
+    if model_artifact is not None:
+        return model_artifact[1], model_artifact
+    if VIT_MODEL_VERSION:
+        print(f"  ERROR: Model version '{VIT_MODEL_VERSION}' is not available in '{model_store_dir}'.")
+        return None, None
+    if not os.path.exists(actual_vit_model_path):
+        print(f"  ERROR: No model version in '{model_store_dir}' and ViT Model directory '{actual_vit_model_path}' not found. "
+              f"Build one with: python prepare_model_artifacts.py --source vit-hebrew-final.zip --store {VIT_MODEL_STORE}")
+    else:
+        print(f"  No model store at '{model_store_dir}'; loading the unversioned model directory.")
+    return actual_vit_model_path, None
+
+def _load_vit_classifier(actual_vit_model_path, current_script_dir, mmap_weights=False):
+    # Returns the classifier for the configured backend, falling back to PyTorch if ONNX is unavailable.
+    # mmap_weights: actual_vit_model_path is a model store artifact whose weights can be mapped in place.
+    if VIT_INFERENCE_BACKEND == "onnx":
+        try:
+            from vit_onnx_backend import OnnxViTClassifier, resolve_onnx_model_path
+            onnx_dir = VIT_ONNX_DIR if os.path.isabs(VIT_ONNX_DIR) else os.path.join(current_script_dir, VIT_ONNX_DIR.lstrip("./\\"))
+            onnx_path = resolve_onnx_model_path(onnx_dir, prefer_int8=VIT_ONNX_PREFER_INT8)
+            if onnx_path is None:
+                print(f"  WARNING: No ONNX model found in '{onnx_dir}'. Run vit_onnx_backend.py to export it. Falling back to PyTorch.")
+            else:
+                classifier = OnnxViTClassifier(onnx_path, actual_vit_model_path, intra_op_threads=RESOURCE_CONFIG["onnx_intra_op_threads"])
+                print(f"  Using ONNX Runtime backend: {onnx_path}")
+                return classifier
+        except Exception as e:
+            print(f"  WARNING: Could not load ONNX backend ({e}). Falling back to PyTorch.")
+            traceback.print_exc()
+    elif VIT_INFERENCE_BACKEND != "torch":
+        print(f"  WARNING: Unknown VIT_INFERENCE_BACKEND '{VIT_INFERENCE_BACKEND}'. Using PyTorch.")
+    if mmap_weights:
+        classifier = load_vit_classifier_mmap(actual_vit_model_path)
+        if classifier is not None:
+            print("  Using memory-mapped safetensors weights.")
+            return classifier
+        print("  WARNING: Could not map the artifact weights. Falling back to from_pretrained.")
+    return ViTForImageClassification.from_pretrained(actual_vit_model_path)
+
+def compute_model_version(model_dir):
+    # Fingerprint of the model config and weight files (name + size), cheap enough to compute at load time.
+    version_parts = []
+    try:
+        for filename in sorted(os.listdir(model_dir)):
+            path = os.path.join(model_dir, filename)
+            if filename == "config.json":
+                with open(path, 'rb') as f: version_parts.append(f.read())
+            elif filename.endswith((".safetensors", ".bin", ".onnx")):
+                version_parts.append(f"{filename}:{os.path.getsize(path)}")
+    except OSError as e:
+        print(f"  Warning: Could not fingerprint model directory '{model_dir}': {e}")
+    return hash_key(*version_parts)[:16]
+
+def load_models(start_threads=True):
+    # start_threads=False: load without starting background threads (a pre-fork parent; see serve_prefork.py)
+    global vit_model_g, vit_processor_g, vit_preprocess_params_g, vit_idx2label_g, vit_scheduler_g, vit_model_version_g, gemini_model_g, models_loaded_flag
     if models_loaded_flag: return True
     print("[OCR Pipeline INFO] Initializing models...")
+    print(f"  Resources: {describe_resource_config()}")
+    import_ml_libraries()
 
     # --- Local ViT Model Loading ---
     # ... (your ViT loading code remains unchanged) ...
     print("  Attempting to load local ViT model...")
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
-    actual_vit_model_path = os.path.join(current_script_dir, VIT_MODEL_PATH.lstrip("./\\"))
-    if not os.path.exists(actual_vit_model_path):
-        zip_file_name = "vit-hebrew-final.zip"
-        zip_path = os.path.join(current_script_dir, zip_file_name)
-        if os.path.exists(zip_path):
-            try:
-                print(f"  Unzipping ViT model from {zip_path} to {current_script_dir}...")
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(current_script_dir)
-                if not os.path.exists(actual_vit_model_path):
-                    print(f"  ERROR: ViT Model still not found at {actual_vit_model_path} after attempting unzip.")
-            except Exception as e:
-                print(f"  Error unzipping ViT model: {e}")
-                traceback.print_exc()
-        else:
-            print(f"  ERROR: ViT Model directory '{actual_vit_model_path}' not found AND zip file '{zip_path}' not found.")
-    if os.path.exists(actual_vit_model_path):
+    actual_vit_model_path, model_artifact = resolve_vit_model_path()
+    if actual_vit_model_path and os.path.exists(actual_vit_model_path):
         try:
-            vit_model_g = ViTForImageClassification.from_pretrained(actual_vit_model_path)
+            vit_model_g = _load_vit_classifier(actual_vit_model_path, current_script_dir, mmap_weights=model_artifact is not None)
             vit_processor_g = ViTImageProcessor.from_pretrained(actual_vit_model_path)
             model_expected_input_size = 224
             desired_processing_size = {"height": model_expected_input_size, "width": model_expected_input_size}
@@ -412,15 +712,25 @@ def load_models():
                     print(f"  ViTImageProcessor.image_processor.size: {getattr(vit_processor_g.image_processor, 'size', 'N/A')}")
             except Exception as e_size:
                 print(f"  Warning: Error setting ViT processor size: {e_size}. Processing might use model's default or fail.")
+            vit_preprocess_params_g = vit_preprocess_params(vit_processor_g)
+            print(f"  Letter preprocessing: {'vectorized' if VIT_FAST_PREPROCESS else 'ViTImageProcessor'} "
+                  f"({vit_preprocess_params_g['height']}x{vit_preprocess_params_g['width']}, mean={vit_preprocess_params_g['mean'].tolist()}, std={vit_preprocess_params_g['std'].tolist()})")
             vit_model_g.eval()
             device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
             vit_model_g.to(device)
+            device = vit_model_g.device
             vit_idx2label_g = vit_model_g.config.id2label
+            # Artifact versions are content-addressed by their manifest; the legacy directory is fingerprinted
+            vit_model_version_g = hash_key(model_artifact[0], model_artifact[2].get("files"))[:16] if model_artifact is not None else compute_model_version(actual_vit_model_path)
             if hasattr(vit_model_g.config, 'image_size'):
                 print(f"  Model's configured image_size from vit_model_g.config: {vit_model_g.config.image_size}")
             else:
                 print(f"  Warning: Could not read image_size directly from vit_model_g.config.")
             print(f"  Local ViT model loaded successfully from '{actual_vit_model_path}' to {device}.")
+            if VIT_SCHEDULER_ENABLED:
+                vit_scheduler_g = ViTBatchScheduler(classify_chars_local_vit_batch, max_batch_size=VIT_BATCH_SIZE, max_wait_ms=VIT_SCHEDULER_MAX_WAIT_MS)
+                if start_threads: vit_scheduler_g.start()
+                print(f"  ViT batch scheduler {'started' if start_threads else 'created'} (max batch: {VIT_BATCH_SIZE}, max wait: {VIT_SCHEDULER_MAX_WAIT_MS}ms).")
         except Exception as e:
             print(f"  Error loading local ViT model: {e}")
             traceback.print_exc()
@@ -438,9 +748,9 @@ def load_models():
         print("  Gemini API Key IS SET. Attempting Gemini load.")
         try:
             print(f"  Configuring Gemini API with key: '{GEMINI_API_KEY[:7]}...{GEMINI_API_KEY[-7:]}'") # Print snippets for confirmation
-            genai.configure(api_key=GEMINI_API_KEY) # <--- This is where it uses the key
+            configure_gemini(GEMINI_API_KEY) # <--- This is where it uses the key
             print("  Gemini API configured successfully.")
-            gemini_model_g = genai.GenerativeModel("models/gemini-1.5-flash-latest")
+            gemini_model_g = get_gemini_model(GEMINI_CORRECTION_MODEL_NAME)
             print("  Gemini model (gemini-1.5-flash-latest) created successfully.")
         except Exception as e:
             print(f"  Error during Gemini API configuration or model creation: {e}")
@@ -452,57 +762,167 @@ def load_models():
     models_loaded_flag = True
     return True
 
+def reinit_after_fork():
+    # Threads do not survive fork(): drop the parent's segmentation pools and (re)start the scheduler thread in this process
+    global segmentation_executors_lock_g
+    segmentation_executors_lock_g = threading.Lock(); segmentation_executors_g.clear()
+    apply_runtime_settings(RESOURCE_CONFIG, torch)
+    if vit_scheduler_g is not None: vit_scheduler_g.start()
+
+def warm_up_pipeline():
+    """
+    Runs a small synthetic page (two lines of 12 letter-sized blocks) through segmentation and ViT
+    classification, so lazy kernel/thread-pool initialization happens before the first
+    request. Skips the caches and Gemini. Returns the wall time in ms, or None without a model.
+    """
+    if vit_model_g is None: return None
+    start = time.perf_counter()
+    page = np.full((600, 900, 3), 255, dtype=np.uint8)
+    for row_top in (120, 360):
+        for col in range(12): cv2.rectangle(page, (60 + col * 32, row_top), (70 + col * 32, row_top + 16), (0, 0, 0), -1)
+    recognize_decoded_image(page, original_filename="warmup")
+    warmup_ms = (time.perf_counter() - start) * 1000.0
+    print(f"[OCR Pipeline INFO] Warm-up inference finished in {warmup_ms:.0f}ms")
+    return warmup_ms
+
 # === CHARACTER CLASSIFICATION (Local ViT) ===
+def char_crop_to_rgb(img_np_char):
+    # Ensure image is RGB for PIL. Returns None for unsupported shapes.
+    if len(img_np_char.shape) == 2: # Grayscale
+        return cv2.cvtColor(img_np_char, cv2.COLOR_GRAY2RGB)
+    elif len(img_np_char.shape) == 3 and img_np_char.shape[2] == 1: # Grayscale with extra dim
+        return cv2.cvtColor(img_np_char, cv2.COLOR_GRAY2RGB)
+    elif len(img_np_char.shape) == 3 and img_np_char.shape[2] == 4: # RGBA
+        return cv2.cvtColor(img_np_char, cv2.COLOR_RGBA2RGB)
+    elif len(img_np_char.shape) == 3 and img_np_char.shape[2] == 3: # Assume BGR from OpenCV
+        return cv2.cvtColor(img_np_char, cv2.COLOR_BGR2RGB)
+    return None
+
+def vit_preprocess_params(processor):
+    # Reads the resize size and normalization constants the ViTImageProcessor would apply.
+    size = getattr(processor, 'size', None)
+    if isinstance(size, dict):
+        height = size.get('height') or size.get('shortest_edge') or 224; width = size.get('width') or height
+    elif isinstance(size, int): height = width = size
+    else: height = width = 224
+    do_rescale = getattr(processor, 'do_rescale', True); do_normalize = getattr(processor, 'do_normalize', True)
+    mean = np.asarray(getattr(processor, 'image_mean', None) or [0.5, 0.5, 0.5], dtype=np.float32) if do_normalize else np.zeros(3, np.float32)
+    std = np.asarray(getattr(processor, 'image_std', None) or [0.5, 0.5, 0.5], dtype=np.float32) if do_normalize else np.ones(3, np.float32)
+    rescale_factor = float(getattr(processor, 'rescale_factor', 1 / 255)) if do_rescale else 1.0
+    return {'height': int(height), 'width': int(width), 'mean': mean, 'std': std, 'rescale_factor': rescale_factor}
+
+def _is_supported_crop(img_np_char):
+    if img_np_char is None or img_np_char.size == 0: return False
+    return img_np_char.ndim == 2 or (img_np_char.ndim == 3 and img_np_char.shape[2] in (1, 3, 4))
+
+def _resize_like_processor(img, target_w, target_h):
+    # ViTImageProcessor resizes with Image.resize(BILINEAR); calling Pillow's C resampler directly gives the
+    # identical pixels. Grayscale crops are resized as one 'L' channel, which Pillow resamples with the same
+    # fixed-point weights as each band of the RGB copy the processor would make.
+    return np.asarray(Image.fromarray(img).resize((target_w, target_h), resample=Image.BILINEAR, reducing_gap=None))
+
+def preprocess_letter_crops(char_crops, params):
+    """
+    Turns letter crops into a normalized (N, 3, H, W) float32 array without ViTImageProcessor.
+    Grayscale crops are resized and normalized as a single channel and only broadcast
+    to the three model channels at the end, which equals gray->RGB followed by the
+    processor's per-channel (x * rescale_factor - mean) / std.
+    """
+    height, width = params['height'], params['width']
+    channel_scale = (params['rescale_factor'] / params['std']).astype(np.float32).reshape(1, 3, 1, 1)
+    channel_offset = (-params['mean'] / params['std']).astype(np.float32).reshape(1, 3, 1, 1)
+    pixel_values = np.empty((len(char_crops), 3, height, width), dtype=np.float32)
+    gray_indices = []; gray_resized = []
+    for crop_idx, img_np_char in enumerate(char_crops):
+        crop_h, crop_w = img_np_char.shape[:2]
+        if img_np_char.ndim == 2 or img_np_char.shape[2] == 1:
+            gray_indices.append(crop_idx)
+            gray_resized.append(_resize_like_processor(img_np_char.reshape(crop_h, crop_w), width, height))
+        else:
+            img_rgb = _resize_like_processor(char_crop_to_rgb(img_np_char), width, height)
+            pixel_values[crop_idx] = img_rgb.transpose(2, 0, 1) * channel_scale[0] + channel_offset[0]
+    if gray_indices:
+        gray_stack = np.stack(gray_resized).astype(np.float32)[:, None, :, :]
+        pixel_values[gray_indices] = gray_stack * channel_scale + channel_offset
+    return pixel_values
+
+def _prepare_vit_batch(char_crops):
+    # Returns the pixel_values tensor for a mini-batch of supported crops.
+    if VIT_FAST_PREPROCESS:
+        params = vit_preprocess_params_g if vit_preprocess_params_g is not None else vit_preprocess_params(vit_processor_g)
+        return torch.from_numpy(preprocess_letter_crops(char_crops, params))
+    return vit_processor_g(images=[Image.fromarray(char_crop_to_rgb(crop)) for crop in char_crops], return_tensors="pt")['pixel_values']
+
 def classify_char_local_vit(img_np_char):
+    """Classifies a single letter crop; returns (label, confidence), ("?", 0.0) on failure."""
+    return classify_chars_local_vit_batch([img_np_char])[0]
+
+def classify_chars_local_vit_batch(char_crops, batch_size=None):
+    """
+    Classifies a list of letter crops with batched ViT forward passes.
+    Returns a list of (label, confidence) tuples in the same order as char_crops.
+    Crops that cannot be converted or whose mini-batch fails get ("?", 0.0).
+    """
     global vit_model_g, vit_processor_g, vit_idx2label_g
+    results = [("?", 0.0)] * len(char_crops)
+    if not char_crops: return results
     if vit_model_g is None or vit_processor_g is None or vit_idx2label_g is None:
-        # print("DEBUG: Local ViT model or processor not loaded, cannot classify.")
-        return "?", 0.0
+        return results
+    batch_size = max(1, batch_size or VIT_BATCH_SIZE)
 
-    try:
-        # Ensure image is RGB for PIL
-        if len(img_np_char.shape) == 2: # Grayscale
-            img_rgb = cv2.cvtColor(img_np_char, cv2.COLOR_GRAY2RGB)
-        elif len(img_np_char.shape) == 3 and img_np_char.shape[2] == 1: # Grayscale with extra dim
-            img_rgb = cv2.cvtColor(img_np_char, cv2.COLOR_GRAY2RGB)
-        elif len(img_np_char.shape) == 3 and img_np_char.shape[2] == 4: # RGBA
-            img_rgb = cv2.cvtColor(img_np_char, cv2.COLOR_RGBA2RGB)
-        elif len(img_np_char.shape) == 3 and img_np_char.shape[2] == 3: # Assume BGR from OpenCV
-             img_rgb = cv2.cvtColor(img_np_char, cv2.COLOR_BGR2RGB)
-        else:
-            # print(f"DEBUG: classify_char_local_vit - Unexpected image shape: {img_np_char.shape}")
-            return "?", 0.0
-        
-        img_pil = Image.fromarray(img_rgb)
-        device = vit_model_g.device
-        
-        inputs = vit_processor_g(images=img_pil, return_tensors="pt").to(device)
-        
-        with torch.no_grad():
-            outputs = vit_model_g(**inputs)
-            logits = outputs.logits
-            predicted_class_idx = logits.argmax(-1).item()
-            # Use vit_idx2label_g to get the actual character label
-            predicted_label = vit_idx2label_g.get(predicted_class_idx, "?")
-            confidence = torch.nn.functional.softmax(logits, dim=-1)[0][predicted_class_idx].item()
-            
-        return predicted_label, confidence
-    except Exception as e:
-        print(f"[ViT Classify ERROR] {e}")
-        traceback.print_exc()
-        return "?", 0.0
+    valid_crops = [(crop_idx, img_np_char) for crop_idx, img_np_char in enumerate(char_crops) if _is_supported_crop(img_np_char)]
+
+    device = vit_model_g.device
+    for batch_start in range(0, len(valid_crops), batch_size):
+        batch = valid_crops[batch_start:batch_start + batch_size]
+        try:
+            pixel_values = _prepare_vit_batch([img_np_char for _, img_np_char in batch]).to(device)
+            with torch.no_grad():
+                logits = vit_model_g(pixel_values=pixel_values).logits
+                confidences, predicted_class_idxs = torch.nn.functional.softmax(logits, dim=-1).max(dim=-1)
+            for (crop_idx, _), class_idx, confidence in zip(batch, predicted_class_idxs.tolist(), confidences.tolist()):
+                results[crop_idx] = (vit_idx2label_g.get(class_idx, "?"), confidence)
+        except Exception as e:
+            print(f"[ViT Batch Classify ERROR] Batch starting at crop {batch_start}: {e}")
+            traceback.print_exc()
+    return results
+
+def classify_items_local_vit(output_items, batch_size=None):
+    """
+    Classifies every ('char', crop) entry of a segmented item list (one page or many)
+    in shared mini-batches. Returns a list aligned with output_items holding
+    (label, confidence) for 'char' items and None for every other item.
+    When the batch scheduler is running, crops are submitted to it so they
+    share forward passes with concurrent requests.
+    """
+    char_positions = [i for i, (item_type, item_data) in enumerate(output_items) if item_type == 'char' and item_data is not None]
+    char_crops = [output_items[i][1] for i in char_positions]
+    if vit_scheduler_g is not None and batch_size is None:
+        char_results = vit_scheduler_g.classify(char_crops)
+    else:
+        char_results = classify_chars_local_vit_batch(char_crops, batch_size=batch_size)
+    item_results = [None] * len(output_items)
+    for item_idx, char_result in zip(char_positions, char_results):
+        item_results[item_idx] = char_result
+    return item_results
+
+def items_to_text(output_items, item_results):
+    # Rebuilds the OCR text from segmented items and their aligned classification results.
+    text_parts = []
+    for (item_type, item_data), item_result in zip(output_items, item_results):
+        if item_type == 'char' and item_data is not None:
+            text_parts.append(item_result[0] if item_result is not None else "?")
+        elif item_type == 'space':
+            text_parts.append(" ")
+        elif item_type == 'newline':
+            text_parts.append("\n")
+        elif item_type == 'error':
+            text_parts.append("?") # Or skip
+    return "".join(text_parts)
 
 # === GEMINI TEXT CORRECTION ===
-def correct_text_gemini(ocr_text):
-    print("\nOCR text BEFORE Gemini correction:\n" + ocr_text)
-    global gemini_model_g
-    if gemini_model_g is None:
-        print("[Gemini] Model not loaded. Skipping correction.")
-        return ocr_text
-    if not ocr_text.strip():
-        print("[Gemini] No text to correct.")
-        return ocr_text
-    prompt = f"""The following Hebrew text is a result of an OCR system recognizing handwritten Hebrew sentences. The OCR system has ~75% character accuracy. Common recognition mistakes include:
+def build_correction_prompt(ocr_text):
+    return f"""The following Hebrew text is a result of an OCR system recognizing handwritten Hebrew sentences. The OCR system has ~75% character accuracy. Common recognition mistakes include:
 - 'ו' mistaken as 'י'
 - 'נ' confused with 'כ'
 - 'ר' and 'פ' are often swapped
@@ -537,37 +957,182 @@ Your task:
 Only output the corrected text in Hebrew. Do not explain anything.
 Fix the following OCR output:
 {ocr_text}"""
+
+def _should_skip_gemini_correction(ocr_text):
+    print("\nOCR text BEFORE Gemini correction:\n" + ocr_text)
+    if gemini_model_g is None:
+        print("[Gemini] Model not loaded. Skipping correction.")
+        return True
+    if not ocr_text.strip():
+        print("[Gemini] No text to correct.")
+        return True
+    return False
+
+def _correction_cache_key(ocr_text):
+    # The template itself is hashed too, so an edited prompt never serves stale corrections
+    return gemini_cache_key("ocr_correction", GEMINI_CORRECTION_MODEL_NAME, None,
+                            hash_key(CORRECTION_PROMPT_VERSION, build_correction_prompt("")), ocr_text)
+
+def _begin_gemini_correction(ocr_text):
+    # Shared front of the sync and async corrections: returns (result, cache_key, prompt), where result is
+    # set when no Gemini call is needed (nothing to correct, or a cached correction).
+    if _should_skip_gemini_correction(ocr_text): return (ocr_text, False), None, None
+    cache_key = _correction_cache_key(ocr_text)
+    cached_text = cached_gemini_response(cache_key)
+    if cached_text is not None:
+        print("[Gemini] Using cached correction."); return (cached_text, False), None, None
+    return None, cache_key, build_correction_prompt(ocr_text)
+
+def _finish_gemini_correction(cache_key, response):
+    print("[Gemini] Received correction from Gemini.")
+    store_gemini_response(cache_key, response.text)
+    return response.text, False
+
+def _failed_gemini_correction(ocr_text, error):
+    GEMINI_CALL_ERRORS.inc(operation="ocr_correction")
+    print(f"[Gemini ERROR] {error}"); traceback.print_exc(); return ocr_text, True
+
+def correct_text_gemini_with_status(ocr_text):
+    # Returns (text, failed); on a failed Gemini call the text is the uncorrected input.
+    result, cache_key, prompt = _begin_gemini_correction(ocr_text)
+    if result is not None: return result
     try:
         print("[Gemini] Sending text to Gemini for correction...")
-        response = gemini_model_g.generate_content(prompt)
-        print("[Gemini] Received correction from Gemini.")
-        return response.text
+        with GEMINI_CALL_SECONDS.time(operation="ocr_correction"):
+            response = gemini_model_g.generate_content(prompt)
+        return _finish_gemini_correction(cache_key, response)
     except Exception as e:
-        print(f"[Gemini ERROR] {e}"); traceback.print_exc(); return ocr_text
+        return _failed_gemini_correction(ocr_text, e)
+
+def correct_text_gemini(ocr_text):
+    return correct_text_gemini_with_status(ocr_text)[0]
+
+async def correct_text_gemini_with_status_async(ocr_text):
+    # Same as correct_text_gemini_with_status, but awaits the Gemini call instead of blocking the event loop.
+    result, cache_key, prompt = _begin_gemini_correction(ocr_text)
+    if result is not None: return result
+    try:
+        print("[Gemini] Sending text to Gemini for correction (async)...")
+        with GEMINI_CALL_SECONDS.time(operation="ocr_correction"):
+            response = await gemini_model_g.generate_content_async(prompt)
+        return _finish_gemini_correction(cache_key, response)
+    except Exception as e:
+        return _failed_gemini_correction(ocr_text, e)
+
+# === OCR RESULT CACHE ===
+def pipeline_config_fingerprint():
+    # Everything besides the image that determines the final text: parameters, model, backend and correction prompt.
+    segmentation_params = {name: globals()[name] for name in SEGMENTATION_PARAM_NAMES}
+    return hash_key(segmentation_params, vit_model_version_g, VIT_INFERENCE_BACKEND, VIT_FAST_PREPROCESS,
+                    GEMINI_CORRECTION_MODEL_NAME if gemini_model_g is not None else "no-gemini", build_correction_prompt(""))
+
+def ocr_cache_key(img_color_orig):
+    return hash_key(str(img_color_orig.shape), str(img_color_orig.dtype), np.ascontiguousarray(img_color_orig).data, pipeline_config_fingerprint())
+
+def store_cached_result(cache_key, final_text, correction_failed=False):
+    # A failed Gemini correction is not cached, so the next request retries it. Gemini returning the text unchanged is a result.
+    if ocr_result_cache_g is None or cache_key is None or correction_failed: return
+    if final_text is None or final_text.startswith("Error:"): return
+    ocr_result_cache_g.put(cache_key, {"recognized_text": final_text})
+
+def decode_and_lookup_cache(image_bytes_content, original_filename="uploaded_image", trace=None):
+    """
+    Decodes the image and looks it up in the result cache.
+    Returns (cache_key, cached_text, img_color_orig): cache_key is None when the cache is off,
+    cached_text is the final corrected text on a hit (else None), and img_color_orig is None
+    when the bytes could not be decoded.
+    """
+    with trace_stage(trace, "decode"):
+        img_color_orig = decode_image_bytes(image_bytes_content)
+    if img_color_orig is None or ocr_result_cache_g is None: return None, None, img_color_orig
+    with trace_stage(trace, "cache_lookup"):
+        cache_key = ocr_cache_key(img_color_orig)
+        cached = ocr_result_cache_g.get(cache_key)
+    if cached is None: return cache_key, None, img_color_orig
+    print(f"[OCR Pipeline] Cache hit for {original_filename} ({cache_key[:12]})")
+    return cache_key, cached["recognized_text"], img_color_orig
+
+def ocr_cache_stats():
+    return ocr_result_cache_g.stats() if ocr_result_cache_g is not None else {"enabled": False}
 
 # === MAIN OCR PIPELINE FUNCTION ===
-def process_image_pipeline(image_bytes_content, original_filename="uploaded_image"):
+def process_image_pipeline(image_bytes_content, original_filename="uploaded_image", trace=None):
+    """
+    Full pipeline: recognition plus Gemini correction, fronted by the result cache.
+    Pass a pipeline_tracing.PipelineTrace as trace to record per-stage timings.
+    """
     print(f"\n[OCR Pipeline] Starting full processing for: {original_filename}")
+    cache_key, ocr_text_from_local_vit, cache_hit = recognize_image_text_cached(image_bytes_content, original_filename=original_filename, trace=trace)
+    if cache_hit or ocr_text_from_local_vit.startswith("Error:"): return ocr_text_from_local_vit
+
+    # Correct with Gemini
+    with trace_stage(trace, "gemini_correction"):
+        final_corrected_text, correction_failed = correct_text_gemini_with_status(ocr_text_from_local_vit)
+    store_cached_result(cache_key, final_corrected_text, correction_failed)
+
+    print(f"[OCR Pipeline] Processing finished for {original_filename}.")
+    return final_corrected_text
+
+def decode_image_bytes(image_bytes_content):
+    nparr = np.frombuffer(image_bytes_content, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def recognize_image_text_cached(image_bytes_content, original_filename="uploaded_image", trace=None):
+    """
+    Cache-aware front of recognize_image_text.
+    Returns (cache_key, text, cache_hit). On a hit, text is the final corrected text;
+    otherwise it is the raw OCR text (or an "Error:" string) and the caller is expected
+    to correct it and hand the result to store_cached_result(cache_key, ...).
+    """
     if not models_loaded_flag:
         load_models()
+    cache_key, cached_text, img_color_orig = decode_and_lookup_cache(image_bytes_content, original_filename=original_filename, trace=trace)
+    if img_color_orig is None: return None, "Error: Could not decode image.", False
+    if cached_text is not None: return cache_key, cached_text, True
+    return cache_key, recognize_decoded_image(img_color_orig, original_filename=original_filename, trace=trace), False
 
-    nparr = np.frombuffer(image_bytes_content, np.uint8)
-    img_color_orig = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+def recognize_image_text(image_bytes_content, original_filename="uploaded_image", trace=None):
+    """
+    CPU-bound part of the pipeline: decode, segmentation and ViT recognition.
+    Returns the raw (uncorrected) OCR text, or a string starting with "Error:".
+    """
+    if not models_loaded_flag:
+        load_models()
+    with trace_stage(trace, "decode"):
+        img_color_orig = decode_image_bytes(image_bytes_content)
     if img_color_orig is None: return "Error: Could not decode image."
+    return recognize_decoded_image(img_color_orig, original_filename=original_filename, trace=trace)
 
-    img_color_resized = resize_to_fixed(img_color_orig, TARGET_WIDTH_FIXED, TARGET_HEIGHT_FIXED)
+def resize_and_segment_lines(img_color_orig, original_filename="uploaded_image", trace=None):
+    # Resize (fixed or adaptive) and line segmentation; returns (line_images_gray, param_scale)
+    param_scale = None
+    with trace_stage(trace, "resize") as stage:
+        if OCR_RESIZE_MODE == "adaptive":
+            img_color_resized, param_scale = resize_adaptive(img_color_orig)
+        else:
+            img_color_resized = resize_to_fixed(img_color_orig, TARGET_WIDTH_FIXED, TARGET_HEIGHT_FIXED)
+        stage.items = img_color_resized.shape[0] * img_color_resized.shape[1] # pixels
     save_debug_image(img_color_resized, original_filename, step_name="ResizedInput")
 
-    line_images_gray = segment_image_to_lines(img_color_resized, base_filename=original_filename)
+    with trace_stage(trace, "segment_lines") as stage:
+        line_images_gray = segment_image_to_lines(img_color_resized, base_filename=original_filename, param_scale=param_scale)
+        stage.items = len(line_images_gray) if line_images_gray else 0
+    return line_images_gray, param_scale
+
+def segment_decoded_image(img_color_orig, original_filename="uploaded_image", trace=None, parallel_lines=True):
+    # Resize, line and letter segmentation of a decoded page; returns its item list or an "Error:" string
+    line_images_gray, param_scale = resize_and_segment_lines(img_color_orig, original_filename=original_filename, trace=trace)
     if line_images_gray is None or not line_images_gray:
         return "Error: No lines found in image or line segmentation failed."
+    with trace_stage(trace, "segment_letters") as stage:
+        output_items = join_line_items(segment_lines_to_items(line_images_gray, base_filename=original_filename,
+                                                              param_scale=param_scale, trace=trace, parallel=parallel_lines))
+        stage.items = sum(1 for item_type, _ in output_items if item_type == 'char')
+    return output_items
 
-    all_output_items_from_segmentation = []
-    for line_idx, line_img in enumerate(line_images_gray):
-        items_in_line = segment_line_to_items(line_img, line_idx, base_filename=original_filename)
-        if items_in_line: all_output_items_from_segmentation.extend(items_in_line)
-        if line_idx < len(line_images_gray) - 1:
-            all_output_items_from_segmentation.append(('newline', None))
+def recognize_decoded_image(img_color_orig, original_filename="uploaded_image", trace=None):
+    all_output_items_from_segmentation = segment_decoded_image(img_color_orig, original_filename=original_filename, trace=trace)
+    if isinstance(all_output_items_from_segmentation, str): return all_output_items_from_segmentation
 
     if DEBUG_VISUALIZE:
         display_output_items_with_newlines(all_output_items_from_segmentation, rtl=RTL_ENABLED, base_filename=original_filename)
@@ -580,30 +1145,106 @@ def process_image_pipeline(image_bytes_content, original_filename="uploaded_imag
         # Decide how to handle this: return error, or return empty string, or proceed to Gemini with empty
         # For now, let's build an empty string so Gemini gets something (though it won't be useful)
     else:
-        for item_type, item_data in all_output_items_from_segmentation:
-            if item_type == 'char' and item_data is not None:
-                label, conf = classify_char_local_vit(item_data)
-                ocr_text_from_local_vit += label
-                # print(f"  Char: {label} (Conf: {conf:.2f})") # Optional: print char-by-char result
-            elif item_type == 'space':
-                ocr_text_from_local_vit += " "
-            elif item_type == 'newline':
-                ocr_text_from_local_vit += "\n"
-            elif item_type == 'error':
-                ocr_text_from_local_vit += "?" # Or skip
+        with trace_stage(trace, "vit_classification") as stage:
+            item_results = classify_items_local_vit(all_output_items_from_segmentation)
+            ocr_text_from_local_vit = items_to_text(all_output_items_from_segmentation, item_results)
+            stage.items = sum(1 for item_result in item_results if item_result is not None)
     
     print(f"[OCR Pipeline] Text from Local ViT: \n{ocr_text_from_local_vit}")
+    return ocr_text_from_local_vit
 
-    # Correct with Gemini
-    final_corrected_text = correct_text_gemini(ocr_text_from_local_vit)
+def recognize_images_batch(named_images, trace=None):
+    """
+    Recognizes many pages at once. named_images is a list of (filename, image_bytes).
+    Pages are decoded, looked up in the result cache and segmented concurrently (up to
+    line_worker_count() pages at a time); the letter crops of all remaining pages then go
+    through one shared classify_items_local_vit pass.
+    Returns a list aligned with named_images of dicts with "filename", "cache_key",
+    "text" (final text on a cache hit, raw OCR text otherwise), "cache_hit" and "error"
+    (an "Error:" string or None).
+    """
+    if not models_loaded_flag:
+        load_models()
 
-    print(f"[OCR Pipeline] Processing finished for {original_filename}.")
-    return final_corrected_text
+    def prepare_page(named_image):
+        filename, image_bytes_content = named_image
+        result = {"filename": filename, "cache_key": None, "text": None, "cache_hit": False, "error": None, "items": None}
+        try:
+            result["cache_key"], cached_text, img_color_orig = decode_and_lookup_cache(image_bytes_content, original_filename=filename, trace=trace)
+            if img_color_orig is None:
+                result["error"] = "Error: Could not decode image."; return result
+            if cached_text is not None:
+                result["text"] = cached_text; result["cache_hit"] = True; return result
+            items = segment_decoded_image(img_color_orig, original_filename=filename, trace=trace, parallel_lines=False)
+            if isinstance(items, str): result["error"] = items
+            else: result["items"] = items
+        except Exception as e:
+            print(f"[OCR Pipeline ERROR] Batch page {filename} failed: {e}"); traceback.print_exc()
+            result["error"] = f"Error: {str(e)}"
+        return result
+
+    workers = min(line_worker_count(), len(named_images))
+    if workers > 1: pages = list(_get_segmentation_executor("page", workers).map(prepare_page, named_images))
+    else: pages = [prepare_page(named_image) for named_image in named_images]
+
+    pending_pages = [page for page in pages if page["items"] is not None]
+    if pending_pages:
+        all_items = [item for page in pending_pages for item in page["items"]]
+        print(f"[OCR Pipeline] Batch: classifying {sum(1 for t, _ in all_items if t == 'char')} letters from {len(pending_pages)} page(s)...")
+        if vit_model_g is None or vit_processor_g is None:
+            print("[OCR Pipeline WARNING] Local ViT model not loaded. Cannot perform character recognition.")
+            for page in pending_pages: page["text"] = ""
+        else:
+            with trace_stage(trace, "vit_classification") as stage:
+                all_results = classify_items_local_vit(all_items)
+                stage.items = sum(1 for item_result in all_results if item_result is not None)
+            offset = 0
+            for page in pending_pages:
+                page_len = len(page["items"])
+                page["text"] = items_to_text(page["items"], all_results[offset:offset + page_len]); offset += page_len
+    for page in pages: page.pop("items", None)
+    return pages
+
+def iter_recognized_lines(image_bytes_content, original_filename="uploaded_image", trace=None):
+    """
+    Streaming variant of recognize_image_text_cached: segments and classifies one line at a
+    time and yields event dicts as results become available:
+      {"event": "cached", "cache_key", "text"}     cache hit with the final corrected text (last event)
+      {"event": "lines", "cache_key", "count"}     number of text lines found
+      {"event": "line", "index", "text"}           raw ViT text of one line, in line order
+      {"event": "error", "detail"}                 an "Error:" message (last event)
+    Joining the "line" texts with newlines gives the raw text recognize_image_text returns.
+    """
+    if not models_loaded_flag:
+        load_models()
+    cache_key, cached_text, img_color_orig = decode_and_lookup_cache(image_bytes_content, original_filename=original_filename, trace=trace)
+    if img_color_orig is None:
+        yield {"event": "error", "detail": "Error: Could not decode image."}; return
+    if cached_text is not None:
+        yield {"event": "cached", "cache_key": cache_key, "text": cached_text}; return
+    line_images_gray, param_scale = resize_and_segment_lines(img_color_orig, original_filename=original_filename, trace=trace)
+    if line_images_gray is None or not line_images_gray:
+        yield {"event": "error", "detail": "Error: No lines found in image or line segmentation failed."}; return
+    if vit_model_g is None or vit_processor_g is None:
+        print("[OCR Pipeline WARNING] Local ViT model not loaded. Cannot perform character recognition.")
+    yield {"event": "lines", "cache_key": cache_key, "count": len(line_images_gray)}
+    for line_idx, line_img in enumerate(line_images_gray):
+        with trace_stage(trace, "segment_letters") as stage:
+            items_in_line = segment_line_to_items(line_img, line_idx, base_filename=original_filename, param_scale=param_scale, trace=trace) or []
+            stage.items = sum(1 for item_type, _ in items_in_line if item_type == 'char')
+        line_text = ""
+        if vit_model_g is not None and vit_processor_g is not None:
+            with trace_stage(trace, "vit_classification") as stage:
+                item_results = classify_items_local_vit(items_in_line)
+                line_text = items_to_text(items_in_line, item_results)
+                stage.items = sum(1 for item_result in item_results if item_result is not None)
+        yield {"event": "line", "index": line_idx, "text": line_text}
 
 # --- Optional Display Function for Segmented Items ---
 def display_output_items_with_newlines(output_items_list, rtl=False, base_filename=""):
     if not DEBUG_VISUALIZE or not output_items_list: return
     num_items = len(output_items_list); cols = min(num_items, 35); rows = (num_items + cols - 1) // cols
+    plt = _pyplot()
     plt.figure(figsize=(cols * 0.5, rows * 0.8))
     for i, (item_type, item_data) in enumerate(output_items_list):
         current_row = i // cols; position_in_row_ltr = i % cols
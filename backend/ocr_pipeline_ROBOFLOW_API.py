@@ -22,17 +22,8 @@ print(f"DEBUG (startup): GEMINI_API_KEY from os.environ after load_dotenv: {os.g
 
 
 # --- Library Imports ---
-# Roboflow SDK (Essential for this version)
-try:
-    from inference_sdk import InferenceHTTPClient
-    # Import specific exceptions that exist in inference_sdk v0.49.5
-    from inference_sdk.http.errors import HTTPClientError, APIKeyNotProvided, InvalidModelIdentifier, ModelNotSelectedError, HTTPCallErrorError
-    # You can add more specific exceptions from inference_sdk.http.errors if needed
-    print("INFO: inference_sdk components (InferenceHTTPClient and specific exceptions) imported successfully.")
-except ImportError as e:
-    print(f"FATAL ERROR: Could not import necessary components from 'inference_sdk'. Error: {e}")
-    print("Please ensure 'inference_sdk' (around v0.49.5) is correctly installed in your environment.")
-    sys.exit("Dependency issue with inference_sdk")
+# Roboflow workflow calls (concurrent, pooled HTTP; replaces one inference_sdk run_workflow call per letter)
+from roboflow_engine import RoboflowRecognitionEngine, RoboflowFatalError
 
 # Google Gemini SDK (Essential for this version)
 try:
@@ -60,10 +51,13 @@ SPACE_MULTIPLIER = 2.5; MIN_ABS_SPACE_WIDTH_RATIO = 0.4; LETTER_CROP_PADDING = 2
 # --- Roboflow API Configuration ---
 ROBOFLOW_API_KEY_FALLBACK = "YOUR_ROBOFLOW_PRIVATE_KEY_HERE"
 ROBOFLOW_API_KEY = os.environ.get("ROBOFLOW_API_KEY", ROBOFLOW_API_KEY_FALLBACK)
-ROBOFLOW_API_URL = "https://detect.roboflow.com"
+ROBOFLOW_API_URL = os.environ.get("ROBOFLOW_API_URL", "https://detect.roboflow.com") # roboflow_mock_server.py for offline runs
 ROBOFLOW_WORKSPACE_NAME = "digiktav"
 ROBOFLOW_WORKFLOW_ID = "custom-workflow" # Make sure this is your project_id/version_number
 ROBOFLOW_PREDICTION_PATH = [0, 'predictions', 'top']
+ROBOFLOW_MAX_IN_FLIGHT = int(os.environ.get("ROBOFLOW_MAX_IN_FLIGHT", "16")) # letters being recognized at once (and pooled connections)
+ROBOFLOW_MAX_RETRIES = int(os.environ.get("ROBOFLOW_MAX_RETRIES", "3")) # per letter, on 429/5xx/connection errors
+ROBOFLOW_TIMEOUT_SECONDS = float(os.environ.get("ROBOFLOW_TIMEOUT_SECONDS", "30"))
 
 print(f"DEBUG: ROBOFLOW_API_KEY being used: '{ROBOFLOW_API_KEY[:5]}...{ROBOFLOW_API_KEY[-5:] if ROBOFLOW_API_KEY and len(ROBOFLOW_API_KEY) > 10 else ''}'")
 PLACEHOLDER_ROBOFLOW_KEYS = ["YOUR_ROBOFLOW_PRIVATE_KEY_HERE"]
@@ -77,6 +71,7 @@ if not GEMINI_API_KEY or GEMINI_API_KEY == GEMINI_API_KEY_FALLBACK:
     print("WARNING: GEMINI_API_KEY not set or is placeholder. Gemini correction will be skipped.")
 
 gemini_model_g = None
+roboflow_engine_g = None
 models_loaded_flag = False
 
 # --- Debugging ---
@@ -405,81 +400,60 @@ def load_models():
     return True
 
 # === CHARACTER RECOGNITION (Roboflow) ===
+def get_roboflow_engine():
+    # One engine per process: its connection pool and in-flight window are shared by all pages
+    global roboflow_engine_g
+    if roboflow_engine_g is None:
+        roboflow_engine_g = RoboflowRecognitionEngine(ROBOFLOW_API_URL, ROBOFLOW_API_KEY, ROBOFLOW_WORKSPACE_NAME, ROBOFLOW_WORKFLOW_ID,
+                                                      max_in_flight=ROBOFLOW_MAX_IN_FLIGHT, max_retries=ROBOFLOW_MAX_RETRIES,
+                                                      timeout_s=ROBOFLOW_TIMEOUT_SECONDS)
+        print(f"DEBUG: Roboflow engine for {roboflow_engine_g.url} (max in flight: {ROBOFLOW_MAX_IN_FLIGHT}, retries: {ROBOFLOW_MAX_RETRIES})")
+    return roboflow_engine_g
+
+def prediction_to_char(output):
+    prediction_val = output
+    for key_path_item in ROBOFLOW_PREDICTION_PATH:
+        if isinstance(prediction_val, dict) and key_path_item in prediction_val: prediction_val = prediction_val[key_path_item]
+        elif isinstance(prediction_val, list) and isinstance(key_path_item, int) and key_path_item < len(prediction_val): prediction_val = prediction_val[key_path_item]
+        else: return "?"
+    return HEBREW_MAP.get(str(prediction_val), "?")
+
 def recognize_text_roboflow(items_list):
-    print(f"DEBUG: Entering recognize_text_roboflow. ROBOFLOW_API_KEY is: '{ROBOFLOW_API_KEY[:5]}...{ROBOFLOW_API_KEY[-5:] if ROBOFLOW_API_KEY and len(ROBOFLOW_API_KEY) > 10 else ''}'")
     if not items_list:
         print("DEBUG: recognize_text_roboflow returning None due to empty items_list.")
         return None
     if not ROBOFLOW_API_KEY or ROBOFLOW_API_KEY in PLACEHOLDER_ROBOFLOW_KEYS:
          print(f"[R-ERROR] Roboflow API Key ('{ROBOFLOW_API_KEY}') is a placeholder or default. Cannot proceed with Roboflow API calls.")
          return None
+
+    # All letters are sent concurrently; results come back in item order
+    char_indices = [i for i, (item_type, item_data) in enumerate(items_list) if item_type == 'char' and item_data is not None and item_data.size > 0]
+    engine = get_roboflow_engine()
     try:
-        print(f"DEBUG: Initializing InferenceHTTPClient with api_url='{ROBOFLOW_API_URL}', api_key='***', workspace='{ROBOFLOW_WORKSPACE_NAME}', workflow_id='{ROBOFLOW_WORKFLOW_ID}'")
-        client = InferenceHTTPClient(api_url=ROBOFLOW_API_URL, api_key=ROBOFLOW_API_KEY)
-        print("DEBUG: InferenceHTTPClient initialized successfully.")
-    except ConnectionError as ce:
-        print(f"\n[R-ERROR] CONNECTION FAILED to Roboflow API at {ROBOFLOW_API_URL}. Details: {ce}")
-        return None
-    except Exception as e: # Catch any exception during client init
-        print(f"[R-ERROR] Failed to initialize Roboflow client: {e}")
-        traceback.print_exc()
+        results = engine.recognize([items_list[i][1] for i in char_indices])
+    except RoboflowFatalError as fatal_e:
+        print(f"\n[R-ERROR] Roboflow rejected the request (API key or workflow access): {fatal_e}")
         return None
+    chars = {}
+    for i, result in zip(char_indices, results):
+        if result.ok: chars[i] = prediction_to_char(result.output)
+        elif result.status_code is not None:
+            print(f"\n[R-ERROR] Roboflow HTTP error for item {i+1} after {result.attempts} attempt(s): {result.error}")
+            chars[i] = "RF_HTTP_ERR" # Add a marker for this specific item
+        else:
+            print(f"\n[R-ERROR] Roboflow call failed for item {i+1} after {result.attempts} attempt(s): {result.error}")
+            chars[i] = "?"
+    if results and all(not result.ok and result.status_code is None for result in results):
+        print("[R-ERROR] Every Roboflow call failed without a response; the API is unreachable.")
+        return None # Critical, stop processing
 
     recognized_text = ""
-    item_count = len(items_list)
     for i, (item_type, item_data) in enumerate(items_list):
-        if item_type == 'char':
-            if item_data is None or item_data.size == 0:
-                recognized_text += "?"
-                continue
-            try:
-                if item_data.dtype != np.uint8:
-                    item_data = (item_data * 255 if item_data.max() <= 1.0 else item_data).astype(np.uint8)
-                img_final_np = cv2.cvtColor(item_data, cv2.COLOR_GRAY2BGR) if len(item_data.shape) == 2 else item_data
-                
-                result = client.run_workflow(
-                    workspace_name=ROBOFLOW_WORKSPACE_NAME,
-                    workflow_id=ROBOFLOW_WORKFLOW_ID,
-                    images={"image": img_final_np },
-                    use_cache=True # Can be False for debugging
-                )
-                
-                prediction_val = result
-                for key_path_item in ROBOFLOW_PREDICTION_PATH:
-                    if isinstance(prediction_val, dict) and key_path_item in prediction_val: prediction_val = prediction_val[key_path_item]
-                    elif isinstance(prediction_val, list) and isinstance(key_path_item, int) and key_path_item < len(prediction_val): prediction_val = prediction_val[key_path_item]
-                    else: prediction_val = "?"; break
-                final_char = HEBREW_MAP.get(str(prediction_val), "?")
-                recognized_text += final_char
-            # Updated exception handling based on inference_sdk.http.errors
-            except APIKeyNotProvided as api_key_e:
-                print(f"\n[R-ERROR] Roboflow API Key Not Provided for item {i+1}: {api_key_e}")
-                return None # Critical error, stop processing
-            except InvalidModelIdentifier as model_id_e:
-                print(f"\n[R-ERROR] Roboflow Invalid Model Identifier for item {i+1} (workflow_id='{ROBOFLOW_WORKFLOW_ID}'): {model_id_e}")
-                return None # Critical error
-            except ModelNotSelectedError as model_select_e:
-                print(f"\n[R-ERROR] Roboflow Model Not Selected for item {i+1}: {model_select_e}")
-                return None # Critical error
-            except HTTPCallErrorError as http_call_e: # Catches errors from API calls (like 401, 403, 404, 500s)
-                print(f"\n[R-ERROR] Roboflow HTTP Call Error for item {i+1}: Status {http_call_e.status_code}, API Msg: {http_call_e.api_message}, Desc: {http_call_e.description}")
-                if http_call_e.status_code in [401, 403]: # Unauthorized or Forbidden
-                    print("DEBUG: Roboflow authentication error (401/403). API Key is likely invalid or lacks permissions for this model/workspace.")
-                    return None
-                recognized_text += "RF_HTTP_ERR" # Add a marker for this specific item
-            except HTTPClientError as http_client_e: # General HTTP client error
-                print(f"\n[R-ERROR] Roboflow HTTP Client Error for item {i+1}: {http_client_e}")
-                recognized_text += "RF_CLIENT_ERR"
-            except ConnectionError as ce: # Network-level connection errors
-                print(f"\n[R-ERROR] Roboflow connection lost during API call: {ce}");
-                return None # Critical, stop processing
-            except Exception as e: # Catch-all for other unexpected errors during the loop
-                print(f"\n[R-ERROR] Unexpected error during Roboflow API call/processing for item {i+1}: {e}")
-                traceback.print_exc()
-                recognized_text += "?"
+        if item_type == 'char': recognized_text += chars.get(i, "?")
         elif item_type == 'space': recognized_text += " "
         elif item_type == 'newline': recognized_text += "\n"
         elif item_type == 'error': recognized_text += "?"
+    print(f"DEBUG: Roboflow recognized {len(char_indices)} letters ({engine.stats()})")
     return recognized_text
 
 # === GEMINI TEXT CORRECTION ===
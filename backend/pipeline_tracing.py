@@ -0,0 +1,250 @@
+# backend/pipeline_tracing.py
+# Per-request stage tracing for the OCR pipeline.
+#
+#   trace = PipelineTrace()
+#   with trace_stage(trace, "segment_lines") as stage:
+#       lines = segment_image_to_lines(...)
+#       stage.items = len(lines)
+#   trace.finish()      # records the stages into PIPELINE_STAGE_STATS
+#   trace.to_dict()     # "timings" block for API responses
+#
+# Wall time uses perf_counter and CPU time is the calling thread's CPU time.
+# process_rss_peak_mb is the RSS high-water mark of the whole process since it started
+# (ru_maxrss), read when the stage ends: it shows when a stage raised the process peak,
+# not what the stage itself used. With OCR_TRACE_MEMORY (noticeable overhead) stages
+# also report traced_peak_mb, the Python/NumPy allocation peak during the stage.
+#
+# tracemalloc's peak is process-wide, and every stage resets it. A traced peak is
+# therefore only recorded for stages during which every other active traced stage was
+# one of their own enclosing or nested stages, i.e. for one request at a time with
+# sequential line segmentation. Stages that overlapped a stage of another request,
+# including async stages interleaved on the event loop, or of a line worker thread
+# leave traced_peak_mb out instead of reporting someone else's allocations.
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+OCR_TRACE_MEMORY = os.environ.get("OCR_TRACE_MEMORY", "false").lower() in ("1", "true", "yes")
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is +Inf
+STAGE_LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+# Memory-traced stages active in the process, and a counter bumped whenever one starts next to
+# active stages that do not all enclose it
+_traced_stages_active = 0
+_traced_overlaps = 0
+
+def _process_rss_peak_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class StageRecord:
+    """Timing of one named stage; repeated stages with the same name are accumulated"""
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+        self.items: Optional[int] = None
+        self.process_rss_peak_mb = 0.0
+        self.traced_peak_mb: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {"name": self.name, "calls": self.calls, "wall_ms": round(self.wall_ms, 3),
+                  "cpu_ms": round(self.cpu_ms, 3), "process_rss_peak_mb": round(self.process_rss_peak_mb, 1)}
+        if self.items is not None: record["items"] = self.items
+        if self.traced_peak_mb is not None: record["traced_peak_mb"] = round(self.traced_peak_mb, 2)
+        return record
+
+class _StageTimer:
+    def __init__(self, trace: "PipelineTrace", name: str):
+        self.trace = trace
+        self.record = trace._record_for(name)
+        self.nested_traced_peak = 0.0
+
+    @property
+    def items(self):
+        return self.record.items
+
+    @items.setter
+    def items(self, value):
+        with self.trace._lock:
+            self.record.items = (self.record.items or 0) + int(value)
+
+    def __enter__(self):
+        global _traced_stages_active, _traced_overlaps
+        active_stages = self.trace._active_stages()
+        if self.trace.trace_memory:
+            with _tracemalloc_lock:
+                # Exclusive only if every active traced stage is one this stage is nested in
+                self._memory_exclusive = _traced_stages_active == len(active_stages)
+                if not self._memory_exclusive: _traced_overlaps += 1
+                _traced_stages_active += 1; self._overlap_mark = _traced_overlaps
+                if self._memory_exclusive: tracemalloc.reset_peak()
+        active_stages.append(self)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_ms = (time.perf_counter() - self._wall_start) * 1000.0
+        cpu_ms = (time.thread_time() - self._cpu_start) * 1000.0
+        process_rss_peak_mb = _process_rss_peak_mb()
+        record = self.record
+        with self.trace._lock:
+            record.calls += 1; record.wall_ms += wall_ms; record.cpu_ms += cpu_ms
+            record.process_rss_peak_mb = max(record.process_rss_peak_mb, process_rss_peak_mb)
+        active_stages = self.trace._active_stages()
+        if active_stages and active_stages[-1] is self: active_stages.pop()
+        if self.trace.trace_memory:
+            global _traced_stages_active
+            with _tracemalloc_lock:
+                _traced_stages_active -= 1
+                exclusive = self._memory_exclusive and _traced_overlaps == self._overlap_mark
+                traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+            if exclusive:
+                # Nested stages reset the traced peak, so fold their peaks into the enclosing stage
+                traced_peak_mb = max(traced_peak_bytes / (1024 * 1024), self.nested_traced_peak)
+                with self.trace._lock: record.traced_peak_mb = max(record.traced_peak_mb or 0.0, traced_peak_mb)
+                if active_stages: active_stages[-1].nested_traced_peak = max(active_stages[-1].nested_traced_peak, traced_peak_mb)
+        return False
+
+class _NullStage:
+    items = None
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): return False
+    def __setattr__(self, name, value): pass
+
+_NULL_STAGE = _NullStage()
+
+def trace_stage(trace: Optional["PipelineTrace"], name: str):
+    """Context manager timing `name` on trace; a no-op when trace is None"""
+    return trace.stage(name) if trace is not None else _NULL_STAGE
+
+class PipelineTrace:
+    """Collects stage timings for one request"""
+    def __init__(self, label: str = "", trace_memory: Optional[bool] = None):
+        global _tracemalloc_users
+        self.label = label
+        self.trace_memory = OCR_TRACE_MEMORY if trace_memory is None else trace_memory
+        self._records: Dict[str, StageRecord] = {}
+        self._order: List[str] = []
+        self._lock = threading.Lock()
+        self._thread_state = threading.local()
+        self._start = time.perf_counter()
+        self.total_ms: Optional[float] = None
+        self._finished = False
+        if self.trace_memory:
+            with _tracemalloc_lock:
+                if _tracemalloc_users == 0 and not tracemalloc.is_tracing(): tracemalloc.start()
+                _tracemalloc_users += 1
+
+    def _record_for(self, name: str) -> StageRecord:
+        with self._lock:
+            if name not in self._records:
+                self._records[name] = StageRecord(name); self._order.append(name)
+            return self._records[name]
+
+    def _active_stages(self) -> List[_StageTimer]:
+        if not hasattr(self._thread_state, "stack"): self._thread_state.stack = []
+        return self._thread_state.stack
+
+    def stage(self, name: str) -> _StageTimer:
+        return _StageTimer(self, name)
+
+    def add_stage_time(self, name: str, wall_ms: float, cpu_ms: float = 0.0, items: Optional[int] = None):
+        # For work timed elsewhere (e.g. in a worker thread) that should count towards this trace
+        record = self._record_for(name)
+        with self._lock:
+            record.calls += 1; record.wall_ms += wall_ms; record.cpu_ms += cpu_ms
+            if items is not None: record.items = (record.items or 0) + int(items)
+
+    def finish(self, stats: Optional["StageStatistics"] = None):
+        global _tracemalloc_users
+        if self._finished: return self
+        self._finished = True
+        self.total_ms = (time.perf_counter() - self._start) * 1000.0
+        if self.trace_memory:
+            with _tracemalloc_lock:
+                _tracemalloc_users -= 1
+                if _tracemalloc_users == 0 and tracemalloc.is_tracing(): tracemalloc.stop()
+        (stats if stats is not None else PIPELINE_STAGE_STATS).observe_trace(self)
+        return self
+
+    def stages(self) -> List[StageRecord]:
+        with self._lock:
+            return [self._records[name] for name in self._order]
+
+    def to_dict(self) -> Dict[str, Any]:
+        total_ms = self.total_ms if self.total_ms is not None else (time.perf_counter() - self._start) * 1000.0
+        return {"total_ms": round(total_ms, 3), "stages": [record.to_dict() for record in self.stages()]}
+
+    def summary(self) -> str:
+        return ", ".join(f"{record.name} {record.wall_ms:.0f}ms" for record in self.stages())
+
+class StageStatistics:
+    """Aggregated per-stage latency histograms across requests"""
+    def __init__(self, buckets_ms: Optional[List[float]] = None):
+        self.buckets_ms = list(buckets_ms or STAGE_LATENCY_BUCKETS_MS)
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, stage: str, wall_ms: float, cpu_ms: float = 0.0, items: Optional[int] = None):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = {"count": 0, "wall_ms_sum": 0.0, "cpu_ms_sum": 0.0, "items_sum": 0,
+                         "bucket_counts": [0] * (len(self.buckets_ms) + 1)}
+                self._stages[stage] = entry
+            entry["count"] += 1; entry["wall_ms_sum"] += wall_ms; entry["cpu_ms_sum"] += cpu_ms
+            if items: entry["items_sum"] += items
+            bucket_idx = len(self.buckets_ms)
+            for idx, upper in enumerate(self.buckets_ms):
+                if wall_ms <= upper: bucket_idx = idx; break
+            entry["bucket_counts"][bucket_idx] += 1
+
+    def observe_trace(self, trace: PipelineTrace):
+        for record in trace.stages():
+            self.observe(record.name, record.wall_ms, record.cpu_ms, record.items)
+        if trace.total_ms is not None:
+            self.observe("total", trace.total_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for name, entry in self._stages.items():
+                cumulative = 0; buckets = []
+                for upper, count in zip(self.buckets_ms + [float("inf")], entry["bucket_counts"]):
+                    cumulative += count
+                    buckets.append({"le": "+Inf" if upper == float("inf") else upper, "count": cumulative})
+                stages[name] = {
+                    "count": entry["count"], "wall_ms_sum": round(entry["wall_ms_sum"], 3),
+                    "wall_ms_avg": round(entry["wall_ms_sum"] / entry["count"], 3) if entry["count"] else 0.0,
+                    "cpu_ms_sum": round(entry["cpu_ms_sum"], 3), "items_sum": entry["items_sum"],
+                    "buckets": buckets,
+                }
+            return {"unit": "ms", "stages": stages}
+
+    def prometheus_lines(self, metric_name: str = "ocr_pipeline_stage_duration_seconds") -> List[str]:
+        """Histogram exposition lines (seconds) labelled by stage, for the /metrics endpoint"""
+        with self._lock:
+            stages = sorted((name, list(entry["bucket_counts"]), entry["wall_ms_sum"], entry["count"]) for name, entry in self._stages.items())
+        lines = [f"# HELP {metric_name} Wall time of OCR pipeline stages", f"# TYPE {metric_name} histogram"]
+        for name, bucket_counts, wall_ms_sum, count in stages:
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets_ms + [None], bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if upper is None else repr(upper / 1000.0)
+                lines.append(f'{metric_name}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric_name}_sum{{stage="{name}"}} {wall_ms_sum / 1000.0!r}')
+            lines.append(f'{metric_name}_count{{stage="{name}"}} {count}')
+        return lines
+
+# Process-wide aggregate fed by PipelineTrace.finish()
+PIPELINE_STAGE_STATS = StageStatistics()
@@ -0,0 +1,181 @@
+# backend/prepare_model_artifacts.py
+# Builds a versioned model artifact (see model_registry.py) from the trained ViT checkpoint.
+#
+#   python prepare_model_artifacts.py --source ./vit-hebrew-final.zip --store ./models
+#   python prepare_model_artifacts.py --store ./models --list
+#   python prepare_model_artifacts.py --store ./models --verify [VERSION]
+#   python prepare_model_artifacts.py --store ./models --compare-load [VERSION]
+#
+# The source may be a model directory or a zip containing one. The weights are re-saved
+# as a single safetensors file with the parameter names of the installed transformers
+# version, so the server can assign the memory-mapped tensors directly. Run it where the
+# server's transformers/torch versions are installed (the Docker build does).
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from model_registry import ModelRegistry, WEIGHTS_FILENAME, load_vit_classifier_mmap, sha256_file
+
+DEFAULT_MODEL_NAME = "vit-hebrew"
+PREPROCESSOR_FILENAME = "preprocessor_config.json"
+
+def find_model_dir(root):
+    for directory, _, filenames in sorted(os.walk(root)):
+        if "config.json" in filenames and "__MACOSX" not in directory: return directory
+    return None
+
+def publish_model(source, store, version=None, name=DEFAULT_MODEL_NAME, set_current=True):
+    import torch
+    from safetensors.torch import save_file
+    import transformers
+    from transformers import ViTForImageClassification
+
+    registry = ModelRegistry(store)
+    os.makedirs(store, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="model-src-") as extract_dir:
+        if zipfile.is_zipfile(source):
+            print(f"[Model Artifacts] Extracting {source}...")
+            with zipfile.ZipFile(source) as zip_ref: zip_ref.extractall(extract_dir)
+            model_dir = find_model_dir(extract_dir)
+        else:
+            model_dir = source if os.path.isfile(os.path.join(source, "config.json")) else find_model_dir(source)
+        if model_dir is None:
+            print(f"[Model Artifacts ERROR] No model directory (config.json) found in '{source}'."); return None
+
+        start = time.perf_counter()
+        model = ViTForImageClassification.from_pretrained(model_dir).eval()
+        print(f"[Model Artifacts] Loaded {model_dir} in {(time.perf_counter() - start) * 1000:.0f}ms.")
+        stage_dir = tempfile.mkdtemp(prefix=".stage-", dir=store)
+        try:
+            # Clone so tensors that share storage are written as independent entries
+            state_dict = {key: tensor.detach().clone().contiguous() for key, tensor in model.state_dict().items()}
+            save_file(state_dict, os.path.join(stage_dir, WEIGHTS_FILENAME), metadata={"format": "pt"})
+            model.config.save_pretrained(stage_dir)
+            if os.path.isfile(os.path.join(model_dir, PREPROCESSOR_FILENAME)):
+                shutil.copyfile(os.path.join(model_dir, PREPROCESSOR_FILENAME), os.path.join(stage_dir, PREPROCESSOR_FILENAME))
+            else:
+                print(f"[Model Artifacts WARNING] {PREPROCESSOR_FILENAME} not found in the source; the processor defaults will be used.")
+
+            weights_sha256 = sha256_file(os.path.join(stage_dir, WEIGHTS_FILENAME))
+            version = version or weights_sha256[:12]
+            target_dir = registry.version_dir(version)
+            if os.path.exists(target_dir):
+                existing = registry.manifest(version)
+                if existing is not None and existing.get("weights_sha256") == weights_sha256:
+                    print(f"[Model Artifacts] Version '{version}' already exists with identical weights.")
+                    if set_current: registry.set_current(version)
+                    return version
+                print(f"[Model Artifacts ERROR] Version '{version}' already exists with different contents."); return None
+
+            # The artifact must load through the mmap path and reproduce the source model's logits
+            mapped_model = load_vit_classifier_mmap(stage_dir)
+            if mapped_model is None:
+                print("[Model Artifacts ERROR] The written artifact does not load through the mmap path."); return None
+            image_size = getattr(model.config, "image_size", 224)
+            sample = torch.randn(2, getattr(model.config, "num_channels", 3), image_size, image_size)
+            with torch.no_grad():
+                if not torch.allclose(model(pixel_values=sample).logits, mapped_model(pixel_values=sample).logits, atol=1e-5):
+                    print("[Model Artifacts ERROR] Logits of the artifact differ from the source model."); return None
+            del mapped_model
+
+            # mkdtemp creates the staging directory as 0700; the published version is world-readable
+            os.chmod(stage_dir, 0o755)
+            for filename in os.listdir(stage_dir): os.chmod(os.path.join(stage_dir, filename), 0o644)
+            os.replace(stage_dir, target_dir)
+        finally:
+            if os.path.isdir(stage_dir): shutil.rmtree(stage_dir, ignore_errors=True)
+
+    registry.write_manifest(version, name, extra={
+        "source": os.path.basename(os.path.normpath(source)), "weights_sha256": weights_sha256,
+        "num_labels": model.config.num_labels, "transformers_version": transformers.__version__, "torch_version": torch.__version__,
+    })
+    problems = registry.verify(version, force=True)
+    if problems:
+        print(f"[Model Artifacts ERROR] Verification of '{version}' failed: {'; '.join(problems)}"); return None
+    if set_current: registry.set_current(version)
+    print(f"[Model Artifacts] Published '{version}' to {target_dir}{' (current)' if set_current else ''}.")
+    return version
+
+def _memory_mb():
+    # RSS split into anonymous memory (private to the process) and file-backed pages (shareable through the page cache)
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[0].endswith(":"): fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        import resource
+        return {"rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    return {"rss_mb": round(fields.get("Rss", 0), 1), "anon_mb": round(fields.get("Anonymous", 0), 1),
+            "file_mb": round(fields.get("Rss", 0) - fields.get("Anonymous", 0), 1)}
+
+def _load_probe(mode, model_dir):
+    import torch
+    from transformers import ViTForImageClassification
+    before = _memory_mb()
+    start = time.perf_counter()
+    model = load_vit_classifier_mmap(model_dir) if mode == "mmap" else ViTForImageClassification.from_pretrained(model_dir).eval()
+    load_ms = (time.perf_counter() - start) * 1000.0
+    image_size = getattr(model.config, "image_size", 224)
+    with torch.no_grad(): model(pixel_values=torch.zeros(1, getattr(model.config, "num_channels", 3), image_size, image_size))
+    after = _memory_mb()
+    print(json.dumps({"mode": mode, "load_ms": round(load_ms, 1), "before": before, "after": after}))
+
+def compare_load(model_dir):
+    results = []
+    for mode in ("from_pretrained", "mmap"):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--load-probe", mode, model_dir],
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(f"{'mode':<16} {'load ms':>8} {'RSS MB':>8} {'anon MB':>8} {'file MB':>8}")
+    for result in results:
+        before, after = result["before"], result["after"]
+        print(f"{result['mode']:<16} {result['load_ms']:>8.0f} {after.get('rss_mb', 0) - before.get('rss_mb', 0):>8.1f} "
+              f"{after.get('anon_mb', 0) - before.get('anon_mb', 0):>8.1f} {after.get('file_mb', 0) - before.get('file_mb', 0):>8.1f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, list and verify versioned ViT model artifacts")
+    parser.add_argument("--store", default="./models", help="Model store directory")
+    parser.add_argument("--source", help="Trained model directory or zip to publish")
+    parser.add_argument("--version", help="Version name for --source (default: weights sha256 prefix)")
+    parser.add_argument("--name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--no-set-current", action="store_true", help="Publish without making it the current version")
+    parser.add_argument("--list", action="store_true", help="List the versions in the store")
+    parser.add_argument("--verify", nargs="?", const="", metavar="VERSION", help="Re-check all checksums of VERSION (default: current)")
+    parser.add_argument("--compare-load", nargs="?", const="", metavar="VERSION", help="Load time / memory of from_pretrained vs mmap loading")
+    parser.add_argument("--load-probe", nargs=2, metavar=("MODE", "DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load_probe:
+        _load_probe(*args.load_probe); return 0
+    registry = ModelRegistry(args.store)
+    if args.source:
+        if publish_model(args.source, args.store, args.version, args.name, set_current=not args.no_set_current) is None: return 1
+    if args.list:
+        current = registry.current_version()
+        for version in registry.versions():
+            manifest = registry.manifest(version) or {}
+            weights = manifest.get("files", {}).get(WEIGHTS_FILENAME, {})
+            print(f"{'*' if version == current else ' '} {version}  {manifest.get('name', '?')}  {manifest.get('created_at', '?')}  "
+                  f"{weights.get('size', 0) / (1024 * 1024):.1f}MB")
+    if args.verify is not None:
+        version = args.verify or registry.current_version()
+        problems = registry.verify(version, force=True) if version else ["no current version"]
+        print(f"{version}: {'OK' if not problems else '; '.join(problems)}")
+        if problems: return 1
+    if args.compare_load is not None:
+        resolved = registry.resolve(args.compare_load or None)
+        if resolved is None: return 1
+        compare_load(resolved[1])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# backend/resource_config.py
+# CPU budget of one server process: thread counts for torch, OpenCV, ONNX Runtime and the
+# pipeline's executors, and optionally the CPUs the process may run on.
+#
+# Settings are read from the JSON file named by OCR_RESOURCE_CONFIG (keys as in
+# RESOURCE_ENV_VARS), then overridden by the environment variables. "auto" (the default
+# for most settings, also "" or 0) derives the value from the CPU budget:
+#
+#   cpu_affinity           OCR_CPU_AFFINITY      CPUs to pin the process to, e.g. "0-3,8" (default: inherited)
+#   cpus                   OCR_CPU_BUDGET        CPUs this process may use (auto: the CPUs it can run on;
+#                                                serve_prefork.py gives each worker its share)
+#   ocr_executor_workers   OCR_MAX_CONCURRENCY   pages recognized at the same time (default 2)
+#   line_workers           OCR_LINE_WORKERS      line / batch-page segmentation threads per page (default 1, auto: cpus)
+#   torch_threads          OCR_TORCH_THREADS     intra-op threads (auto: cpus with the ViT batch scheduler, which runs
+#                                                one forward pass at a time, else cpus // ocr_executor_workers)
+#   torch_interop_threads  OCR_TORCH_INTEROP_THREADS  (default 1; the pipeline has no inter-op parallelism)
+#   opencv_threads         OCR_OPENCV_THREADS    (auto: cpus // (ocr_executor_workers * line_workers))
+#   onnx_intra_op_threads  OCR_ONNX_THREADS      (auto: torch_threads)
+#
+# Every concurrently running page brings its own OpenCV calls and, without the scheduler,
+# its own torch forward pass. With library pools sized for the whole machine, N overlapping
+# requests run N x cpus threads, and that shows up as p95 latency. The auto values split
+# the budget instead. benchmark_pipeline.py --concurrency/--sweep measures the curve.
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+RESOURCE_ENV_VARS = {
+    "cpu_affinity": "OCR_CPU_AFFINITY",
+    "cpus": "OCR_CPU_BUDGET",
+    "ocr_executor_workers": "OCR_MAX_CONCURRENCY",
+    "line_workers": "OCR_LINE_WORKERS",
+    "torch_threads": "OCR_TORCH_THREADS",
+    "torch_interop_threads": "OCR_TORCH_INTEROP_THREADS",
+    "opencv_threads": "OCR_OPENCV_THREADS",
+    "onnx_intra_op_threads": "OCR_ONNX_THREADS",
+}
+RESOURCE_DEFAULTS = {"cpu_affinity": "", "cpus": "auto", "ocr_executor_workers": 2, "line_workers": 1, "torch_threads": "auto",
+                     "torch_interop_threads": 1, "opencv_threads": "auto", "onnx_intra_op_threads": "auto"}
+# Settings that can be changed on a running process (see apply_runtime_settings); the rest apply at startup
+RUNTIME_SETTINGS = ("torch_threads", "opencv_threads", "line_workers")
+
+def available_cpus() -> int:
+    try: return len(os.sched_getaffinity(0))
+    except AttributeError: return os.cpu_count() or 1
+
+def parse_cpu_list(text: str) -> List[int]:
+    """"0-3,8" -> [0, 1, 2, 3, 8]"""
+    cpus = set()
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part: continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+def _thread_count(name: str, value: Any, auto: int, invalid: Optional[int] = None) -> int:
+    if value is None or str(value).strip().lower() in ("", "auto", "0"): return max(1, auto)
+    try: return max(1, int(value))
+    except (TypeError, ValueError):
+        fallback = max(1, invalid if invalid is not None else auto)
+        print(f"[Resources WARNING] Invalid {name} {value!r}, using {fallback}."); return fallback
+
+def load_resource_settings(config_path: Optional[str] = None) -> Dict[str, Any]:
+    """Raw settings: defaults <- OCR_RESOURCE_CONFIG file <- environment"""
+    settings = dict(RESOURCE_DEFAULTS)
+    config_path = config_path if config_path is not None else os.environ.get("OCR_RESOURCE_CONFIG", "")
+    if config_path:
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f: file_settings = json.load(f)
+            unknown = sorted(set(file_settings) - set(RESOURCE_DEFAULTS))
+            if unknown: print(f"[Resources WARNING] Unknown settings in {config_path} ignored: {', '.join(unknown)}")
+            settings.update({key: value for key, value in file_settings.items() if key in RESOURCE_DEFAULTS})
+        except (OSError, ValueError) as e:
+            print(f"[Resources WARNING] Could not read OCR_RESOURCE_CONFIG '{config_path}': {e}")
+    for key, variable in RESOURCE_ENV_VARS.items():
+        if os.environ.get(variable) is not None: settings[key] = os.environ[variable]
+    return settings
+
+def resolve_resource_config(settings: Dict[str, Any], scheduler_enabled: bool = False) -> Dict[str, Any]:
+    """Thread counts for every library and executor; "auto" values split the CPU budget"""
+    try: affinity = parse_cpu_list(settings["cpu_affinity"]) if settings["cpu_affinity"] else []
+    except ValueError:
+        print(f"[Resources WARNING] Invalid cpu_affinity {settings['cpu_affinity']!r}, ignoring it."); affinity = []
+    cpus = _thread_count("cpus", settings["cpus"], len(affinity) or available_cpus())
+    executor_workers = _thread_count("ocr_executor_workers", settings["ocr_executor_workers"], 2)
+    line_workers = _thread_count("line_workers", settings["line_workers"], cpus, invalid=1)
+    torch_threads = _thread_count("torch_threads", settings["torch_threads"], cpus if scheduler_enabled else cpus // executor_workers)
+    return {
+        "cpu_affinity": affinity or None, "cpus": cpus, "ocr_executor_workers": executor_workers, "line_workers": line_workers,
+        "torch_threads": torch_threads, "torch_interop_threads": _thread_count("torch_interop_threads", settings["torch_interop_threads"], 1),
+        "opencv_threads": _thread_count("opencv_threads", settings["opencv_threads"], cpus // (executor_workers * line_workers)),
+        "onnx_intra_op_threads": _thread_count("onnx_intra_op_threads", settings["onnx_intra_op_threads"], torch_threads),
+    }
+
+RESOURCE_CONFIG = resolve_resource_config(load_resource_settings(),
+                                          scheduler_enabled=os.environ.get("VIT_SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes"))
+
+def apply_process_settings(config: Dict[str, Any] = RESOURCE_CONFIG):
+    """CPU affinity and OpenCV's pool; call before the first OpenCV work"""
+    if config["cpu_affinity"]:
+        try: os.sched_setaffinity(0, config["cpu_affinity"])
+        except (AttributeError, OSError) as e: print(f"[Resources WARNING] Could not set the CPU affinity to {config['cpu_affinity']}: {e}")
+    import cv2
+    cv2.setNumThreads(config["opencv_threads"])
+
+def configure_torch(torch_module, config: Dict[str, Any] = RESOURCE_CONFIG):
+    """Torch thread pools; interop threads can only be set once, before any inter-op work"""
+    torch_module.set_num_threads(config["torch_threads"])
+    try: torch_module.set_num_interop_threads(config["torch_interop_threads"])
+    except RuntimeError: pass
+
+def apply_runtime_settings(config: Dict[str, Any], torch_module=None):
+    """Re-applies the RUNTIME_SETTINGS thread counts (after fork(), or between benchmark runs)"""
+    import cv2
+    cv2.setNumThreads(config["opencv_threads"])
+    if torch_module is not None: torch_module.set_num_threads(config["torch_threads"])
+
+def describe_resource_config(config: Dict[str, Any] = RESOURCE_CONFIG) -> str:
+    return (f"{config['cpus']} CPU(s){' pinned to ' + ','.join(map(str, config['cpu_affinity'])) if config['cpu_affinity'] else ''}: "
+            f"{config['ocr_executor_workers']} concurrent page(s), {config['line_workers']} line worker(s), torch {config['torch_threads']}"
+            f"+{config['torch_interop_threads']} interop, OpenCV {config['opencv_threads']}, ONNX {config['onnx_intra_op_threads']} thread(s)")
@@ -0,0 +1,198 @@
+# backend/result_cache.py
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl # serializes the eviction of processes sharing a DiskCache directory (POSIX only)
+except ImportError:
+    fcntl = None
+
+def hash_key(*parts: Any) -> str:
+    """Stable sha256 hex digest of bytes/str parts (other values are JSON-encoded)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(part)
+        elif isinstance(part, str):
+            digest.update(part.encode('utf-8'))
+        else:
+            digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+class LRUMemoryCache:
+    """Thread-safe in-memory LRU cache bounded by entry count"""
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries: return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class DiskCache:
+    """
+    JSON-file cache in a local directory, bounded by total size in bytes.
+    The least recently used files (by modification time, which get() refreshes) are evicted first.
+    Several processes (e.g. pre-forked workers) can share the directory: the size index only
+    sees this process's writes between scans, so it is rebuilt from the directory, under a lock
+    file, before evicting and at least every rescan_interval_s. The budget holds for the
+    directory as a whole, overshooting by at most the other processes' writes since the last scan.
+    """
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, rescan_interval_s: float = 30.0):
+        self.directory = directory
+        self.max_bytes = max(0, int(max_bytes))
+        self.rescan_interval_s = rescan_interval_s
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict() # path -> size, oldest first
+        self._total_bytes = 0
+        self._last_scan = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".evict.lock")
+        self._load_index()
+
+    def _load_index(self):
+        # Rebuilds the index from the files in the directory (call with self._lock held, or from __init__)
+        self._index.clear(); self._total_bytes = 0; self._last_scan = time.monotonic()
+        files = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith('.json'): continue
+                path = os.path.join(root, filename)
+                try: stat = os.stat(path)
+                except OSError: continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._index[path] = size; self._total_bytes += size
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path_for(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f: value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if path in self._index: self._index.move_to_end(path)
+        try: os.utime(path, None)
+        except OSError: pass
+        return value
+
+    def put(self, key: str, value: Any):
+        path = self._path_for(key)
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        if self.max_bytes and len(data) > self.max_bytes: return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f: f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[Cache WARNING] Could not write disk cache entry {path}: {e}")
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return
+        with self._lock:
+            self._total_bytes -= self._index.pop(path, 0)
+            self._index[path] = len(data); self._total_bytes += len(data)
+            if self.max_bytes and (self._total_bytes > self.max_bytes or time.monotonic() - self._last_scan > self.rescan_interval_s):
+                with self._directory_lock():
+                    self._load_index() # counts the files of the other processes sharing the directory
+                    self._evict_locked(int(self.max_bytes * 0.9)) # headroom, so the next puts do not rescan right away
+
+    @contextlib.contextmanager
+    def _directory_lock(self):
+        if fcntl is None:
+            yield; return
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try: yield
+            finally: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict_locked(self, target_bytes: int):
+        while self._total_bytes > target_bytes and self._index:
+            path, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try: os.remove(path)
+            except OSError: pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"directory": self.directory, "entries": len(self._index), "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+class TieredCache:
+    """
+    In-memory LRU tier in front of an optional disk tier, with hit/miss counters.
+    With ttl_seconds, entries are stored as {"expires_at", "value"} and expired ones count as misses.
+    """
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None, max_disk_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = None):
+        self.memory = LRUMemoryCache(max_entries)
+        self.disk = DiskCache(disk_dir, max_disk_bytes) if disk_dir else None
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._counter_lock = threading.Lock()
+        self.memory_hits = 0; self.disk_hits = 0; self.misses = 0; self.stores = 0; self.expired = 0
+
+    def _unwrap(self, entry: Any) -> Optional[Any]:
+        if self.ttl_seconds is None: return entry
+        if not isinstance(entry, dict) or entry.get("expires_at", 0) <= time.time():
+            with self._counter_lock: self.expired += 1
+            return None
+        return entry["value"]
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.memory.get(key)
+        value = self._unwrap(entry) if entry is not None else None
+        if value is not None:
+            with self._counter_lock: self.memory_hits += 1
+            return value
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            value = self._unwrap(entry) if entry is not None else None
+            if value is not None:
+                self.memory.put(key, entry)
+                with self._counter_lock: self.disk_hits += 1
+                return value
+        with self._counter_lock: self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any):
+        entry = {"expires_at": time.time() + self.ttl_seconds, "value": value} if self.ttl_seconds is not None else value
+        self.memory.put(key, entry)
+        if self.disk is not None: self.disk.put(key, entry)
+        with self._counter_lock: self.stores += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counter_lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            stats = {
+                "hits": hits, "memory_hits": self.memory_hits, "disk_hits": self.disk_hits,
+                "misses": self.misses, "stores": self.stores, "expired": self.expired,
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+            }
+        if self.disk is not None: stats["disk"] = self.disk.stats()
+        return stats
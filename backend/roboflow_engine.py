@@ -0,0 +1,125 @@
+# backend/roboflow_engine.py
+# Concurrent letter recognition against a Roboflow workflow (used by ocr_pipeline_ROBOFLOW_API.py).
+#
+#   engine = RoboflowRecognitionEngine(api_url, api_key, workspace, workflow_id, max_in_flight=16)
+#   results = engine.recognize(letter_crops)   # one RecognitionResult per crop, in crop order
+#
+# Every crop is one POST to {api_url}/{workspace}/workflows/{workflow_id} (the endpoint
+# inference_sdk's run_workflow calls), with the crop JPEG-encoded the same way. Up to
+# max_in_flight requests run at once on one requests.Session, whose connection pool keeps
+# that many keep-alive connections open, so a page costs about letters / max_in_flight
+# round trips instead of one per letter. 429, 5xx and connection errors are retried with
+# exponential backoff and jitter, honouring Retry-After. 401/403 stop the whole page
+# (RoboflowFatalError), and the letters that were not sent yet are never sent. Other
+# failures mark only their own letter.
+#
+# roboflow_mock_server.py serves the same endpoint locally, for offline throughput and
+# failure tests.
+import base64
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+FATAL_STATUS_CODES = (401, 403)
+
+class RoboflowFatalError(Exception):
+    """The remaining letters cannot succeed either (bad API key, no access to the workflow)"""
+
+class RecognitionResult:
+    __slots__ = ("output", "error", "status_code", "attempts")
+
+    def __init__(self, output: Any = None, error: Optional[str] = None, status_code: Optional[int] = None, attempts: int = 0):
+        self.output = output; self.error = error; self.status_code = status_code; self.attempts = attempts
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def encode_crop(crop: np.ndarray) -> str:
+    if crop.dtype != np.uint8:
+        crop = (crop * 255 if crop.max() <= 1.0 else crop).astype(np.uint8)
+    if crop.ndim == 2: crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+    ok, encoded = cv2.imencode(".jpg", crop)
+    if not ok: raise ValueError("Could not encode the letter crop")
+    return base64.b64encode(encoded.tobytes()).decode("ascii")
+
+class RoboflowRecognitionEngine:
+    def __init__(self, api_url: str, api_key: str, workspace: str, workflow_id: str, max_in_flight: int = 16,
+                 max_retries: int = 3, backoff_base_s: float = 0.25, backoff_max_s: float = 8.0, timeout_s: float = 30.0,
+                 use_cache: bool = True):
+        self.url = f"{api_url.rstrip('/')}/{workspace}/workflows/{workflow_id}"
+        self.api_key = api_key
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base_s = backoff_base_s; self.backoff_max_s = backoff_max_s
+        self.timeout_s = timeout_s
+        self.use_cache = use_cache
+        self.session = requests.Session()
+        # pool_block: a thread waits for a free connection instead of opening (and then discarding) an extra one
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight, pool_block=True, max_retries=0)
+        self.session.mount("http://", adapter); self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="roboflow")
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0; self.retries = 0; self.failures = 0
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def stats(self):
+        with self._stats_lock:
+            return {"requests": self.requests_sent, "retries": self.retries, "failures": self.failures, "max_in_flight": self.max_in_flight}
+
+    def _backoff_s(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try: return min(self.backoff_max_s, max(0.0, float(retry_after)))
+            except ValueError: pass
+        return min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    def _recognize_one(self, crop: np.ndarray, abort: threading.Event) -> RecognitionResult:
+        if abort.is_set(): return RecognitionResult(error="aborted")
+        try: payload = {"api_key": self.api_key, "use_cache": self.use_cache, "inputs": {"image": {"type": "base64", "value": encode_crop(crop)}}}
+        except Exception as e:
+            return RecognitionResult(error=f"encode: {e}")
+        for attempt in range(self.max_retries + 1):
+            if abort.is_set(): return RecognitionResult(error="aborted", attempts=attempt)
+            with self._stats_lock:
+                self.requests_sent += 1
+                if attempt: self.retries += 1
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout_s)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                result = RecognitionResult(error=f"connection: {e}", attempts=attempt + 1)
+            else:
+                if response.status_code == 200:
+                    try: return RecognitionResult(output=response.json().get("outputs"), status_code=200, attempts=attempt + 1)
+                    except ValueError:
+                        result = RecognitionResult(error="invalid JSON response", status_code=200, attempts=attempt + 1)
+                else:
+                    result = RecognitionResult(error=f"HTTP {response.status_code}: {response.text[:200]}", status_code=response.status_code, attempts=attempt + 1)
+                    if response.status_code in FATAL_STATUS_CODES:
+                        abort.set(); return result
+                    if response.status_code not in RETRYABLE_STATUS_CODES: break
+                    retry_after = response.headers.get("Retry-After")
+            if attempt < self.max_retries: time.sleep(self._backoff_s(attempt, retry_after))
+        with self._stats_lock: self.failures += 1
+        return result
+
+    def recognize(self, crops: Sequence[np.ndarray]) -> List[RecognitionResult]:
+        """One result per crop, in the order of crops; raises RoboflowFatalError on 401/403"""
+        if not crops: return []
+        abort = threading.Event()
+        futures = [self._executor.submit(self._recognize_one, crop, abort) for crop in crops]
+        results = [future.result() for future in futures]
+        fatal = next((result for result in results if result.status_code in FATAL_STATUS_CODES), None)
+        if fatal is not None: raise RoboflowFatalError(fatal.error)
+        return results
@@ -0,0 +1,165 @@
+# backend/roboflow_mock_server.py
+# Local stand-in for the Roboflow workflow endpoint, to test roboflow_engine.py offline.
+#
+#   python roboflow_mock_server.py --port 9001 --latency-ms 40 --error-rate 0.05
+#   ROBOFLOW_API_URL=http://127.0.0.1:9001 ROBOFLOW_API_KEY=mock python ocr_pipeline_ROBOFLOW_API.py
+#   python roboflow_mock_server.py --bench --letters 300 --windows 1,4,16,32 --error-rate 0.05
+#
+# POST /<workspace>/workflows/<workflow_id> answers like the real workflow:
+# {"outputs": [{"predictions": {"top": "<class>", "confidence": ...}}]}. The class is
+# read from the crop itself: the mean gray level // MOCK_GRAY_STEP, which the synthetic
+# crops of --bench encode, so a reply that lands on the wrong letter is noticed. Each
+# request sleeps --latency-ms (plus jitter). A share --error-rate of requests fails with
+# 503, and a wrong --api-key gets 401. The server counts requests, TCP connections and the
+# peak number of concurrent requests, so connection reuse and the in-flight bound can
+# be checked.
+#
+# --bench starts the server in-process and recognizes --letters synthetic crops at every
+# --windows in-flight limit, checking that each result matches its crop. It reports
+# letters/s, retries, failures and the connections opened.
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+MOCK_GRAY_STEP = 9 # class c is drawn with gray level c * MOCK_GRAY_STEP + 4
+MOCK_NUM_CLASSES = 27
+
+class MockRoboflowServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=30.0, jitter_ms=10.0, error_rate=0.0, api_key=None, seed=0):
+        super().__init__(address, _MockHandler)
+        self.latency_ms = latency_ms; self.jitter_ms = jitter_ms; self.error_rate = error_rate; self.api_key = api_key
+        self._random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0; self.errors_injected = 0; self.connections = 0; self.in_flight = 0; self.max_in_flight = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def draw(self):
+        with self.lock: return self._random.random(), self._random.uniform(-1.0, 1.0)
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "errors_injected": self.errors_injected, "connections": self.connections,
+                    "max_in_flight": self.max_in_flight}
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+    disable_nagle_algorithm = True # headers and body are separate writes; with Nagle each reply waits for a delayed ACK
+
+    def setup(self):
+        super().setup()
+        with self.server.lock: self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items(): self.send_header(name, value)
+        self.end_headers(); self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests += 1; server.in_flight += 1; server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[1] != "workflows":
+                self._reply(404, {"message": f"No route {self.path}"}); return
+            try: payload = json.loads(body)
+            except ValueError:
+                self._reply(400, {"message": "Invalid JSON"}); return
+            if server.api_key is not None and payload.get("api_key") != server.api_key:
+                self._reply(401, {"message": "Unauthorized api_key"}); return
+            failure_draw, jitter_draw = server.draw()
+            time.sleep(max(0.0, server.latency_ms + server.jitter_ms * jitter_draw) / 1000.0)
+            if failure_draw < server.error_rate:
+                with server.lock: server.errors_injected += 1
+                self._reply(503, {"message": "Injected failure"}); return
+            try:
+                image = payload["inputs"]["image"]["value"]
+                crop = cv2.imdecode(np.frombuffer(base64.b64decode(image), np.uint8), cv2.IMREAD_GRAYSCALE)
+                label = min(MOCK_NUM_CLASSES - 1, int(crop.mean()) // MOCK_GRAY_STEP)
+            except Exception as e:
+                self._reply(400, {"message": f"Invalid image input: {e}"}); return
+            self._reply(200, {"outputs": [{"predictions": {"top": str(label), "confidence": 0.99}}]})
+        finally:
+            with server.lock: server.in_flight -= 1
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    """Starts a MockRoboflowServer on a daemon thread; port 0 picks a free port (see .url)"""
+    server = MockRoboflowServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="roboflow-mock", daemon=True).start()
+    return server
+
+def synthetic_crop(label, size=32):
+    return np.full((size, size), label * MOCK_GRAY_STEP + 4, dtype=np.uint8)
+
+def run_bench(args):
+    from roboflow_engine import RoboflowRecognitionEngine, RoboflowFatalError
+    server = start_mock_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, api_key="mock", seed=args.seed)
+    rng = random.Random(args.seed)
+    labels = [rng.randrange(MOCK_NUM_CLASSES) for _ in range(args.letters)]
+    crops = [synthetic_crop(label) for label in labels]
+    print(f"Mock server at {server.url}: {args.latency_ms:g}ms latency, {args.error_rate:.0%} injected 503s, {args.letters} letters")
+    print(f"{'window':>6} {'letters/s':>10} {'wall s':>8} {'retries':>8} {'failed':>7} {'wrong':>6} {'conns':>6} {'peak':>5}")
+    for window in [int(w) for w in args.windows.split(",") if w.strip()]:
+        engine = RoboflowRecognitionEngine(server.url, "mock", "digiktav", "custom-workflow", max_in_flight=window,
+                                           max_retries=args.retries, backoff_base_s=args.backoff_ms / 1000.0)
+        before = server.stats()
+        with server.lock: server.max_in_flight = 0
+        start = time.perf_counter()
+        results = engine.recognize(crops)
+        wall_s = time.perf_counter() - start
+        after = server.stats(); engine.close()
+        failed = sum(1 for result in results if not result.ok)
+        wrong = sum(1 for label, result in zip(labels, results) if result.ok and result.output[0]["predictions"]["top"] != str(label))
+        print(f"{window:>6} {args.letters / wall_s:>10.1f} {wall_s:>8.2f} {engine.stats()['retries']:>8} {failed:>7} {wrong:>6} "
+              f"{after['connections'] - before['connections']:>6} {after['max_in_flight']:>5}")
+    try:
+        RoboflowRecognitionEngine(server.url, "wrong-key", "digiktav", "custom-workflow", max_in_flight=4).recognize(crops[:50])
+        print("❌ A wrong API key was not reported")
+    except RoboflowFatalError as e:
+        print(f"Wrong API key: RoboflowFatalError ({e}), {server.stats()['requests'] - after['requests']} of 50 letters sent")
+    server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Roboflow workflow API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--api-key", default=None, help="Reject other keys with 401 (default: accept any)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bench", action="store_true", help="Benchmark roboflow_engine against an in-process server and exit")
+    parser.add_argument("--letters", type=int, default=300)
+    parser.add_argument("--windows", default="1,4,16,32", help="Comma-separated max_in_flight values for --bench")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    if args.bench:
+        run_bench(args); return
+    server = MockRoboflowServer((args.host, args.port), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                error_rate=args.error_rate, api_key=args.api_key, seed=args.seed)
+    print(f"Mock Roboflow workflow API on {server.url} (latency {args.latency_ms:g}ms, error rate {args.error_rate:.0%})")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: print(f"Stats: {server.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# backend/serve_prefork.py
+# Multi-worker server: the models are loaded once in this (parent) process, which then
+# forks OCR_SERVER_WORKERS uvicorn workers serving main:app on one shared listening socket.
+#
+#   python serve_prefork.py --workers 4 --port 8000
+#   OCR_SERVER_WORKERS=4 python serve_prefork.py
+#
+# The workers inherit the loaded ViT copy-on-write: the memory-mapped artifact weights
+# (model_registry.py) stay in the page cache once, and the torch/transformers runtime
+# pages are shared until a worker writes to them (gc.freeze() keeps the garbage collector
+# from touching the inherited objects). Each worker gets CPUs // workers as its CPU budget
+# (OCR_CPU_BUDGET), which resource_config.py splits between torch, OpenCV and the executors;
+# with --pin-workers (OCR_PIN_WORKERS) each worker is also pinned to its own slice of the CPUs.
+#
+# The parent never runs inference or starts threads before forking (thread pools do not
+# survive fork()); every worker starts its own scheduler and runs the warm-up inference in
+# its startup event. Workers that die are re-forked from the loaded parent. The SQLite job
+# store and the disk caches are safe to share between the workers; the disk caches rebuild
+# their size index from the shared directory before evicting, so OCR_CACHE_MAX_DISK_MB and
+# GEMINI_CACHE_MAX_DISK_MB bound the directory, not each worker.
+#
+# If the ViT cannot be loaded the workers still start, degraded: /enhance-text/ and the
+# liveness endpoints answer and /health/ready reports the failure, as with a single process.
+# With one worker, or with OCR_BACKGROUND_WARMUP (the parent would block on load_models
+# before any worker accepts a connection), this runs plain uvicorn main:app instead, so
+# /health/live answers during a cold start.
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+OCR_SERVER_WORKERS = int(os.environ.get("OCR_SERVER_WORKERS", "1"))
+OCR_PIN_WORKERS = os.environ.get("OCR_PIN_WORKERS", "false").lower() in ("1", "true", "yes")
+OCR_WORKER_SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("OCR_WORKER_SHUTDOWN_TIMEOUT_SECONDS", "30"))
+# A worker exiting sooner than this after being forked counts as a crash loop
+OCR_WORKER_MIN_UPTIME_SECONDS = 10.0
+OCR_WORKER_MAX_FAST_FAILURES = 5
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port)); sock.listen(backlog); sock.set_inheritable(True)
+    return sock
+
+def load_shared_models():
+    # Imported here so the worker CPU budget and OMP_NUM_THREADS are set before resource_config and torch are
+    import main
+    import ocr_pipeline
+    start = time.perf_counter()
+    try: ocr_pipeline.load_models(start_threads=False)
+    except Exception as e: print(f"[Prefork] ERROR: Loading the models failed: {e}")
+    if ocr_pipeline.vit_model_g is None:
+        print("[Prefork] WARNING: The ViT model could not be loaded; workers start without OCR and report not ready.")
+    else:
+        print(f"[Prefork] Models loaded in the parent in {(time.perf_counter() - start) * 1000:.0f}ms.")
+    return main.app
+
+def run_worker(app, sock, worker_index, worker_cpus, log_level):
+    import uvicorn
+    import ocr_pipeline
+    signal.signal(signal.SIGINT, signal.SIG_DFL); signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if worker_cpus:
+        try: os.sched_setaffinity(0, worker_cpus)
+        except OSError as e: print(f"[Prefork] WARNING: Could not pin worker {worker_index} to CPUs {worker_cpus}: {e}")
+    ocr_pipeline.reinit_after_fork()
+    print(f"[Prefork] Worker {worker_index} started (pid {os.getpid()}{f', CPUs {worker_cpus}' if worker_cpus else ''}).")
+    config = uvicorn.Config(app, log_level=log_level, timeout_graceful_shutdown=OCR_WORKER_SHUTDOWN_TIMEOUT_SECONDS)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def fork_worker(app, sock, worker_index, worker_cpus, log_level):
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try: run_worker(app, sock, worker_index, worker_cpus, log_level)
+        except BaseException as e:
+            print(f"[Prefork] Worker {worker_index} failed: {e}"); exit_code = 1
+        finally:
+            sys.stdout.flush(); sys.stderr.flush()
+            os._exit(exit_code)
+    return pid
+
+def serve(host, port, num_workers, worker_cpu_sets, log_level="info"):
+    sock = bind_socket(host, port)
+    app = load_shared_models()
+    # Objects that exist now are shared with the workers; frozen, the collector never writes to their pages
+    gc.collect(); gc.freeze()
+
+    workers = {} # pid -> (worker index, fork time)
+    stopping = False
+    def handle_stop(signum, _frame):
+        nonlocal stopping
+        if not stopping: print(f"[Prefork] Received signal {signum}, stopping {len(workers)} worker(s)...")
+        stopping = True
+        for pid in list(workers):
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+    signal.signal(signal.SIGTERM, handle_stop); signal.signal(signal.SIGINT, handle_stop)
+
+    from resource_config import describe_resource_config
+    print(f"[Prefork] Serving on {host}:{port} with {num_workers} worker(s), each with {describe_resource_config()}.")
+    for worker_index in range(num_workers):
+        workers[fork_worker(app, sock, worker_index, worker_cpu_sets[worker_index], log_level)] = (worker_index, time.monotonic())
+    fast_failures = 0
+    stop_deadline = None
+    while workers:
+        if stopping and stop_deadline is None: stop_deadline = time.monotonic() + OCR_WORKER_SHUTDOWN_TIMEOUT_SECONDS + 5
+        if stop_deadline is not None and time.monotonic() > stop_deadline:
+            for pid in list(workers):
+                print(f"[Prefork] Worker pid {pid} did not stop in time, killing it.")
+                try: os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError: pass
+            stop_deadline = float("inf")
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.5); continue
+        if pid not in workers: continue
+        worker_index, started_at = workers.pop(pid)
+        if stopping: continue
+        print(f"[Prefork] Worker {worker_index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting it.")
+        fast_failures = fast_failures + 1 if time.monotonic() - started_at < OCR_WORKER_MIN_UPTIME_SECONDS else 0
+        if fast_failures >= OCR_WORKER_MAX_FAST_FAILURES:
+            print(f"[Prefork] ERROR: {fast_failures} workers exited right after starting; shutting down.")
+            handle_stop(signal.SIGTERM, None); continue
+        workers[fork_worker(app, sock, worker_index, worker_cpu_sets[worker_index], log_level)] = (worker_index, time.monotonic())
+    sock.close()
+    print("[Prefork] All workers stopped.")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve main:app from pre-forked workers sharing one loaded model")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=OCR_SERVER_WORKERS)
+    parser.add_argument("--pin-workers", action="store_true", default=OCR_PIN_WORKERS, help="Pin each worker to its own slice of the CPUs")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    num_workers = max(1, args.workers)
+    from dotenv import load_dotenv
+    load_dotenv() # ocr_pipeline does this too, but resource_config reads the environment first here
+    background_warmup = os.environ.get("OCR_BACKGROUND_WARMUP", "false").lower() in ("1", "true", "yes")
+    if num_workers == 1 or background_warmup:
+        if num_workers > 1: print(f"[Prefork] WARNING: OCR_BACKGROUND_WARMUP is set; serving from one process instead of {num_workers} workers.")
+        import uvicorn
+        uvicorn.run("main:app", host=args.host, port=args.port, log_level=args.log_level)
+        return 0
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    cpus_per_worker = max(1, len(cpus) // num_workers)
+    os.environ.setdefault("OCR_CPU_BUDGET", str(cpus_per_worker))
+    import resource_config
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"): os.environ.setdefault(variable, str(resource_config.RESOURCE_CONFIG["torch_threads"]))
+    # With fewer CPUs than workers the slices wrap around
+    worker_cpu_sets = [[cpus[(index * cpus_per_worker + offset) % len(cpus)] for offset in range(cpus_per_worker)] if args.pin_workers else None
+                       for index in range(num_workers)]
+    return serve(args.host, args.port, num_workers, worker_cpu_sets, args.log_level)
+
+if __name__ == "__main__":
+    sys.exit(main())
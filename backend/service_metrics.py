@@ -0,0 +1,162 @@
+# backend/service_metrics.py
+# Minimal Prometheus text-format metrics (counters, gauges, histograms with labels).
+# Kept dependency-free on purpose; main.py serves METRICS.render() at /metrics.
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS_S = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra is not None: pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == math.inf: return "+Inf"
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    metric_type = "untyped"
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def _render_values(self, callback) -> List[str]:
+        if callback is not None:
+            try: items = [(self._key(labels), float(value)) for labels, value in callback()]
+            except Exception as e:
+                print(f"[Metrics WARNING] {self.metric_type.capitalize()} callback for {self.name} failed: {e}"); items = []
+        else:
+            with self._lock: items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+class Counter(_Metric):
+    metric_type = "counter"
+    def __init__(self, name, documentation, label_names=(), callback: Optional[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = None):
+        """callback, if given, is called at render time and yields (labels, value) pairs of totals kept elsewhere"""
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self._render_values(self.callback)
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+    def __init__(self, name, documentation, label_names=(), callback: Optional[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = None):
+        """callback, if given, is called at render time and yields (labels, value) pairs"""
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock: self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        return self._render_values(self.callback)
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+    def __init__(self, name, documentation, label_names=(), buckets: Optional[Sequence[float]] = None):
+        super().__init__(name, documentation, label_names)
+        self.buckets = sorted(buckets or DEFAULT_LATENCY_BUCKETS_S)
+        self._values: Dict[Tuple[str, ...], Dict[str, object]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = entry
+            bucket_idx = len(self.buckets)
+            for idx, upper in enumerate(self.buckets):
+                if value <= upper: bucket_idx = idx; break
+            entry["counts"][bucket_idx] += 1; entry["sum"] += value; entry["count"] += 1
+
+    def time(self, **labels):
+        return _HistogramTimer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, {"counts": list(entry["counts"]), "sum": entry["sum"], "count": entry["count"]}) for key, entry in self._values.items())
+        lines = self.header()
+        for key, entry in items:
+            cumulative = 0
+            for upper, count in zip(self.buckets + [math.inf], entry["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(upper)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {entry['count']}")
+        return lines
+
+class _HistogramTimer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram; self.labels = labels
+    def __enter__(self):
+        self._start = time.perf_counter(); return self
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels); return False
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock: self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=(), callback=None) -> Counter:
+        return self.register(Counter(name, documentation, label_names, callback))
+
+    def gauge(self, name, documentation, label_names=(), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names, callback))
+
+    def histogram(self, name, documentation, label_names=(), buckets=None) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """collector returns ready-made exposition lines (HELP/TYPE included) at render time"""
+        with self._lock: self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock: metrics = list(self._metrics); collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics: lines.extend(metric.render())
+        for collector in collectors:
+            try: lines.extend(collector())
+            except Exception as e: print(f"[Metrics WARNING] Collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+
+# --- Metrics shared across modules ---
+GEMINI_CALL_SECONDS = METRICS.histogram("gemini_call_duration_seconds", "Latency of Gemini API calls", ["operation"])
+GEMINI_CALL_ERRORS = METRICS.counter("gemini_call_errors_total", "Gemini API calls that raised or returned no text", ["operation"])
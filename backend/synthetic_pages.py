@@ -0,0 +1,238 @@
+# backend/synthetic_pages.py
+# Synthetic handwritten-page generator for load and scaling tests.
+#
+# Composes Hebrew pages from letter images with a controllable number of lines,
+# letters per line, ruled lines, noise and resolution, and records the ground
+# truth (text plus one box per letter). Letter images come from, in order:
+#   - a directory of labelled crops (one sub-directory per letter, named by the
+#     letter itself or by its class index in HEBREW_LETTERS),
+#   - a TrueType font with Hebrew glyphs,
+#   - procedurally drawn stroke glyphs (default; deterministic, one connected
+#     blob per letter, so segmentation ground truth holds but the ViT will not
+#     read them as real letters).
+#
+#   page = generate_page(num_lines=12, letters_per_line=35, seed=1)
+#   text = ocr_pipeline.process_image_pipeline(page.encode(), "synthetic.png")
+#
+#   python synthetic_pages.py --count 5 --lines 20 --letters-per-line 40 --out-dir synthetic_out
+import argparse
+import glob
+import json
+import os
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+# Same order as the ViT's id2label
+HEBREW_LETTERS = "אבגדהוזחטיכךלמםנןסעפףצץקרשת"
+FINAL_FORMS = {"כ": "ך", "מ": "ם", "נ": "ן", "פ": "ף", "צ": "ץ"}
+NON_FINAL_LETTERS = [letter for letter in HEBREW_LETTERS if letter not in FINAL_FORMS.values()]
+# Width/height of the procedural glyphs; narrow letters and the short yod get their own shapes
+NARROW_LETTERS = "וזןי"; DESCENDER_LETTERS = "ךןףץק"; SHORT_LETTERS = "י"
+
+class LetterSource:
+    """Produces grayscale ink masks (uint8, 255 = full ink) for a letter at a given height"""
+    def __init__(self, crops_by_letter: Optional[Dict[str, List[np.ndarray]]] = None, font_path: Optional[str] = None):
+        self.crops_by_letter = crops_by_letter or {}
+        self.font_path = font_path
+        self._fonts = {}
+
+    @classmethod
+    def from_directory(cls, letters_dir: str) -> "LetterSource":
+        crops_by_letter = {}
+        for sub_dir in sorted(glob.glob(os.path.join(letters_dir, "*"))):
+            if not os.path.isdir(sub_dir): continue
+            name = os.path.basename(sub_dir)
+            letter = HEBREW_LETTERS[int(name)] if name.isdigit() and int(name) < len(HEBREW_LETTERS) else name
+            if letter not in HEBREW_LETTERS: continue
+            crops = []
+            for path in sorted(glob.glob(os.path.join(sub_dir, "*"))):
+                crop = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                if crop is None: continue
+                # Crops are dark ink on light paper (as in the training data), masks are the inverse
+                mask = 255 - crop
+                ys, xs = np.nonzero(mask > 40)
+                if len(xs): crops.append(mask[ys.min():ys.max() + 1, xs.min():xs.max() + 1])
+            if crops: crops_by_letter[letter] = crops
+        if not crops_by_letter: raise ValueError(f"No letter crops found under {letters_dir}")
+        print(f"[Synthetic] Loaded crops for {len(crops_by_letter)} letters from {letters_dir}")
+        return cls(crops_by_letter=crops_by_letter)
+
+    @classmethod
+    def from_font(cls, font_path: str) -> "LetterSource":
+        return cls(font_path=font_path)
+
+    def render(self, letter: str, height: int, rng: np.random.Generator) -> np.ndarray:
+        height = max(4, int(height))
+        if letter in self.crops_by_letter:
+            crops = self.crops_by_letter[letter]
+            crop = crops[int(rng.integers(len(crops)))]
+            scale = height / crop.shape[0]
+            return cv2.resize(crop, (max(1, round(crop.shape[1] * scale)), height), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+        if self.font_path:
+            return self._render_font(letter, height)
+        return self._render_procedural(letter, height, rng)
+
+    def _render_font(self, letter, height):
+        from PIL import Image, ImageDraw, ImageFont
+        if height not in self._fonts: self._fonts[height] = ImageFont.truetype(self.font_path, size=int(height * 1.3))
+        font = self._fonts[height]
+        canvas = Image.new("L", (height * 3, height * 3), 0)
+        ImageDraw.Draw(canvas).text((height, height // 2), letter, fill=255, font=font)
+        mask = np.array(canvas)
+        ys, xs = np.nonzero(mask)
+        return mask[ys.min():ys.max() + 1, xs.min():xs.max() + 1] if len(xs) else np.zeros((height, max(1, height // 2)), np.uint8)
+
+    def _render_procedural(self, letter, height, rng):
+        # Fixed skeleton per letter (seeded by the letter), per-sample jitter from rng
+        shape_rng = np.random.default_rng(zlib.crc32(letter.encode("utf-8")))
+        glyph_h = height * (0.55 if letter in SHORT_LETTERS else 1.35 if letter in DESCENDER_LETTERS else 1.0)
+        glyph_w = height * (0.3 if letter in NARROW_LETTERS else shape_rng.uniform(0.55, 0.85))
+        thickness = max(1, round(height * 0.09))
+        pad = thickness + 1
+        canvas = np.zeros((int(glyph_h) + 2 * pad, int(glyph_w) + 2 * pad), np.uint8)
+        point = np.array([shape_rng.uniform(0, 1), 0.0])
+        for _ in range(int(shape_rng.integers(2, 4))):
+            # Each stroke starts where the previous ended, so the glyph stays one connected component
+            target = np.array([shape_rng.uniform(0, 1), shape_rng.uniform(0, 1)])
+            control = (point + target) / 2 + shape_rng.normal(0, 0.2, 2)
+            t = np.linspace(0, 1, 12)[:, None]
+            curve = (1 - t) ** 2 * point + 2 * (1 - t) * t * control + t ** 2 * target
+            curve = curve + rng.normal(0, 0.02, curve.shape)
+            pts = np.stack([pad + np.clip(curve[:, 0], 0, 1) * (glyph_w - 1), pad + np.clip(curve[:, 1], 0, 1) * (glyph_h - 1)], axis=1)
+            cv2.polylines(canvas, [np.round(pts).astype(np.int32)], False, 255, thickness, lineType=cv2.LINE_AA)
+            point = target
+        ys, xs = np.nonzero(canvas)
+        return canvas[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+class SyntheticPage:
+    def __init__(self, image: np.ndarray, lines: List[List[Dict]], settings: Dict):
+        self.image = image # BGR uint8
+        self.lines = lines # per line, letters in reading order: {"char", "box": [x, y, w, h]}, words split by {"char": " "}
+        self.settings = settings
+
+    @property
+    def text(self) -> str:
+        return "\n".join("".join(letter["char"] for letter in line) for line in self.lines)
+
+    @property
+    def letter_count(self) -> int:
+        return sum(1 for line in self.lines for letter in line if letter["char"] != " ")
+
+    def encode(self, ext: str = ".png") -> bytes:
+        """Encoded image bytes, ready for ocr_pipeline.process_image_pipeline"""
+        ok, encoded = cv2.imencode(ext, self.image)
+        if not ok: raise ValueError(f"Could not encode synthetic page as {ext}")
+        return encoded.tobytes()
+
+    def ground_truth(self) -> Dict:
+        return {"text": self.text, "width": self.image.shape[1], "height": self.image.shape[0],
+                "letter_count": self.letter_count, "settings": self.settings,
+                "lines": [[letter for letter in line if letter["char"] != " "] for line in self.lines]}
+
+    def save(self, image_path: str):
+        """Writes the image and a ground-truth JSON next to it (same name, .json)"""
+        cv2.imwrite(image_path, self.image)
+        with open(os.path.splitext(image_path)[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.ground_truth(), f, ensure_ascii=False, indent=1)
+
+def random_line_text(letters_per_line: int, rng: np.random.Generator, word_length: Sequence[int] = (2, 6)) -> str:
+    words = []; remaining = letters_per_line
+    while remaining > 0:
+        length = min(remaining, int(rng.integers(word_length[0], word_length[1] + 1)))
+        word = [NON_FINAL_LETTERS[int(i)] for i in rng.integers(len(NON_FINAL_LETTERS), size=length)]
+        word[-1] = FINAL_FORMS.get(word[-1], word[-1])
+        words.append("".join(word)); remaining -= length
+    return " ".join(words)
+
+def generate_page(num_lines: int = 10, letters_per_line: int = 30, width: int = 2268, height: int = 3302,
+                  ruled_lines: bool = True, noise: float = 0.02, seed: int = 0, letter_source: Optional[LetterSource] = None,
+                  letter_height: Optional[int] = None, lines_text: Optional[List[str]] = None, rtl: bool = True) -> SyntheticPage:
+    """
+    Composes one page. lines_text overrides the random text (one string per line, spaces
+    between words); otherwise num_lines x letters_per_line random Hebrew words are used.
+    noise is the std-dev of the Gaussian pixel noise as a fraction of full scale.
+    """
+    rng = np.random.default_rng(seed)
+    letter_source = letter_source or LetterSource()
+    if lines_text is None:
+        lines_text = [random_line_text(letters_per_line, rng) for _ in range(num_lines)]
+    num_lines = len(lines_text)
+    margin_x = int(width * 0.06); margin_y = int(height * 0.06)
+    line_pitch = (height - 2 * margin_y) / max(1, num_lines)
+    longest_line = max((len(line) for line in lines_text), default=1)
+    if letter_height is None:
+        # Letters take ~0.75 of their height in width (incl. gaps); fit both the line pitch and the longest line
+        letter_height = int(min(line_pitch * 0.45, (width - 2 * margin_x) / max(1, longest_line * 0.75), height * 0.05))
+    letter_height = max(6, int(letter_height))
+
+    paper = np.array([rng.uniform(225, 245), rng.uniform(230, 248), rng.uniform(235, 252)], np.float32)
+    image = np.empty((height, width, 3), np.float32); image[:] = paper
+    ink = np.array([rng.uniform(20, 70), rng.uniform(15, 50), rng.uniform(10, 40)], np.float32)
+    if ruled_lines:
+        rule_color = np.array([200, 170, 150], np.float32)
+        for line_idx in range(num_lines + 1):
+            y = int(margin_y + (line_idx + 0.8) * line_pitch)
+            if y < height: image[max(0, y - 1):y + 1, :] = rule_color
+
+    pages_lines = []
+    for line_idx, line_text in enumerate(lines_text):
+        baseline = margin_y + (line_idx + 0.7) * line_pitch
+        x = width - margin_x if rtl else margin_x
+        line_letters = []
+        for char in line_text:
+            if char == " ":
+                x += -letter_height * 0.9 if rtl else letter_height * 0.9
+                line_letters.append({"char": " "}); continue
+            mask = letter_source.render(char, int(letter_height * rng.uniform(0.9, 1.1)), rng)
+            mask_h, mask_w = mask.shape
+            top = int(baseline - letter_height * rng.uniform(0.95, 1.05)) if char not in DESCENDER_LETTERS else int(baseline - letter_height)
+            left = int(x - mask_w) if rtl else int(x)
+            top = max(0, min(height - mask_h, top)); left = max(0, min(width - mask_w, left))
+            region = image[top:top + mask_h, left:left + mask_w]
+            alpha = (mask.astype(np.float32) / 255.0)[..., None] * rng.uniform(0.85, 1.0)
+            region[:] = region * (1 - alpha) + ink * alpha
+            line_letters.append({"char": char, "box": [left, top, mask_w, mask_h]})
+            gap = letter_height * rng.uniform(0.15, 0.3)
+            x = left - gap if rtl else left + mask_w + gap
+        pages_lines.append(line_letters)
+
+    if noise > 0:
+        image += rng.normal(0, noise * 255.0, image.shape).astype(np.float32)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    settings = {"num_lines": num_lines, "letters_per_line": letters_per_line, "width": width, "height": height,
+                "ruled_lines": ruled_lines, "noise": noise, "seed": seed, "letter_height": letter_height}
+    return SyntheticPage(image, pages_lines, settings)
+
+def generate_pages(count: int, seed: int = 0, **page_kwargs):
+    """Yields `count` pages with consecutive seeds; keyword arguments go to generate_page"""
+    for page_idx in range(count):
+        yield generate_page(seed=seed + page_idx, **page_kwargs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic handwritten Hebrew pages with ground truth.")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--lines", type=int, default=10, help="Text lines per page")
+    parser.add_argument("--letters-per-line", type=int, default=30)
+    parser.add_argument("--width", type=int, default=2268)
+    parser.add_argument("--height", type=int, default=3302)
+    parser.add_argument("--noise", type=float, default=0.02, help="Gaussian noise std-dev as a fraction of full scale")
+    parser.add_argument("--no-ruled-lines", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--letters-dir", default=None, help="Directory of labelled letter crops (one sub-directory per letter)")
+    parser.add_argument("--font", default=None, help="TrueType font with Hebrew glyphs")
+    parser.add_argument("--out-dir", default="synthetic_pages")
+    parser.add_argument("--format", default="png", choices=["png", "jpg"])
+    args = parser.parse_args()
+
+    source = LetterSource.from_directory(args.letters_dir) if args.letters_dir else LetterSource.from_font(args.font) if args.font else LetterSource()
+    os.makedirs(args.out_dir, exist_ok=True)
+    for idx, page in enumerate(generate_pages(args.count, seed=args.seed, num_lines=args.lines, letters_per_line=args.letters_per_line,
+                                              width=args.width, height=args.height, ruled_lines=not args.no_ruled_lines,
+                                              noise=args.noise, letter_source=source)):
+        path = os.path.join(args.out_dir, f"page_{idx:03d}.{args.format}")
+        page.save(path)
+        print(f"  {path}: {page.settings['num_lines']} lines, {page.letter_count} letters")
+    print(f"✅ Wrote {args.count} page(s) to {args.out_dir}")
@@ -1,8 +1,21 @@
 # backend/text_enhancement.py
-import google.generativeai as genai
 import os
 from typing import Dict, Any, Optional
 import re
+from service_metrics import GEMINI_CALL_SECONDS, GEMINI_CALL_ERRORS
+from gemini_clients import configure_gemini, get_gemini_model, gemini_cache_key, cached_gemini_response, store_gemini_response
+from result_cache import hash_key
+
+ENHANCEMENT_MODEL_NAME = 'gemini-1.5-flash'
+ENHANCEMENT_GENERATION_CONFIG = {
+    'temperature': 0.3,  # Lower temperature for more consistent output
+    'top_p': 0.8,        # Reduce randomness
+    'top_k': 20,         # Limit token choices
+    'max_output_tokens': 2048,
+}
+# Part of the Gemini response cache key, next to a hash of the rendered prompt template; bump when the
+# prompt changes meaning without changing its text (e.g. a new model behaviour)
+ENHANCEMENT_PROMPT_VERSION = "1"
 
 def initialize_gemini():
     """Initialize Gemini API with environment variable"""
@@ -12,7 +25,7 @@ def initialize_gemini():
         return False
     
     try:
-        genai.configure(api_key=api_key)
+        configure_gemini(api_key)
         print("✅ Gemini API initialized successfully")
         return True
     except Exception as e:
@@ -159,17 +172,18 @@ def enhance_text_with_gemini(text: str, options: Dict[str, Any]) -> Optional[str
     Returns:
         Enhanced text response from Gemini or None if failed
     """
+    # Identical text + options (e.g. translation toggled off and on again) are answered from the cache.
+    # The template rendered for these options is hashed too, so an edited prompt never serves stale responses
+    cache_key = gemini_cache_key("text_enhancement", ENHANCEMENT_MODEL_NAME, ENHANCEMENT_GENERATION_CONFIG,
+                                 hash_key(ENHANCEMENT_PROMPT_VERSION, create_enhancement_prompt("", options)), text, options)
+    cached_response = cached_gemini_response(cache_key)
+    if cached_response is not None:
+        print(f"✅ Using cached Gemini response")
+        return cached_response
+
     try:
-        # Create the model with better parameters
-        model = genai.GenerativeModel(
-            'gemini-1.5-flash',
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.3,  # Lower temperature for more consistent output
-                top_p=0.8,       # Reduce randomness
-                top_k=20,        # Limit token choices
-                max_output_tokens=2048,
-            )
-        )
+        # Shared model (and connection) from the client registry
+        model = get_gemini_model(ENHANCEMENT_MODEL_NAME, ENHANCEMENT_GENERATION_CONFIG)
         
         # Generate the prompt
         prompt = create_enhancement_prompt(text, options)
@@ -179,18 +193,22 @@ def enhance_text_with_gemini(text: str, options: Dict[str, Any]) -> Optional[str
         print(f"⚙️ Options: {options}")
         
         # Generate content
-        response = model.generate_content(prompt)
+        with GEMINI_CALL_SECONDS.time(operation="text_enhancement"):
+            response = model.generate_content(prompt)
         
         if response.text:
             print(f"✅ Received response from Gemini API")
             # Clean up the response to remove any unwanted formatting
             cleaned_response = clean_gemini_output(response.text)
+            store_gemini_response(cache_key, cleaned_response)
             return cleaned_response
         else:
+            GEMINI_CALL_ERRORS.inc(operation="text_enhancement")
             print(f"❌ Empty response from Gemini API")
             return None
             
     except Exception as e:
+        GEMINI_CALL_ERRORS.inc(operation="text_enhancement")
         print(f"❌ Error calling Gemini API: {e}")
         return None
 
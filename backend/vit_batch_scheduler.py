@@ -0,0 +1,128 @@
+# backend/vit_batch_scheduler.py
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+class _ClassificationRequest:
+    """Tracks the letter crops of one submit() call until all of them are classified"""
+    def __init__(self, num_crops: int):
+        self.future = Future()
+        self.results: List[Optional[Tuple[str, float]]] = [None] * num_crops
+        self.remaining = num_crops
+        self.lock = threading.Lock()
+
+    def set_result(self, crop_idx: int, result: Tuple[str, float]):
+        with self.lock:
+            self.results[crop_idx] = result
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done and not self.future.done():
+            self.future.set_result(self.results)
+
+    def set_exception(self, exc: BaseException):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+class ViTBatchScheduler:
+    """
+    In-process dynamic batching for the ViT letter classifier.
+
+    Letter crops submitted by concurrent requests are collected into shared
+    batches of up to max_batch_size crops. A batch is dispatched as soon as it
+    is full or max_wait_ms after its first crop arrived, whichever comes first.
+    Each submit() returns a Future resolving to (label, confidence) tuples in
+    the order the crops were submitted.
+    """
+    def __init__(self, classify_fn: Callable[[List[Any]], List[Tuple[str, float]]],
+                 max_batch_size: int = 32, max_wait_ms: float = 10.0):
+        self.classify_fn = classify_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self.batches_run = 0
+        self.crops_classified = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._worker is not None and self._worker.is_alive(): return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name="vit-batch-scheduler", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        self._stopping.set()
+        self._queue.put(None) # Wake the worker up
+        if self._worker is not None:
+            self._worker.join(timeout)
+        self._worker = None
+
+    def submit(self, char_crops: Sequence[Any]) -> Future:
+        request = _ClassificationRequest(len(char_crops))
+        if not char_crops:
+            request.future.set_result([])
+            return request.future
+        if self._worker is None or not self._worker.is_alive():
+            self.start()
+        for crop_idx, crop in enumerate(char_crops):
+            self._queue.put((request, crop_idx, crop))
+        return request.future
+
+    def classify(self, char_crops: Sequence[Any], timeout: Optional[float] = None) -> List[Tuple[str, float]]:
+        return self.submit(char_crops).result(timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            "batches_run": self.batches_run,
+            "crops_classified": self.crops_classified,
+            "queued_crops": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000.0,
+        }
+
+    def _collect_batch(self):
+        first_entry = self._queue.get()
+        if first_entry is None: return []
+        batch = [first_entry]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            try:
+                # Drain whatever is already queued without waiting
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                remaining_wait = deadline - time.monotonic()
+                if remaining_wait <= 0: break
+                try: entry = self._queue.get(timeout=remaining_wait)
+                except queue.Empty: break
+            if entry is None:
+                self._stopping.set(); break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect_batch()
+            if not batch: continue
+            try:
+                results = self.classify_fn([crop for _, _, crop in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Classifier returned {len(results)} results for {len(batch)} crops")
+            except Exception as e:
+                print(f"[ViT Scheduler ERROR] Batch of {len(batch)} crops failed: {e}")
+                traceback.print_exc()
+                for request, _, _ in batch: request.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.crops_classified += len(batch)
+            for (request, crop_idx, _), result in zip(batch, results):
+                request.set_result(crop_idx, result)
+        # Fail whatever is still queued so callers do not hang on shutdown
+        while True:
+            try: entry = self._queue.get_nowait()
+            except queue.Empty: break
+            if entry is not None: entry[0].set_exception(RuntimeError("ViT batch scheduler stopped"))
@@ -0,0 +1,137 @@
+# backend/vit_onnx_backend.py
+# ONNX Runtime inference backend for the Hebrew ViT letter classifier.
+#
+# Export (run once, e.g. at image build time):
+#   python vit_onnx_backend.py --model-dir ./vit-hebrew-final --output ./vit-hebrew-final-onnx/model.onnx
+# This writes model.onnx (fp32) and, unless --no-quantize is given, model.int8.onnx
+# with dynamic int8 quantization of the weights. Select the backend at runtime with
+# VIT_INFERENCE_BACKEND=onnx (see ocr_pipeline.load_models).
+import argparse
+import os
+import sys
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_ONNX_DIR = "./vit-hebrew-final-onnx"
+ONNX_FP32_FILENAME = "model.onnx"
+ONNX_INT8_FILENAME = "model.int8.onnx"
+ONNX_OPSET_VERSION = 17
+
+def export_vit_to_onnx(model_dir: str, onnx_path: str, quantize: bool = True) -> Optional[str]:
+    """
+    Export a ViTForImageClassification checkpoint to ONNX with a dynamic batch axis.
+    When quantize is True, also writes an int8 dynamically-quantized copy next to it.
+
+    Returns:
+        Path of the model that should be served (int8 if quantized, else fp32), or None on failure
+    """
+    try:
+        import torch
+        from transformers import ViTForImageClassification
+    except ImportError as e:
+        print(f"[ONNX Export ERROR] torch/transformers are required for export: {e}")
+        return None
+
+    class _LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).logits
+
+    model = ViTForImageClassification.from_pretrained(model_dir)
+    model.eval()
+    image_size = getattr(model.config, 'image_size', 224)
+    num_channels = getattr(model.config, 'num_channels', 3)
+    dummy_input = torch.zeros(1, num_channels, image_size, image_size, dtype=torch.float32)
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    print(f"[ONNX Export] Exporting {model_dir} -> {onnx_path} (opset {ONNX_OPSET_VERSION})...")
+    with torch.no_grad():
+        torch.onnx.export(
+            _LogitsOnly(model).eval(), (dummy_input,), onnx_path,
+            input_names=["pixel_values"], output_names=["logits"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=ONNX_OPSET_VERSION,
+            dynamo=False, # TorchScript exporter: keeps dynamic_axes and quantizes cleanly
+        )
+    if not quantize:
+        return onnx_path
+
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError as e:
+        print(f"[ONNX Export WARNING] onnxruntime quantization not available, keeping fp32 model only: {e}")
+        return onnx_path
+    int8_path = os.path.join(os.path.dirname(os.path.abspath(onnx_path)), ONNX_INT8_FILENAME)
+    print(f"[ONNX Export] Quantizing weights to int8 -> {int8_path}...")
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+class _OnnxViTOutput:
+    def __init__(self, logits):
+        self.logits = logits
+
+class OnnxViTClassifier:
+    """
+    Drop-in replacement for ViTForImageClassification at inference time.
+
+    Exposes the pieces ocr_pipeline relies on (config.id2label, device, eval(),
+    to() and calling with pixel_values returning an object with .logits) while
+    running the forward pass through ONNX Runtime. The label mapping is read from
+    the original checkpoint's config.json so it stays identical to the PyTorch path.
+    """
+    def __init__(self, onnx_path: str, model_dir: str, intra_op_threads: int = 0):
+        import onnxruntime as ort
+        import torch
+        from transformers import ViTConfig
+
+        self._torch = torch
+        self.config = ViTConfig.from_pretrained(model_dir)
+        self.device = torch.device("cpu")
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            session_options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.onnx_path = onnx_path
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self # ONNX Runtime CPU session, device placement is fixed
+
+    def __call__(self, pixel_values=None, **kwargs):
+        if isinstance(pixel_values, self._torch.Tensor):
+            pixel_values = pixel_values.detach().cpu().numpy()
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        logits = self.session.run(None, {self.input_name: pixel_values})[0]
+        return _OnnxViTOutput(self._torch.from_numpy(logits))
+
+def resolve_onnx_model_path(onnx_dir: str, prefer_int8: bool = True) -> Optional[str]:
+    # Picks the int8 model when present (and preferred), otherwise the fp32 export.
+    candidates = [ONNX_INT8_FILENAME, ONNX_FP32_FILENAME] if prefer_int8 else [ONNX_FP32_FILENAME]
+    for filename in candidates:
+        path = os.path.join(onnx_dir, filename)
+        if os.path.exists(path): return path
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the Hebrew ViT classifier to ONNX (optionally int8-quantized).")
+    parser.add_argument("--model-dir", default=None,
+                        help="Hugging Face checkpoint directory (default: the model version ocr_pipeline loads, see resolve_vit_model_path)")
+    parser.add_argument("--output", default=os.path.join(DEFAULT_ONNX_DIR, ONNX_FP32_FILENAME), help="Path of the fp32 ONNX file to write")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip dynamic int8 quantization")
+    args = parser.parse_args()
+
+    if args.model_dir is None:
+        from ocr_pipeline import resolve_vit_model_path
+        args.model_dir, _ = resolve_vit_model_path()
+        if args.model_dir is None: sys.exit(1)
+    served_path = export_vit_to_onnx(args.model_dir, args.output, quantize=not args.no_quantize)
+    if served_path is None:
+        sys.exit(1)
+    print(f"✅ ONNX export complete. Model to serve: {served_path}")